@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 import sys
 from dotenv import load_dotenv
@@ -6,6 +7,7 @@ from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from utils import setup_logger, validate_env_vars
 from slack_handler import SlackHandler
+from config_watcher import ConfigWatcher
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +19,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _async_mode_enabled():
+    """Check if the asyncio pipeline (AsyncApp + async Socket Mode) was requested"""
+    return os.environ.get("SLACK_ASYNC_MODE", "").lower() in ("1", "true", "yes")
+
+def _start_config_watcher(slack_handler):
+    """Reload the agent in-process when the flow changes on disk, unless FLOW_HOT_RELOAD=0"""
+    if os.environ.get("FLOW_HOT_RELOAD", "1").lower() in ("0", "false", "no"):
+        return
+    # settings.json isn't watched: nothing the running agent builds is read from it
+    flow_manager = slack_handler.langchain_manager.flow_manager
+    ConfigWatcher(
+        [flow_manager.flow_path],
+        slack_handler.langchain_manager.reload_configuration
+    ).start()
+
+async def async_main():
+    """Run the bot on AsyncApp so one process serves many conversations without a thread each"""
+    from slack_bolt.async_app import AsyncApp
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+    from async_slack_handler import AsyncSlackHandler
+    
+    try:
+        app = AsyncApp(token=os.environ.get("SLACK_BOT_TOKEN"), logger=logger)
+        auth_test = await app.client.auth_test()
+        logger.info(f"Bot connected as: {auth_test['bot_id']} with name: {auth_test.get('user')}")
+    except Exception as e:
+        logger.error(f"Error connecting to Slack: {e}")
+        logger.error("Please check your SLACK_BOT_TOKEN and make sure it has the correct scopes")
+        return
+    
+    try:
+        slack_handler = AsyncSlackHandler(app)
+        logger.info("AsyncSlackHandler initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize AsyncSlackHandler: {e}")
+        return
+    
+    _start_config_watcher(slack_handler)
+    
+    try:
+        handler = AsyncSocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
+        logger.info("⚡️ LangChain Slackbot is running (async mode)!")
+        await handler.start_async()
+    except Exception as e:
+        logger.error(f"Error starting AsyncSocketModeHandler: {e}")
+        logger.error("Please check your SLACK_APP_TOKEN and make sure it has the correct scopes")
+
 def main():
     # Validate environment variables
     try:
@@ -28,6 +77,10 @@ def main():
         logger.error(str(e))
         return
     
+    if _async_mode_enabled():
+        asyncio.run(async_main())
+        return
+    
     # Initialize the Slack app with more detailed logging
     try:
         app = App(token=os.environ.get("SLACK_BOT_TOKEN"), logger=logger)
@@ -55,6 +108,9 @@ def main():
         logger.error(f"Failed to initialize SlackHandler: {e}")
         return
     
+    # Reload the agent in-process when the flow or settings change on disk
+    _start_config_watcher(slack_handler)
+    
     # Start the app using Socket Mode
     try:
         handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
@@ -0,0 +1,139 @@
+import logging
+from rate_limiter import PRIORITY_DIRECT, PRIORITY_MENTION, ServiceBusyError
+from retrieval_service import SlackContext
+from slack_handler import BUSY_MESSAGE, SlackHandler
+from slack_streamer import AsyncSlackMessageStreamer
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class AsyncSlackHandler(SlackHandler):
+    """Handles Slack events on an AsyncApp, one coroutine per request instead of one thread"""
+
+    def register_handlers(self):
+        """Register all event handlers with the async Slack app"""
+        self.app.event("message")(self.handle_message)
+        self.app.event("app_mention")(self.handle_mention)
+
+        logger.info("Registered async event handlers: message, app_mention")
+
+    async def _reset_command(self, args: str, context: Dict[str, Any]) -> str:
+        """Handler for the reset command, waiting for the conversation's in-flight turn"""
+        conversation_key = f"{context['channel_id']}:{context['user_id']}"
+        if await self.langchain_manager.areset_conversation(conversation_key):
+            return "Conversation has been reset."
+        return "Failed to reset conversation."
+
+    async def _arun_command(self, text: str, channel_id: str, user_id: str) -> Tuple[bool, Optional[str]]:
+        """Async version of _run_command"""
+        parsed = self._parse_command(text, channel_id, user_id)
+        if parsed is None:
+            return False, None
+        return True, await self.command_handler.ahandle_command(*parsed)
+
+    async def _stream_reply(self, channel_id: str, conversation_key: str, text: str, priority: int,
+                            context: Optional[SlackContext] = None):
+        """Post a placeholder and edit it as tokens arrive"""
+        streamer = AsyncSlackMessageStreamer(self.app.client, channel_id)
+        await streamer.start()
+        response = None
+        try:
+            async for response in self.langchain_manager.astream_response(conversation_key, text, priority, context):
+                await streamer.update(response)
+        except ServiceBusyError as e:
+            logger.warning(f"Too busy to answer: {e}")
+            response = BUSY_MESSAGE
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            response = "I'm having trouble processing your request. Please try again later."
+        await streamer.finish(response or "I'm sorry, I couldn't generate a response. Please try again.")
+
+    async def handle_message(self, body: Dict[str, Any], logger: logging.Logger):
+        """Handle direct messages to the bot"""
+        event = body["event"]
+
+        # Skip messages from the bot itself
+        if event.get("bot_id"):
+            return
+
+        # Only respond to direct messages
+        if event.get("channel_type") != "im":
+            return
+
+        channel_id = event["channel"]
+        user_id = event["user"]
+        text = event["text"]
+        conversation_key = f"{channel_id}:{user_id}"
+
+        # Check if this is a command
+        is_command, response = await self._arun_command(text, channel_id, user_id)
+
+        if is_command:
+            if response:
+                await self.app.client.chat_postMessage(channel=channel_id, text=response)
+            return
+
+        slack_context = self._slack_context(body)
+        try:
+            if self.streaming:
+                await self._stream_reply(channel_id, conversation_key, text, PRIORITY_DIRECT, slack_context)
+                return
+
+            response = await self.langchain_manager.agenerate_response(conversation_key, text, PRIORITY_DIRECT,
+                                                                       slack_context)
+
+            if response is None:
+                logger.warning("Agent returned None response")
+                response = "I'm sorry, I couldn't generate a response. Please try again."
+            await self.app.client.chat_postMessage(channel=channel_id, text=response)
+        except ServiceBusyError as e:
+            logger.warning(f"Too busy to answer: {e}")
+            await self.app.client.chat_postMessage(channel=channel_id, text=BUSY_MESSAGE)
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            await self.app.client.chat_postMessage(
+                channel=channel_id,
+                text="I'm having trouble processing your request. Please try again later."
+            )
+
+    async def handle_mention(self, body: Dict[str, Any], say):
+        """Handle mentions of the bot in channels"""
+        try:
+            event = body["event"]
+            channel_id = event["channel"]
+            user_id = event["user"]
+            text = self._strip_mention(event["text"])
+            conversation_key = f"{channel_id}:{user_id}"
+
+            # Check if this is a command
+            is_command, response = await self._arun_command(text, channel_id, user_id)
+
+            if is_command:
+                if response:
+                    await say(response)
+                return
+
+            slack_context = self._slack_context(body)
+            try:
+                if self.streaming:
+                    await self._stream_reply(channel_id, conversation_key, text, PRIORITY_MENTION, slack_context)
+                    return
+
+                response = await self.langchain_manager.agenerate_response(
+                    conversation_key, text, PRIORITY_MENTION, slack_context
+                )
+
+                if response is None:
+                    logger.warning("Agent returned None response")
+                    await say("I'm sorry, I couldn't generate a response. Please try again.")
+                else:
+                    await say(response)
+            except ServiceBusyError as e:
+                logger.warning(f"Too busy to answer: {e}")
+                await say(BUSY_MESSAGE)
+            except Exception as e:
+                logger.error(f"Error processing mention: {e}")
+                await say("I'm having trouble processing your request. Please try again later.")
+        except Exception as e:
+            logger.error(f"Error handling mention: {e}")
+            await say("Sorry, I encountered an error while processing your mention.")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark vector-only against hybrid (vector + BM25) retrieval on identifier lookups
+
+Each synthetic incident chunk mentions one ticket number among ordinary
+runbook words. The fake embeddings are random projections of word counts, so
+a ticket number is a small part of a chunk's vector, much like with real
+embeddings. Embedding requests sleep for a fixed round trip.
+
+Usage:
+    python benchmarks/bench_hybrid_retrieval.py [--chunks 2000] [--queries 200] [--embed-latency 0.05]
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from embedding_service import EmbeddingService  # noqa: E402
+from lexical_index import tokenize  # noqa: E402
+from pinecone_manager import PineconeManager  # noqa: E402
+
+WORDS = ("deploy rollback incident runbook latency cache index shard replica region quota alert "
+         "owner service pipeline schema migration backup restore token budget retry timeout").split()
+DIMENSION = 256
+
+
+class FakeEmbeddings:
+    """Bag-of-words random projection with a fixed round trip per request"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    def _vector(self, text):
+        vector = np.zeros(DIMENSION)
+        for term in tokenize(text):
+            seed = int.from_bytes(hashlib.sha1(term.encode()).digest()[:4], "little")
+            vector += np.random.default_rng(seed).standard_normal(DIMENSION)
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+def make_chunks(count, seed=7):
+    rng = random.Random(seed)
+    return [
+        (f"INC-{1000 + i}", " ".join(rng.choice(WORDS) for _ in range(60)) + f" see INC-{1000 + i} for details.")
+        for i in range(count)
+    ]
+
+
+def run(manager, questions, embeddings):
+    hits = 0
+    embeddings.requests = 0
+    started = time.perf_counter()
+    for ticket, question in questions:
+        results = manager.query(question, top_k=3)
+        hits += any(ticket in result["text"] for result in results)
+    elapsed = time.perf_counter() - started
+    return hits / len(questions), elapsed / len(questions) * 1000, embeddings.requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hybrid retrieval")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding request")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks)
+    rng = random.Random(11)
+    sample = rng.sample(chunks, args.queries)
+    question_sets = {
+        "ticket only": [(ticket, ticket) for ticket, _ in sample],
+        "question with ticket": [(ticket, f"what was the rollback plan for {ticket}?") for ticket, _ in sample],
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        embeddings = FakeEmbeddings(args.embed_latency)
+        # The cache is off so every question pays for its embedding
+        service = EmbeddingService(client=embeddings, path=None, max_entries=0, batch_window_ms=0)
+        texts = [text for _, text in chunks]
+        vectors = service.embed_documents(texts)
+        PineconeManager(embedding_service=service, provider="local", index_name="bench",
+                        local_path=directory).upsert_vectors([
+            {"id": str(i), "values": vector, "metadata": {"text": text}}
+            for i, (text, vector) in enumerate(zip(texts, vectors))
+        ])
+        managers = {
+            mode: PineconeManager(embedding_service=service, provider="local", index_name="bench",
+                                  local_path=directory, retrieval=mode)
+            for mode in ("vector", "hybrid")
+        }
+
+        print(f"{args.chunks} chunks, {args.queries} questions, {args.embed_latency * 1000:.0f} ms per embedding\n")
+        print(f"{'questions':<24}{'retrieval':>10}{'hit@3':>8}{'ms/query':>10}{'embeds':>8}")
+        for label, questions in question_sets.items():
+            for mode, manager in managers.items():
+                hit_rate, latency, requests = run(manager, questions, embeddings)
+                print(f"{label:<24}{mode:>10}{hit_rate:>8.2f}{latency:>10.1f}{requests:>8}")
+
+        metrics = managers["hybrid"].metrics()
+        print("\nhybrid stage p50 (ms): " + ", ".join(
+            f"{stage} {metrics[f'{stage}_p50'] * 1000:.2f}"
+            for stage in ("embed", "vector", "lexical", "fusion", "total") if metrics[f"{stage}_p50"] is not None
+        ))
+
+
+if __name__ == "__main__":
+    main()
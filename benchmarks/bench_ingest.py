@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark document ingestion throughput against simulated embedding and Pinecone latencies
+
+Compares the original upload_document loop (a new embeddings client and one
+embedding + one upsert call per document, no chunking) with IngestionPipeline
+over a synthetic corpus. The fakes sleep for a fixed round trip plus a small
+per-item cost, so the numbers reflect request counts and concurrency rather
+than network conditions.
+
+Usage:
+    python benchmarks/bench_ingest.py [--files 200] [--kb-per-file 8] [--workers 2]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from embedding_service import EmbeddingService  # noqa: E402
+from ingestion import IngestCheckpoint, IngestionPipeline, iter_files  # noqa: E402
+from pinecone_manager import PineconeManager  # noqa: E402
+
+WORDS = ("deploy rollback incident runbook latency cache index shard replica region quota alert "
+         "owner service pipeline schema migration backup restore token budget retry timeout").split()
+
+
+class FakeEmbeddings:
+    """Embeddings API: one round trip per request plus a little per text"""
+
+    def __init__(self, round_trip, per_text, dimension=8):
+        self.round_trip = round_trip
+        self.per_text = per_text
+        self.dimension = dimension
+        self.requests = 0
+
+    def embed_documents(self, texts):
+        self.requests += 1
+        time.sleep(self.round_trip + self.per_text * len(texts))
+        return [[float(len(text) % 97)] * self.dimension for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeIndex:
+    """Pinecone index: one round trip per upsert plus a little per vector"""
+
+    def __init__(self, round_trip, per_vector):
+        self.round_trip = round_trip
+        self.per_vector = per_vector
+        self.requests = 0
+        self.vectors = {}
+
+    def upsert(self, vectors):
+        self.requests += 1
+        time.sleep(self.round_trip + self.per_vector * len(vectors))
+        for vector in vectors:
+            self.vectors[vector["id"]] = vector
+
+
+def make_corpus(directory, files, kb_per_file, seed=7):
+    rng = random.Random(seed)
+    for i in range(files):
+        paragraphs = []
+        size = 0
+        while size < kb_per_file * 1024:
+            paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + "."
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 2
+        (Path(directory) / f"doc_{i:04d}.md").write_text("\n\n".join(paragraphs))
+
+
+def make_manager(args):
+    manager = PineconeManager(embedding_service=EmbeddingService(
+        client=FakeEmbeddings(args.embed_latency, args.embed_per_text), path=None, batch_window_ms=0
+    ))
+    manager.index = FakeIndex(args.upsert_latency, args.upsert_per_vector)
+    return manager
+
+
+def legacy_upload(directory, args):
+    """The original loop: every document is one embedding request and one upsert"""
+    index = FakeIndex(args.upsert_latency, args.upsert_per_vector)
+    started = time.perf_counter()
+    for i, file in enumerate(iter_files([directory])):
+        text = file.read_text()
+        # A new client per call, and the whole document as a single vector
+        embeddings = FakeEmbeddings(args.embed_latency, args.embed_per_text)
+        vector = embeddings.embed_query(text)
+        index.upsert(vectors=[{"id": str(i), "values": vector, "metadata": {"text": text[:1000]}}])
+    return time.perf_counter() - started, len(index.vectors), index.requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document ingestion")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--kb-per-file", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2, help="Parsing processes for the pipeline")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--embed-per-text", type=float, default=0.0002)
+    parser.add_argument("--upsert-latency", type=float, default=0.03, help="Seconds per upsert request")
+    parser.add_argument("--upsert-per-vector", type=float, default=0.00005)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_corpus(directory, args.files, args.kb_per_file)
+        print(f"{args.files} files, {args.kb_per_file} KB each\n")
+        print(f"{'loader':<30}{'seconds':>9}{'vectors':>9}{'upserts':>9}{'files/s':>9}{'chunks/s':>10}")
+
+        seconds, vectors, upserts = legacy_upload(directory, args)
+        print(f"{'legacy upload_document':<30}{seconds:>9.2f}{vectors:>9}{upserts:>9}"
+              f"{args.files / seconds:>9.1f}{'-':>10}")
+
+        for label, workers in (("pipeline (in-process parse)", 0), (f"pipeline ({args.workers} workers)", args.workers)):
+            manager = make_manager(args)
+            pipeline = IngestionPipeline(manager, concurrency=args.concurrency, workers=workers,
+                                         checkpoint=IngestCheckpoint())
+            stats = pipeline.run([directory])
+            print(f"{label:<30}{stats.elapsed:>9.2f}{stats.vectors:>9}{manager.index.requests:>9}"
+                  f"{stats.files / stats.elapsed:>9.1f}{stats.chunks_per_second:>10.0f}")
+
+        # A second run over an unchanged corpus is answered by the checkpoint
+        checkpoint = IngestCheckpoint(Path(directory) / "checkpoint.json")
+        manager = make_manager(args)
+        IngestionPipeline(manager, concurrency=args.concurrency, workers=0, checkpoint=checkpoint).run([directory])
+        stats = IngestionPipeline(manager, concurrency=args.concurrency, workers=0,
+                                  checkpoint=IngestCheckpoint(checkpoint.path)).run([directory])
+        print(f"{'resume, nothing changed':<30}{stats.elapsed:>9.2f}{stats.vectors:>9}{'':>9}"
+              f"{'':>9}{'skipped ' + str(stats.skipped):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark intent routing: per-message cost and precision/recall on a labelled set
+
+Compares the original keyword heuristics (_might_need_tools / _might_need_rag)
+with IntentRouter, with and without the naive Bayes fallback classifier.
+
+Usage:
+    python benchmarks/bench_router.py [--labels benchmarks/data/router_labels.jsonl] [--repeat 200]
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flow_compiler import RouterSpec  # noqa: E402
+from intent_router import ROUTES, IntentRouter, NaiveBayesIntentClassifier  # noqa: E402
+
+
+def legacy_might_need_tools(text):
+    """The heuristic IntentRouter replaced, kept verbatim for comparison"""
+    tool_keywords = [
+        "weather", "temperature", "forecast",
+        "wikipedia", "information", "search",
+        "time", "date", "current time", "schedule", "meeting"
+    ]
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in tool_keywords)
+
+
+def legacy_might_need_rag(text):
+    rag_keywords = [
+        "knowledge", "document", "information", "data",
+        "find", "search", "lookup", "retrieve", "get",
+        "what do you know about", "tell me about", "do you know",
+        "can you tell me", "what is", "who is", "when is", "where is",
+        "how does", "why does", "explain", "describe",
+        "framework", "library", "tool", "technology", "platform",
+        "language", "concept", "theory", "approach", "methodology",
+        "company", "organization", "person", "event", "history"
+    ]
+    text_lower = text.lower()
+    if any(keyword in text_lower for keyword in rag_keywords):
+        return True
+    if text_lower.startswith(("what", "who", "when", "where", "why", "how")):
+        return True
+    if len(text_lower.split()) > 5:
+        return True
+    return False
+
+
+def legacy_route(text):
+    return {"tools": legacy_might_need_tools(text), "rag": legacy_might_need_rag(text)}
+
+
+def router_route(router):
+    def route(text):
+        decision = router.route(text)
+        return {"tools": decision.use_tools, "rag": decision.use_rag}
+    return route
+
+
+def load_labels(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(route, examples):
+    """Precision/recall per route, plus how often a message was sent anywhere it didn't need"""
+    counts = {r: {"tp": 0, "fp": 0, "fn": 0} for r in ROUTES}
+    over_routed = 0
+    for example in examples:
+        predicted = route(example["text"])
+        expected = set(example["routes"])
+        for r in ROUTES:
+            if predicted[r] and r in expected:
+                counts[r]["tp"] += 1
+            elif predicted[r]:
+                counts[r]["fp"] += 1
+            elif r in expected:
+                counts[r]["fn"] += 1
+        over_routed += any(predicted[r] and r not in expected for r in ROUTES)
+
+    report = {}
+    for r, c in counts.items():
+        precision = c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else 1.0
+        recall = c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else 1.0
+        report[r] = (precision, recall)
+    return report, over_routed / len(examples)
+
+
+def time_per_message(route, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            route(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent routing")
+    parser.add_argument("--labels", default=str(Path(__file__).parent / "data" / "router_labels.jsonl"))
+    parser.add_argument("--repeat", type=int, default=200, help="Passes over the set for timing")
+    args = parser.parse_args()
+
+    examples = load_labels(args.labels)
+    # Train the classifier on one half and evaluate everything on the other
+    train, held_out = examples[::2], examples[1::2]
+    classifier = NaiveBayesIntentClassifier((e["text"], set(e["routes"])) for e in train)
+
+    candidates = [
+        ("legacy heuristics", legacy_route),
+        ("IntentRouter", router_route(IntentRouter(RouterSpec()))),
+        ("IntentRouter + classifier", router_route(IntentRouter(RouterSpec(), classifier))),
+    ]
+
+    print(f"{len(held_out)} held-out messages ({len(train)} used to train the classifier)\n")
+    print(f"{'router':<28}{'us/msg':>8}{'tools P/R':>14}{'rag P/R':>14}{'over-routed':>13}")
+    for name, route in candidates:
+        cost = time_per_message(route, [e["text"] for e in held_out], args.repeat)
+        report, over_routed = evaluate(route, held_out)
+        tools, rag = report["tools"], report["rag"]
+        print(f"{name:<28}{cost:>8.1f}{tools[0]:>8.2f}/{tools[1]:.2f}{rag[0]:>8.2f}/{rag[1]:.2f}{over_routed:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark the local vector index: query latency and size on disk by index size and quantization
+
+Usage:
+    python benchmarks/bench_vector_index.py [--sizes 1000 5000 20000] [--dimension 1536] [--queries 100]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vector_store import QUANTIZATIONS, LocalVectorIndex  # noqa: E402
+
+
+def build(path, vectors, quantization, batch=1000):
+    index = LocalVectorIndex(path, quantization)
+    for start in range(0, len(vectors), batch):
+        index.upsert([
+            {"id": str(i), "values": vectors[i], "metadata": {"text": f"chunk {i}"}}
+            for i in range(start, min(start + batch, len(vectors)))
+        ])
+    return index
+
+
+def recall_at_k(index, exact, queries, k):
+    """Share of the exact float64 top k the index returns"""
+    hits = 0
+    for query, expected in zip(queries, exact):
+        found = {int(match["id"]) for match in index.query(query, top_k=k)["matches"]}
+        hits += len(found & set(expected))
+    return hits / (len(queries) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local vector index")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"{'vectors':>8}{'storage':>9}{'MB':>8}{'ms/query':>10}{'recall@k':>10}")
+    for size in args.sizes:
+        vectors = rng.standard_normal((size, args.dimension)).astype(np.float32)
+        # Queries near stored vectors, like a question close to a chunk
+        queries = vectors[rng.integers(0, size, args.queries)] + rng.normal(0, 0.5, (args.queries, args.dimension))
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        exact = [np.argsort(-(normalized @ query))[:args.top_k] for query in queries]
+
+        for quantization in QUANTIZATIONS:
+            with tempfile.TemporaryDirectory() as directory:
+                index = build(directory, vectors, quantization)
+                index.query(queries[0], top_k=args.top_k)
+                started = time.perf_counter()
+                for query in queries:
+                    index.query(query, top_k=args.top_k)
+                latency = (time.perf_counter() - started) / len(queries) * 1000
+                megabytes = len(index) * args.dimension * (1 if quantization == "int8" else 4) / 1e6
+                recall = recall_at_k(index, exact, queries, args.top_k)
+                print(f"{size:>8}{quantization:>9}{megabytes:>8.1f}{latency:>10.2f}{recall:>10.2f}")
+                index.close()
+
+
+if __name__ == "__main__":
+    main()
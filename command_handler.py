@@ -1,3 +1,4 @@
+import inspect
 import logging
 from typing import Dict, Callable, Any, Optional
 
@@ -46,6 +47,22 @@ class CommandHandler:
         
         return None
     
+    async def ahandle_command(self, command: str, args: str, context: Dict[str, Any]) -> Optional[str]:
+        """Async version of handle_command; handlers may be coroutine functions"""
+        command = command.lower()
+        
+        if command in self.commands:
+            try:
+                response = self.commands[command]["handler"](args, context)
+                if inspect.isawaitable(response):
+                    response = await response
+                return response
+            except Exception as e:
+                logger.error(f"Error executing command '{command}': {e}")
+                return f"Error executing command: {str(e)}"
+        
+        return None
+    
     def _help_command(self, args: str, context: Dict[str, Any]) -> str:
         """Handler for the help command"""
         help_text = "Available commands:\n"
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Config Watcher - Watches the flow/settings files and triggers an in-process reload
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("config_watcher")
+
+
+class ConfigWatcher:
+    """Calls a reload callback when any of the watched files changes
+
+    Uses inotify (via the optional ``inotify_simple`` package) on the parent
+    directories so atomic save-by-rename from editors is picked up, and falls
+    back to polling os.stat() when inotify is not available.
+    """
+
+    def __init__(self, paths: Iterable[Path], on_change: Callable[[], object],
+                 debounce: float = 0.5, poll_interval: float = 1.0):
+        self.paths = [Path(p).resolve() for p in paths]
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.mode: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ConfigWatcher":
+        """Start watching in a daemon thread"""
+        if self._thread is not None:
+            return self
+
+        target = self._run_polling
+        try:
+            import inotify_simple  # noqa: F401
+            target = self._run_inotify
+            self.mode = "inotify"
+        except ImportError:
+            logger.info("inotify_simple not installed, polling config files for changes")
+            self.mode = "polling"
+
+        self._thread = threading.Thread(target=target, name="config-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {[str(p) for p in self.paths]} ({self.mode})")
+        return self
+
+    def stop(self):
+        """Stop the watcher thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _fire(self):
+        """Invoke the callback, never letting an error kill the watcher"""
+        try:
+            self.on_change()
+        except Exception as e:
+            logger.error(f"Error reloading configuration: {e}")
+
+    def _run_inotify(self):
+        """Block on inotify events for the watched directories"""
+        from inotify_simple import INotify, flags
+
+        inotify = INotify()
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE
+        watched: Dict[int, Path] = {}
+        for directory in {p.parent for p in self.paths}:
+            if directory.exists():
+                watched[inotify.add_watch(str(directory), mask)] = directory
+        names = {(p.parent, p.name) for p in self.paths}
+
+        try:
+            while not self._stop.is_set():
+                events = inotify.read(timeout=int(self.poll_interval * 1000))
+                if not any((watched.get(e.wd), e.name) in names for e in events):
+                    continue
+                # Swallow the burst of events a single save produces
+                time.sleep(self.debounce)
+                inotify.read(timeout=0)
+                self._fire()
+        finally:
+            inotify.close()
+
+    def _stat_all(self) -> Tuple[Optional[Tuple[int, int, int]], ...]:
+        """Return (mtime, size, inode) for each watched path, None if missing"""
+        keys = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                keys.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except FileNotFoundError:
+                keys.append(None)
+        return tuple(keys)
+
+    def _run_polling(self):
+        """Poll os.stat() on the watched files"""
+        last = self._stat_all()
+        while not self._stop.wait(self.poll_interval):
+            current = self._stat_all()
+            if current == last:
+                continue
+            # Wait until the file stops changing before reloading
+            time.sleep(self.debounce)
+            last = self._stat_all()
+            self._fire()
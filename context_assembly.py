@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Context Assembly - Deduplicates, compresses and budgets knowledge base results before they go into a prompt
+"""
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Set
+
+from conversation_memory import TokenCounter
+from lexical_index import tokenize
+
+logger = logging.getLogger("context_assembly")
+
+DEFAULT_MAX_TOKENS = 1500
+DEFAULT_DEDUP_THRESHOLD = 0.85
+# A chunk is only cut to fit the budget if at least this much of it fits
+MIN_PARTIAL_TOKENS = 50
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def _split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    return dot / (math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values())))
+
+
+@dataclass
+class AssembledContext:
+    """The results to put in the prompt, and what assembling them saved"""
+    results: List[Dict[str, Any]]
+    tokens_before: int
+    tokens_after: int
+    duplicates: int = 0
+    trimmed: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class ContextAssembler:
+    """Turns ranked knowledge base results into the context of a RAG prompt
+
+    In rank order: a chunk whose words (as a term-frequency vector) have
+    cosine similarity of at least dedup_threshold with a chunk already
+    kept is dropped as a near duplicate; with extract_sentences, a chunk is
+    reduced to the sentences that share a term with the question (chunks
+    sharing none were found by meaning and are kept whole); and chunks are
+    added until max_tokens, the last one cut at a sentence boundary if
+    enough of it fits. Comparing words rather than embeddings needs no
+    extra API call. Token counts before and after are logged per request
+    and summed in metrics().
+    """
+
+    def __init__(self, counter: TokenCounter, max_tokens: int = DEFAULT_MAX_TOKENS,
+                 dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD, extract_sentences: bool = False):
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.extract_sentences = extract_sentences
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "tokens_before": 0, "tokens_after": 0, "duplicates": 0, "trimmed": 0}
+
+    @classmethod
+    def from_env(cls, counter: TokenCounter) -> "ContextAssembler":
+        """Configured by RAG_CONTEXT_MAX_TOKENS (0 for no budget), RAG_CONTEXT_DEDUP_THRESHOLD
+        and RAG_CONTEXT_EXTRACT_SENTENCES"""
+        return cls(
+            counter,
+            max_tokens=int(os.environ.get("RAG_CONTEXT_MAX_TOKENS", DEFAULT_MAX_TOKENS)),
+            dedup_threshold=float(os.environ.get("RAG_CONTEXT_DEDUP_THRESHOLD", DEFAULT_DEDUP_THRESHOLD)),
+            extract_sentences=os.environ.get("RAG_CONTEXT_EXTRACT_SENTENCES", "").lower() in ("1", "true", "yes"),
+        )
+
+    def assemble(self, question: str, results: Sequence[Dict[str, Any]]) -> AssembledContext:
+        tokens_before = sum(self.counter.count(result.get("text", "")) for result in results)
+        question_terms = set(tokenize(question))
+
+        kept: List[Dict[str, Any]] = []
+        kept_terms: List[Counter] = []
+        duplicates = trimmed = used = 0
+        for result in results:
+            text = result.get("text", "")
+            terms = Counter(tokenize(text))
+            if any(_cosine(terms, other) >= self.dedup_threshold for other in kept_terms):
+                duplicates += 1
+                continue
+
+            if self.extract_sentences and question_terms:
+                text = self._relevant_sentences(text, question_terms)
+
+            tokens = self.counter.count(text)
+            if self.max_tokens and used + tokens > self.max_tokens:
+                trimmed += 1
+                text = self._fit(text, self.max_tokens - used)
+                if not text:
+                    continue
+                tokens = self.counter.count(text)
+
+            kept.append({**result, "text": text})
+            kept_terms.append(terms)
+            used += tokens
+
+        context = AssembledContext(kept, tokens_before, used, duplicates, trimmed)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["tokens_before"] += tokens_before
+            self.stats["tokens_after"] += used
+            self.stats["duplicates"] += duplicates
+            self.stats["trimmed"] += trimmed
+        logger.info(f"RAG context: {tokens_before} -> {used} tokens ({context.tokens_saved} saved, "
+                    f"{duplicates} duplicates dropped, {trimmed} chunks trimmed)")
+        return context
+
+    def _relevant_sentences(self, text: str, question_terms: Set[str]) -> str:
+        sentences = _split_sentences(text)
+        relevant = [sentence for sentence in sentences if question_terms.intersection(tokenize(sentence))]
+        # A chunk that shares no words with the question was found by meaning; keep all of it
+        return " ".join(relevant) if relevant else text
+
+    def _fit(self, text: str, budget: int) -> str:
+        """The leading sentences of text that fit in budget tokens, or "" if too little fits"""
+        if budget < MIN_PARTIAL_TOKENS:
+            return ""
+        fitted: List[str] = []
+        used = 0
+        for sentence in _split_sentences(text):
+            tokens = self.counter.count(sentence)
+            if used + tokens > budget:
+                break
+            fitted.append(sentence)
+            used += tokens
+        if not fitted:
+            # A single sentence longer than the budget; cut it in proportion, at a word
+            cut = len(text) * budget // max(self.counter.count(text), 1)
+            return text[:cut].rsplit(" ", 1)[0]
+        return " ".join(fitted)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        saved = stats["tokens_before"] - stats["tokens_after"]
+        return {
+            **stats,
+            "tokens_saved": saved,
+            "saved_ratio": saved / stats["tokens_before"] if stats["tokens_before"] else 0.0,
+        }
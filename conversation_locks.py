@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Conversation Locks - Runs each conversation's requests one at a time, in arrival order
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Set
+
+
+class _TicketLock:
+    """FIFO lock state for one key: requests take a ticket and wait until it is served"""
+    __slots__ = ("abandoned", "condition", "next_ticket", "serving", "users")
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.next_ticket = 0
+        self.serving = 0
+        self.users = 0
+        # Tickets whose waiter was interrupted before being served
+        self.abandoned: Set[int] = set()
+
+    def advance(self):
+        """Serve the next ticket, skipping any whose waiter has gone; call with condition held"""
+        self.serving += 1
+        while self.serving in self.abandoned:
+            self.abandoned.discard(self.serving)
+            self.serving += 1
+
+
+class ConversationLocks:
+    """Per-conversation FIFO locks for threaded handlers
+
+    A key only has a lock while a request holds or waits for it, so memory
+    stays proportional to in-flight conversations. The registry mutex is held
+    just long enough to take a ticket; waiting happens on the key's own
+    condition, so different conversations never block each other.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks: Dict[str, _TicketLock] = {}
+        self.stats = {"acquired": 0, "waited": 0}
+
+    @contextmanager
+    def hold(self, key: str):
+        with self._mutex:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = _TicketLock()
+            ticket = lock.next_ticket
+            lock.next_ticket += 1
+            lock.users += 1
+            self.stats["acquired"] += 1
+            if lock.users > 1:
+                self.stats["waited"] += 1
+
+        acquired = False
+        try:
+            with lock.condition:
+                while lock.serving != ticket:
+                    lock.condition.wait()
+                acquired = True
+            yield
+        finally:
+            with lock.condition:
+                if acquired or lock.serving == ticket:
+                    lock.advance()
+                else:
+                    # Interrupted while waiting: the holder ahead of us skips this ticket
+                    lock.abandoned.add(ticket)
+                lock.condition.notify_all()
+            with self._mutex:
+                lock.users -= 1
+                if not lock.users:
+                    del self._locks[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._mutex:
+            return {"active": len(self._locks), **self.stats}
+
+
+class AsyncConversationLocks:
+    """Per-conversation locks for coroutines on one event loop
+
+    asyncio.Lock already wakes waiters in FIFO order, so each key just needs
+    its own lock, dropped when nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        # key -> [lock, users]
+        self._locks: Dict[str, List[Any]] = {}
+        self.stats = {"acquired": 0, "waited": 0}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.stats["acquired"] += 1
+        if entry[0].locked():
+            self.stats["waited"] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"active": len(self._locks), **self.stats}
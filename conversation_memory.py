@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Conversation Memory - Token-budgeted chat history with background summarization
+"""
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+
+from flow_compiler import MemorySpec
+from history_store import ChatHistoryBackend, StoredConversation
+
+logger = logging.getLogger("conversation_memory")
+
+SUMMARY_PROMPT = """Progressively summarize the conversation below, adding onto the previous summary.
+Keep names, dates, decisions and open questions. Reply with the new summary only.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when installed, otherwise approximates ~4 characters per token"""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self._encoding = None
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            logger.info("tiktoken not available, approximating token counts")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return len(text) // 4 + 1
+
+    def count_message(self, message: BaseMessage) -> int:
+        # Per-message overhead for role and separators in chat formats
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        return self.count(content) + 4
+
+
+class ConversationMemory:
+    """Chat history for one conversation, kept within the flow's memory budget
+
+    The newest messages live in a window with cached token counts. When the
+    window exceeds its turn or token limit, the oldest messages are moved
+    out. With summarization on, they are queued for a background summarizer
+    instead of being summarized while the user waits.
+
+    Every message gets a sequence number. With a history backend, new
+    messages and the summary are handed to it as they change, and
+    `_base_seq` records the first message that is neither summarized nor
+    dropped, which is where a restore resumes.
+
+    clear() starts a new generation; a summary that was already being
+    written for the old one is discarded instead of being applied or
+    persisted over the new conversation.
+    """
+
+    def __init__(self, spec: MemorySpec, counter: TokenCounter,
+                 summarizer: Optional["BackgroundSummarizer"] = None,
+                 backend: Optional[ChatHistoryBackend] = None,
+                 conversation_key: Optional[str] = None):
+        self.spec = spec
+        self.counter = counter
+        self.summarizer = summarizer
+        self.backend = backend
+        self.conversation_key = conversation_key
+        self.summary = ""
+        self.summary_tokens = 0
+        self.messages: List[BaseMessage] = []
+        self._token_counts: List[int] = []
+        self._window_tokens = 0
+        self._pending: List[BaseMessage] = []
+        self._summary_scheduled = False
+        self._next_seq = 0
+        self._base_seq = 0
+        self._persisted_base = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _window_start_seq(self) -> int:
+        return self._next_seq - len(self.messages)
+
+    def restore(self, stored: StoredConversation):
+        """Load state read back from a history backend, without writing it again"""
+        with self._lock:
+            self.summary = stored.summary
+            self.summary_tokens = self.counter.count(stored.summary)
+            self.messages = []
+            self._token_counts = []
+            self._window_tokens = 0
+            for _, message in stored.messages:
+                self._append(message)
+            self._next_seq = stored.message_count
+            # Messages skipped by the load limit are treated as dropped
+            self._base_seq = self._persisted_base = max(stored.summarized_count, self._window_start_seq)
+            self._trim()
+        self._persist_base()
+        self._schedule_summary()
+
+    @property
+    def token_count(self) -> int:
+        """Tokens this memory currently contributes to a prompt"""
+        return self.summary_tokens + self._window_tokens
+
+    def configure(self, spec: MemorySpec):
+        """Apply a new memory configuration, trimming right away if it is tighter"""
+        with self._lock:
+            self.spec = spec
+            self._trim()
+        self._schedule_summary()
+
+    def load_messages(self) -> List[BaseMessage]:
+        """Messages to send with the next prompt: the running summary, then the window"""
+        with self._lock:
+            if self.summary:
+                return [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] + self.messages
+            return list(self.messages)
+
+    def load_buffer(self) -> str:
+        """The same history as load_messages(), formatted as a transcript"""
+        return get_buffer_string(self.load_messages())
+
+    def add_message(self, message: BaseMessage):
+        """Append one message and enforce the budget"""
+        self._save([message])
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]):
+        """Record one human/AI exchange"""
+        self._save([HumanMessage(content=inputs["input"]), AIMessage(content=outputs["output"])])
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.summary_tokens = 0
+            self.messages = []
+            self._token_counts = []
+            self._window_tokens = 0
+            self._pending = []
+            self._next_seq = self._base_seq = self._persisted_base = 0
+            self._summary_scheduled = False
+            self._generation += 1
+            # Queued under the lock so no summary of the old generation can be written after it
+            if self.backend is not None:
+                self.backend.delete(self.conversation_key)
+
+    def _save(self, messages: List[BaseMessage]):
+        with self._lock:
+            rows = [(self._append(message), message) for message in messages]
+            self._trim()
+        if self.backend is not None:
+            self.backend.append(self.conversation_key, rows)
+        self._persist_base()
+        self._schedule_summary()
+
+    def _append(self, message: BaseMessage) -> int:
+        tokens = self.counter.count_message(message)
+        self.messages.append(message)
+        self._token_counts.append(tokens)
+        self._window_tokens += tokens
+        self._next_seq += 1
+        return self._next_seq - 1
+
+    def _persist_base(self, generation: Optional[int] = None):
+        """Tell the backend how far the summary (or dropping) has advanced
+
+        With a generation, nothing is written if clear() has run since.
+        """
+        if self.backend is None:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if self._base_seq == self._persisted_base:
+                return
+            self._persisted_base = self._base_seq
+            self.backend.save_summary(self.conversation_key, self.summary, self._base_seq)
+
+    def _trim(self):
+        """Move the oldest messages out of the window until it fits the spec"""
+        if self.spec.mode == "buffer":
+            return
+
+        max_messages = self.spec.window_turns * 2 if self.spec.window_turns else None
+        # Leave room for the summary inside the hard token budget
+        max_tokens = self.spec.max_tokens - self.summary_tokens if self.spec.max_tokens else None
+
+        overflow = 0
+        window_tokens = self._window_tokens
+        remaining = len(self.messages)
+        # Keep at least the latest exchange even if it alone exceeds the budget
+        while remaining > 2 and (
+            (max_messages is not None and remaining > max_messages)
+            or (max_tokens is not None and window_tokens > max_tokens)
+        ):
+            window_tokens -= self._token_counts[overflow]
+            overflow += 1
+            remaining -= 1
+
+        # Don't start the window halfway through an exchange
+        while overflow and remaining > 2 and not isinstance(self.messages[overflow], HumanMessage):
+            window_tokens -= self._token_counts[overflow]
+            overflow += 1
+            remaining -= 1
+
+        if not overflow:
+            return
+
+        if self.spec.summarize and self.summarizer is not None:
+            self._pending.extend(self.messages[:overflow])
+        del self.messages[:overflow]
+        del self._token_counts[:overflow]
+        self._window_tokens = window_tokens
+
+        if not (self.spec.summarize and self.summarizer is not None):
+            # Dropped for good, including anything still waiting for a summary
+            self._pending = []
+            self._base_seq = max(self._base_seq, self._window_start_seq)
+
+    def _schedule_summary(self):
+        with self._lock:
+            if not self._pending or self._summary_scheduled or self.summarizer is None:
+                return
+            self._summary_scheduled = True
+        self.summarizer.submit(self)
+
+    def _take_pending(self):
+        """Hand the overflow to the summarizer, with the seq the summary will cover up to
+        and the generation it belongs to"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return self.summary, pending, self._window_start_seq, self._generation
+
+    def _apply_summary(self, summary: str, covered_seq: int, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                # Cleared while the summary was being written; it belongs to the old conversation
+                return
+            self.summary = summary
+            self.summary_tokens = self.counter.count(summary)
+            self._summary_scheduled = False
+            self._base_seq = max(self._base_seq, covered_seq)
+            # A longer summary may push the window over budget
+            self._trim()
+        self._persist_base(generation)
+        self._schedule_summary()
+
+    def _summary_failed(self, pending: List[BaseMessage], generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            # Keep the overflow for the next attempt instead of losing it
+            self._pending = pending + self._pending
+            self._summary_scheduled = False
+
+
+class BackgroundSummarizer:
+    """Single worker thread that folds overflowed messages into each memory's summary"""
+
+    def __init__(self, get_llm: Callable[[], Any], max_queue: int = 1000):
+        self.get_llm = get_llm
+        self._queue: "queue.Queue[ConversationMemory]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="memory-summarizer", daemon=True)
+        self._thread.start()
+        self.stats = {"summaries": 0, "failures": 0, "dropped": 0}
+
+    def submit(self, memory: ConversationMemory):
+        try:
+            self._queue.put_nowait(memory)
+        except queue.Full:
+            # Under pressure just drop the overflow, the window is already within budget
+            self.stats["dropped"] += 1
+            summary, _, covered_seq, generation = memory._take_pending()
+            memory._apply_summary(summary, covered_seq, generation)
+
+    def _run(self):
+        while True:
+            memory = self._queue.get()
+            summary, pending, covered_seq, generation = memory._take_pending()
+            if not pending:
+                memory._apply_summary(summary, covered_seq, generation)
+                continue
+            try:
+                prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", lines=get_buffer_string(pending))
+                result = self.get_llm().invoke(prompt)
+                memory._apply_summary(getattr(result, "content", str(result)).strip(), covered_seq, generation)
+                self.stats["summaries"] += 1
+            except Exception as e:
+                logger.error(f"Error summarizing conversation: {e}")
+                self.stats["failures"] += 1
+                memory._summary_failed(pending, generation)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Conversation Store - Bounded storage for per-conversation chains and agents
+"""
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("conversation_store")
+
+# Called as on_evict(key, value, reason) with reason one of "capacity", "ttl", "memory"
+EvictionCallback = Callable[[str, Any, str], None]
+
+
+class ConversationStore(ABC):
+    """Interface for storing per-conversation state keyed by "channel:user"
+
+    Implementations decide how long entries live; callers must be prepared
+    for get() to miss on a key they stored earlier.
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, value: Any):
+        ...
+
+    @abstractmethod
+    def pop(self, key: str, default: Any = None) -> Any:
+        ...
+
+    def touch(self, key: str):
+        """Tell the store an entry's contents changed (e.g. its memory grew)"""
+
+    @abstractmethod
+    def keys(self) -> List[str]:
+        ...
+
+    def clear(self):
+        for key in self.keys():
+            self.pop(key)
+
+    @abstractmethod
+    def add_eviction_listener(self, callback: EvictionCallback):
+        ...
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"size": len(self)}
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self.put(key, value)
+
+    def __delitem__(self, key: str):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+
+class LRUConversationStore(ConversationStore):
+    """In-memory store with a max-entries cap, idle TTL and optional memory budget
+
+    Entries are kept in least-recently-used order, so idle-TTL expiry and
+    capacity eviction both only ever look at the front of the list.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: Optional[float] = None,
+                 max_memory_bytes: Optional[int] = None,
+                 size_of: Optional[Callable[[Any], int]] = None,
+                 on_evict: Optional[EvictionCallback] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.size_of = size_of or (lambda value: 0)
+        self._clock = clock
+        # key -> (value, last_access, size)
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self._listeners: List[EvictionCallback] = [on_evict] if on_evict else []
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0,
+                       "evicted_capacity": 0, "evicted_ttl": 0, "evicted_memory": 0}
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "LRUConversationStore":
+        """Create a store sized from CONVERSATION_MAX_ENTRIES, CONVERSATION_TTL_SECONDS
+        and CONVERSATION_MAX_MEMORY_MB"""
+        max_entries = int(os.environ.get("CONVERSATION_MAX_ENTRIES", "1000"))
+        ttl = os.environ.get("CONVERSATION_TTL_SECONDS", "86400")
+        memory_mb = os.environ.get("CONVERSATION_MAX_MEMORY_MB")
+        return cls(
+            max_entries=max_entries,
+            ttl_seconds=float(ttl) if ttl else None,
+            max_memory_bytes=int(float(memory_mb) * 1024 * 1024) if memory_mb else None,
+            **kwargs
+        )
+
+    def add_eviction_listener(self, callback: EvictionCallback):
+        """Register a callback invoked for every evicted entry, e.g. to persist its history"""
+        self._listeners.append(callback)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], self._clock()):
+                evicted.append(self._remove(key, "ttl"))
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                value = default
+            else:
+                self._stats["hits"] += 1
+                value, _, size = entry
+                self._entries[key] = (value, self._clock(), size)
+                self._entries.move_to_end(key)
+        self._notify(evicted)
+        return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            if key in self._entries:
+                self._memory_bytes -= self._entries.pop(key)[2]
+            size = self._measure(value)
+            self._entries[key] = (value, self._clock(), size)
+            self._memory_bytes += size
+            evicted = self._enforce_limits(keep=key)
+        self._notify(evicted)
+
+    def touch(self, key: str):
+        """Re-measure an entry after its memory grew and enforce the budget"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            value, _, old_size = entry
+            size = self._measure(value)
+            self._entries[key] = (value, self._clock(), size)
+            self._entries.move_to_end(key)
+            self._memory_bytes += size - old_size
+            evicted = self._enforce_limits(keep=key)
+        self._notify(evicted)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._memory_bytes -= entry[2]
+            return entry[0]
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry[1], self._clock())
+
+    def evict_expired(self) -> int:
+        """Drop every idle entry past its TTL; returns how many were evicted"""
+        with self._lock:
+            evicted = self._evict_idle(self._clock())
+        self._notify(evicted)
+        return len(evicted)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "size": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                **self._stats,
+            }
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - last_access > self.ttl_seconds
+
+    def _measure(self, value: Any) -> int:
+        if self.max_memory_bytes is None:
+            return 0
+        try:
+            return int(self.size_of(value))
+        except Exception as e:
+            logger.debug(f"Could not measure conversation entry: {e}")
+            return 0
+
+    def _remove(self, key: str, reason: str) -> Tuple[str, Any, str]:
+        value, _, size = self._entries.pop(key)
+        self._memory_bytes -= size
+        self._stats["evictions"] += 1
+        self._stats[f"evicted_{reason}"] += 1
+        return key, value, reason
+
+    def _evict_idle(self, now: float) -> List[Tuple[str, Any, str]]:
+        evicted = []
+        if self.ttl_seconds is None:
+            return evicted
+        while self._entries:
+            key, (_, last_access, _) = next(iter(self._entries.items()))
+            if not self._expired(last_access, now):
+                break
+            evicted.append(self._remove(key, "ttl"))
+        return evicted
+
+    def _enforce_limits(self, keep: str) -> List[Tuple[str, Any, str]]:
+        """Evict from the LRU end until all limits hold; never evicts `keep`"""
+        evicted = self._evict_idle(self._clock())
+        while len(self._entries) > self.max_entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            evicted.append(self._remove(key, "capacity"))
+        if self.max_memory_bytes is not None:
+            while self._memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+                key = next(iter(self._entries))
+                if key == keep:
+                    break
+                evicted.append(self._remove(key, "memory"))
+        return evicted
+
+    def _notify(self, evicted: List[Tuple[str, Any, str]]):
+        """Run eviction callbacks outside the lock"""
+        for key, value, reason in evicted:
+            logger.debug(f"Evicted conversation {key} ({reason})")
+            for callback in self._listeners:
+                try:
+                    callback(key, value, reason)
+                except Exception as e:
+                    logger.error(f"Error in eviction callback for {key}: {e}")
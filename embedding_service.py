@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Embedding Service - One shared embeddings client with batching and an LRU + SQLite cache
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger("embedding_service")
+
+DEFAULT_MODEL = "text-embedding-ada-002"
+DEFAULT_MAX_ENTRIES = 10000
+# How long the first of several concurrent queries waits for others to join its request
+DEFAULT_BATCH_WINDOW_MS = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def embedding_key(model: str, text: str) -> str:
+    """Cache key for a text embedded by a model"""
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _QueryBatcher:
+    """Coalesces embed calls from concurrent threads into one request
+
+    The first caller waits window seconds, then sends every text submitted
+    in the meantime and hands each caller its vectors; callers arriving
+    while that request is in flight start the next batch.
+    """
+
+    def __init__(self, embed, window: float):
+        self._embed = embed
+        self.window = window
+        self._pending: List[Tuple[str, Future]] = []
+        self._collecting = False
+        self._lock = threading.Lock()
+
+    def submit(self, texts: Sequence[str]) -> List[List[float]]:
+        futures = [Future() for _ in texts]
+        with self._lock:
+            self._pending.extend(zip(texts, futures))
+            lead = not self._collecting
+            self._collecting = True
+
+        if lead:
+            time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._collecting = False
+            try:
+                vectors = self._embed([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+        return [future.result() for future in futures]
+
+
+class _AsyncQueryBatcher:
+    """_QueryBatcher for coroutines on one event loop
+
+    The batch is sent by its own task, so a caller being cancelled doesn't
+    strand the others waiting on the same request.
+    """
+
+    def __init__(self, aembed, window: float):
+        self._aembed = aembed
+        self.window = window
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, texts: Sequence[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        self._pending.extend(zip(texts, futures))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+        return list(await asyncio.gather(*futures))
+
+    async def _flush(self):
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+        try:
+            vectors = await self._aembed([text for text, _ in batch])
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class EmbeddingService(Embeddings):
+    """Embeddings with one long-lived client, request batching and a two-tier cache
+
+    Vectors are cached by (model, text hash) in an in-memory LRU in front
+    of an optional SQLite table, so identical texts are embedded once even
+    across restarts. Cache misses of one call go out as a single request,
+    and single queries arriving together from different threads (or
+    coroutines) are coalesced into one request as well.
+    """
+
+    def __init__(self, client: Any = None, model: str = DEFAULT_MODEL, path: Optional[Path] = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, batch_window_ms: float = DEFAULT_BATCH_WINDOW_MS):
+        self.model = model
+        self._client = client
+        self._client_lock = threading.Lock()
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies: "deque[float]" = deque(maxlen=200)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "requests": 0, "texts_embedded": 0,
+                      "errors": 0}
+
+        window = batch_window_ms / 1000.0
+        self._batcher = _QueryBatcher(self._embed_uncached, window) if window > 0 else None
+        self._async_batcher = _AsyncQueryBatcher(self._aembed_uncached, window) if window > 0 else None
+
+        self.path = Path(path) if path else None
+        self._conn = None
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(SCHEMA)
+            except Exception as e:
+                logger.error(f"Error opening embedding cache at {self.path}, caching in memory only: {e}")
+                self._conn = None
+
+    @classmethod
+    def from_env(cls) -> "EmbeddingService":
+        """Create the service from EMBEDDING_MODEL, EMBEDDING_CACHE (sqlite, memory or none),
+        EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES and EMBEDDING_BATCH_WINDOW_MS"""
+        backend = os.environ.get("EMBEDDING_CACHE", "sqlite").lower()
+        path = None
+        if backend == "sqlite":
+            path = os.environ.get("EMBEDDING_CACHE_PATH") or Path(__file__).parent / "embeddings.db"
+        elif backend not in ("memory", "none", ""):
+            logger.error(f"Unknown embedding cache '{backend}', caching in memory only")
+        max_entries = 0 if backend in ("none", "") else int(
+            os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        return cls(
+            model=os.environ.get("EMBEDDING_MODEL", DEFAULT_MODEL),
+            path=path,
+            max_entries=max_entries,
+            batch_window_ms=float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", DEFAULT_BATCH_WINDOW_MS)),
+        )
+
+    @property
+    def client(self):
+        """The OpenAI embeddings client, created once so its HTTP connections are reused"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from langchain_openai import OpenAIEmbeddings
+                    self._client = OpenAIEmbeddings(model=self.model)
+        return self._client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, sending all cache misses in one request"""
+        vectors, missing = self._lookup(texts)
+        if missing:
+            self._fill(vectors, texts, missing, self._embed_uncached(list(missing)))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed one text, batched with concurrent queries from other threads"""
+        vectors, missing = self._lookup([text])
+        if missing:
+            embed = self._batcher.submit if self._batcher is not None else self._embed_uncached
+            self._fill(vectors, [text], missing, embed([text]))
+        return vectors[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup(texts)
+        if missing:
+            self._fill(vectors, texts, missing, await self._aembed_uncached(list(missing)))
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, missing = self._lookup([text])
+        if missing:
+            embed = self._async_batcher.submit if self._async_batcher is not None else self._aembed_uncached
+            self._fill(vectors, [text], missing, await embed([text]))
+        return vectors[0]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            latencies = sorted(self._latencies)
+            return {
+                "size": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "mean_batch_size": self.stats["texts_embedded"] / self.stats["requests"] if self.stats["requests"] else 0.0,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "latency_p95": latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] if latencies else None,
+                **self.stats,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _lookup(self, texts: Sequence[str]) -> Tuple[List[Optional[List[float]]], "OrderedDict[str, List[int]]"]:
+        """Cached vectors for texts (None where missing) and the missing texts with their positions"""
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing: "OrderedDict[str, List[int]]" = OrderedDict()
+        with self._lock:
+            for i, text in enumerate(texts):
+                if text in missing:
+                    missing[text].append(i)
+                    continue
+                key = embedding_key(self.model, text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                else:
+                    vector = self._load(key)
+                    if vector is not None:
+                        self.stats["disk_hits"] += 1
+                        self._remember(key, vector)
+                if vector is None:
+                    self.stats["misses"] += 1
+                    missing[text] = [i]
+                else:
+                    vectors[i] = vector
+        return vectors, missing
+
+    def _fill(self, vectors: List[Optional[List[float]]], texts: Sequence[str],
+              missing: "OrderedDict[str, List[int]]", embedded: List[List[float]]):
+        rows = []
+        with self._lock:
+            for (text, positions), vector in zip(missing.items(), embedded):
+                for i in positions:
+                    vectors[i] = vector
+                key = embedding_key(self.model, text)
+                self._remember(key, vector)
+                rows.append((key, array("f", vector).tobytes(), time.time()))
+            if self._conn is None or not rows:
+                return
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows
+                    )
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error persisting embeddings: {e}")
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        started = time.monotonic()
+        vectors = self.client.embed_documents(texts)
+        self._record_request(started, len(texts))
+        return vectors
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        started = time.monotonic()
+        vectors = await self.client.aembed_documents(texts)
+        self._record_request(started, len(texts))
+        return vectors
+
+    def _record_request(self, started: float, count: int):
+        with self._lock:
+            self._latencies.append(time.monotonic() - started)
+            self.stats["requests"] += 1
+            self.stats["texts_embedded"] += count
+
+    def _remember(self, key: str, vector: List[float]):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[List[float]]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Error reading embedding cache: {e}")
+            return None
+        if row is None:
+            return None
+        return array("f", row[0]).tolist()
+
+
+_shared_service: Optional[EmbeddingService] = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """The process-wide embedding service, shared across PineconeManager instances and reloads"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_lock:
+            if _shared_service is None:
+                _shared_service = EmbeddingService.from_env()
+    return _shared_service
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Flow Compiler - Turns the Flow Editor's React-Flow JSON into an indexed AgentSpec
+"""
+import hashlib
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from metadata_filter import filter_to_sql
+
+logger = logging.getLogger("flow_compiler")
+
+DEFAULT_PROVIDER = "openai"
+DEFAULT_MODEL = "gpt-4"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant for Slack."
+DEFAULT_RAG_PROVIDER = "pinecone"
+DEFAULT_INDEX_NAME = "slack-knowledge"
+RAG_PROVIDERS = ("pinecone", "local")
+# Storage of the local index; int8 uses a quarter of the space
+RAG_QUANTIZATIONS = ("float32", "int8")
+# hybrid fuses embedding search with BM25 keyword search
+RAG_RETRIEVAL_MODES = ("vector", "hybrid")
+# Knowledge base namespace per Slack workspace or channel, or one shared namespace
+RAG_PARTITIONS = ("none", "workspace", "channel")
+
+# Node types an agent cannot run without (only enforced for non-empty flows,
+# an empty flow still compiles to the default agent)
+REQUIRED_NODE_TYPES = ("llm",)
+
+_EMPTY = MappingProxyType({})
+
+# Independently rebuildable parts of an agent, see AgentSpec.component_fingerprints
+COMPONENTS = ("llm", "systemPrompt", "tools", "rag", "memory", "router")
+
+MEMORY_MODES = ("buffer", "window", "token_budget")
+DEFAULT_MEMORY_MAX_TOKENS = 2000
+
+DEFAULT_ROUTER_THRESHOLD = 0.5
+
+DEFAULT_LLM_CACHE_ENTRIES = 1000
+
+DEFAULT_CASCADE_MIN_CONFIDENCE = 0.6
+
+# Node data keys that only affect how the editor draws a node
+_DISPLAY_KEYS = frozenset({"label"})
+
+
+class FlowValidationError(ValueError):
+    """Raised when a flow cannot be compiled into an AgentSpec"""
+
+    def __init__(self, errors: List[str]):
+        self.errors = list(errors)
+        super().__init__("Invalid flow: " + "; ".join(self.errors))
+
+
+@dataclass(frozen=True)
+class FlowNode:
+    """A single node of the flow graph"""
+    id: str
+    type: str
+    data: Mapping[str, Any] = field(default_factory=lambda: _EMPTY)
+
+
+@dataclass(frozen=True)
+class LLMCacheSpec:
+    """Exact-match response cache for the flow's language model
+
+    Set on the llm node as "cache": true or {"maxEntries": ..., "persist": ...,
+    "ttlSeconds": ...}; persist keeps entries in SQLite across restarts.
+    """
+    enabled: bool = False
+    max_entries: int = DEFAULT_LLM_CACHE_ENTRIES
+    persist: bool = True
+    ttl_seconds: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class CascadeSpec:
+    """Small model that answers conversation turns before the main one is asked"""
+    provider: str
+    model: str
+    min_confidence: float = DEFAULT_CASCADE_MIN_CONFIDENCE
+
+
+@dataclass(frozen=True)
+class LLMSpec:
+    """Language model selected by the flow"""
+    provider: str = DEFAULT_PROVIDER
+    model: str = DEFAULT_MODEL
+    cache: LLMCacheSpec = field(default_factory=LLMCacheSpec)
+    # Other (provider, model) pairs to pool with this one for failover
+    fallbacks: Tuple[Tuple[str, str], ...] = ()
+    hedge: bool = False
+    cascade: Optional[CascadeSpec] = None
+    node_id: Optional[str] = None
+    data: Mapping[str, Any] = field(default_factory=lambda: _EMPTY)
+
+
+@dataclass(frozen=True)
+class RAGSpec:
+    """Retrieval configuration selected by the flow"""
+    provider: str = DEFAULT_RAG_PROVIDER
+    index_name: str = DEFAULT_INDEX_NAME
+    enabled: bool = True
+    # Only used by the local provider: index directory and matrix storage
+    path: Optional[str] = None
+    quantization: Optional[str] = None
+    retrieval: str = "vector"
+    partition: str = "none"
+    # Pinecone metadata filter sent with every query
+    metadata_filter: Optional[Mapping[str, Any]] = None
+    node_id: Optional[str] = None
+    data: Mapping[str, Any] = field(default_factory=lambda: _EMPTY)
+
+
+@dataclass(frozen=True)
+class MemorySpec:
+    """How much chat history each conversation keeps
+
+    buffer keeps everything (the default), window keeps the last
+    window_turns exchanges, and token_budget additionally caps the history
+    at max_tokens, optionally summarizing what falls out of the window.
+    """
+    mode: str = "buffer"
+    max_tokens: Optional[int] = None
+    window_turns: Optional[int] = None
+    summarize: bool = False
+    node_id: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class RouterSpec:
+    """Keywords and threshold the intent router decides tools/RAG routing with
+
+    Keywords map to a weight in (0, 1]; they are added to the router's
+    built-in keywords unless include_defaults is off. classifier is an
+    optional path to labelled examples for the fallback classifier.
+    """
+    tool_keywords: Mapping[str, float] = field(default_factory=lambda: _EMPTY)
+    rag_keywords: Mapping[str, float] = field(default_factory=lambda: _EMPTY)
+    include_defaults: bool = True
+    threshold: float = DEFAULT_ROUTER_THRESHOLD
+    classifier: Optional[str] = None
+    node_id: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class AgentSpec:
+    """Immutable, typed description of the agent a flow describes"""
+    llm: LLMSpec = field(default_factory=LLMSpec)
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT
+    tools: Tuple[Mapping[str, Any], ...] = ()
+    rag: Optional[RAGSpec] = None
+    memory: MemorySpec = field(default_factory=MemorySpec)
+    router: RouterSpec = field(default_factory=RouterSpec)
+    nodes_by_id: Mapping[str, FlowNode] = field(default_factory=lambda: _EMPTY)
+    nodes_by_type: Mapping[str, Tuple[FlowNode, ...]] = field(default_factory=lambda: _EMPTY)
+    successors: Mapping[str, Tuple[str, ...]] = field(default_factory=lambda: _EMPTY)
+    predecessors: Mapping[str, Tuple[str, ...]] = field(default_factory=lambda: _EMPTY)
+    order: Tuple[str, ...] = ()
+
+    def nodes_of_type(self, node_type: str) -> Tuple[FlowNode, ...]:
+        """All nodes of a type, in topological order"""
+        return self.nodes_by_type.get(node_type, ())
+
+    def first_of_type(self, node_type: str) -> Optional[FlowNode]:
+        """The first node of a type in topological order, if any"""
+        nodes = self.nodes_of_type(node_type)
+        return nodes[0] if nodes else None
+
+    def upstream(self, node_id: str) -> Tuple[FlowNode, ...]:
+        """Nodes with an edge into the given node"""
+        return tuple(self.nodes_by_id[n] for n in self.predecessors.get(node_id, ()))
+
+    def downstream(self, node_id: str) -> Tuple[FlowNode, ...]:
+        """Nodes the given node has an edge into"""
+        return tuple(self.nodes_by_id[n] for n in self.successors.get(node_id, ()))
+
+    @property
+    def rag_enabled(self) -> bool:
+        """Check if RAG is enabled in the flow"""
+        return self.rag is not None and self.rag.enabled
+
+    def component_fingerprints(self) -> Dict[str, str]:
+        """
+        Content hash of each component in COMPONENTS
+
+        Two specs with the same fingerprint for a component build identical
+        objects for it, so a reload only has to rebuild what differs. Editor
+        layout (positions, labels) does not affect the fingerprints.
+        """
+        parts = {
+            "llm": (self.llm.provider, self.llm.model, _without_display_keys(self.llm.data)),
+            "systemPrompt": self.system_prompt,
+            "tools": self.tools,
+            "rag": None if self.rag is None else (
+                self.rag.provider, self.rag.index_name, self.rag.enabled, _without_display_keys(self.rag.data)
+            ),
+            "memory": (self.memory.mode, self.memory.max_tokens, self.memory.window_turns, self.memory.summarize),
+            "router": (dict(self.router.tool_keywords), dict(self.router.rag_keywords),
+                       self.router.include_defaults, self.router.threshold, self.router.classifier),
+        }
+        return {name: _fingerprint(value) for name, value in parts.items()}
+
+
+def _without_display_keys(data: Mapping[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in data.items() if k not in _DISPLAY_KEYS}
+
+
+def _keyword_weights(value: Any) -> Dict[str, float]:
+    """Accept either a list of keywords (weight 1.0) or a {keyword: weight} mapping"""
+    if isinstance(value, Mapping):
+        return {str(k).lower(): float(w) for k, w in value.items()}
+    return {str(k).lower(): 1.0 for k in value or ()}
+
+
+def _llm_cache_spec(value: Any) -> LLMCacheSpec:
+    """Parse an llm node's "cache" setting, either a flag or an options object"""
+    if not isinstance(value, Mapping):
+        return LLMCacheSpec(enabled=bool(value))
+    ttl = value.get("ttlSeconds")
+    return LLMCacheSpec(
+        enabled=bool(value.get("enabled", True)),
+        max_entries=int(value.get("maxEntries", DEFAULT_LLM_CACHE_ENTRIES)),
+        persist=bool(value.get("persist", True)),
+        ttl_seconds=float(ttl) if ttl else None,
+    )
+
+
+def _cascade_spec(value: Any) -> Optional[CascadeSpec]:
+    """Parse an llm node's "cascade" setting: {"provider", "model", "minConfidence"}"""
+    if not isinstance(value, Mapping) or not value.get("model") or value.get("enabled") is False:
+        return None
+    return CascadeSpec(
+        provider=value.get("provider", DEFAULT_PROVIDER),
+        model=value["model"],
+        min_confidence=float(value.get("minConfidence", DEFAULT_CASCADE_MIN_CONFIDENCE)),
+    )
+
+
+def _fingerprint(value: Any) -> str:
+    encoded = json.dumps(value, sort_keys=True, default=dict).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def _topological_order(node_ids: List[str], successors: Dict[str, List[str]],
+                       predecessors: Dict[str, List[str]]) -> List[str]:
+    """Kahn's algorithm; nodes that sit on a cycle keep their file order at the end"""
+    in_degree = {node_id: len(predecessors[node_id]) for node_id in node_ids}
+    queue = deque(node_id for node_id in node_ids if in_degree[node_id] == 0)
+    order = []
+
+    while queue:
+        node_id = queue.popleft()
+        order.append(node_id)
+        for succ in successors[node_id]:
+            in_degree[succ] -= 1
+            if in_degree[succ] == 0:
+                queue.append(succ)
+
+    if len(order) < len(node_ids):
+        seen = set(order)
+        cyclic = [node_id for node_id in node_ids if node_id not in seen]
+        logger.warning(f"Flow contains a cycle through nodes: {cyclic}")
+        order.extend(cyclic)
+
+    return order
+
+
+def compile_flow(flow_data: Mapping[str, Any]) -> AgentSpec:
+    """
+    Compile React-Flow JSON into an AgentSpec in a single pass over nodes and edges
+
+    Args:
+        flow_data: The flow as stored by the Flow Editor ({"nodes": [...], "edges": [...]})
+
+    Returns:
+        AgentSpec with nodes indexed by id and type and edges resolved
+
+    Raises:
+        FlowValidationError: if node ids are missing or duplicated, an edge points at
+            an unknown node, or a required node type is absent
+    """
+    errors = []
+    node_ids: List[str] = []
+    nodes_by_id: Dict[str, FlowNode] = {}
+
+    for position, raw in enumerate(flow_data.get("nodes", ()) or ()):
+        node_id = raw.get("id")
+        node_type = raw.get("type")
+        if not node_id or not node_type:
+            errors.append(f"node #{position} is missing an id or type")
+            continue
+        if node_id in nodes_by_id:
+            errors.append(f"duplicate node id '{node_id}'")
+            continue
+        nodes_by_id[node_id] = FlowNode(node_id, node_type, raw.get("data") or _EMPTY)
+        node_ids.append(node_id)
+
+    successors: Dict[str, List[str]] = {node_id: [] for node_id in node_ids}
+    predecessors: Dict[str, List[str]] = {node_id: [] for node_id in node_ids}
+
+    for edge in flow_data.get("edges", ()) or ():
+        source, target = edge.get("source"), edge.get("target")
+        if source not in nodes_by_id or target not in nodes_by_id:
+            errors.append(f"edge '{edge.get('id', '?')}' references unknown node")
+            continue
+        if target not in successors[source]:
+            successors[source].append(target)
+            predecessors[target].append(source)
+
+    if node_ids:
+        present_types = {node.type for node in nodes_by_id.values()}
+        for required in REQUIRED_NODE_TYPES:
+            if required not in present_types:
+                errors.append(f"missing required '{required}' node")
+
+    for node in nodes_by_id.values():
+        if node.type == "memory" and node.data.get("mode", "buffer") not in MEMORY_MODES:
+            errors.append(f"memory node '{node.id}' has unknown mode '{node.data.get('mode')}'")
+        if node.type == "llm":
+            for fallback in node.data.get("fallbacks", ()) or ():
+                if not isinstance(fallback, Mapping) or not fallback.get("model"):
+                    errors.append(f"llm node '{node.id}' has a fallback without a model")
+            cascade = node.data.get("cascade")
+            if cascade is not None and not (isinstance(cascade, Mapping) and cascade.get("model")):
+                errors.append(f"llm node '{node.id}' cascade needs a model")
+        if node.type == "llm" and isinstance(node.data.get("cache"), Mapping):
+            max_entries = node.data["cache"].get("maxEntries", DEFAULT_LLM_CACHE_ENTRIES)
+            if not isinstance(max_entries, int) or max_entries < 1:
+                errors.append(f"llm node '{node.id}' cache maxEntries must be a positive integer")
+        if node.type == "rag":
+            if node.data.get("provider", DEFAULT_RAG_PROVIDER) not in RAG_PROVIDERS:
+                errors.append(f"rag node '{node.id}' has unknown provider '{node.data.get('provider')}'")
+            if node.data.get("quantization", "float32") not in RAG_QUANTIZATIONS:
+                errors.append(f"rag node '{node.id}' has unknown quantization '{node.data.get('quantization')}'")
+            if node.data.get("retrieval", "vector") not in RAG_RETRIEVAL_MODES:
+                errors.append(f"rag node '{node.id}' has unknown retrieval mode '{node.data.get('retrieval')}'")
+            if node.data.get("partition", "none") not in RAG_PARTITIONS:
+                errors.append(f"rag node '{node.id}' has unknown partition '{node.data.get('partition')}'")
+            if node.data.get("filter") is not None:
+                try:
+                    filter_to_sql(node.data["filter"])
+                except (ValueError, AttributeError) as e:
+                    errors.append(f"rag node '{node.id}' has an invalid filter: {e}")
+        if node.type == "router":
+            threshold = node.data.get("threshold", DEFAULT_ROUTER_THRESHOLD)
+            if not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1:
+                errors.append(f"router node '{node.id}' threshold must be between 0 and 1")
+
+    if errors:
+        raise FlowValidationError(errors)
+
+    order = _topological_order(node_ids, successors, predecessors)
+
+    by_type: Dict[str, List[FlowNode]] = {}
+    for node_id in order:
+        node = nodes_by_id[node_id]
+        by_type.setdefault(node.type, []).append(node)
+
+    spec = AgentSpec(
+        nodes_by_id=MappingProxyType(nodes_by_id),
+        nodes_by_type=MappingProxyType({t: tuple(nodes) for t, nodes in by_type.items()}),
+        successors=MappingProxyType({k: tuple(v) for k, v in successors.items()}),
+        predecessors=MappingProxyType({k: tuple(v) for k, v in predecessors.items()}),
+        order=tuple(order),
+    )
+    return _resolve(spec)
+
+
+def _resolve(spec: AgentSpec) -> AgentSpec:
+    """Fill in the typed llm/prompt/tools/rag sections from the indexed graph"""
+    llm = LLMSpec()
+    llm_nodes = spec.nodes_of_type("llm")
+    if llm_nodes:
+        node = llm_nodes[0]
+        llm = LLMSpec(
+            provider=node.data.get("provider", DEFAULT_PROVIDER),
+            model=node.data.get("model", DEFAULT_MODEL),
+            cache=_llm_cache_spec(node.data.get("cache")),
+            fallbacks=tuple(
+                (fallback.get("provider", DEFAULT_PROVIDER), fallback["model"])
+                for fallback in node.data.get("fallbacks", ())
+            ),
+            hedge=bool(node.data.get("hedge", False)),
+            cascade=_cascade_spec(node.data.get("cascade")),
+            node_id=node.id,
+            data=node.data,
+        )
+        if len(llm_nodes) > 1:
+            logger.warning(f"Flow has {len(llm_nodes)} llm nodes, using '{node.id}'")
+
+    # Prefer the prompt wired into the selected LLM, otherwise the first one
+    prompt_node = None
+    if llm.node_id:
+        prompt_node = next((n for n in spec.upstream(llm.node_id) if n.type == "systemPrompt"), None)
+    if prompt_node is None:
+        prompt_node = spec.first_of_type("systemPrompt")
+    system_prompt = prompt_node.data.get("prompt", DEFAULT_SYSTEM_PROMPT) if prompt_node else DEFAULT_SYSTEM_PROMPT
+
+    # Union of enabled tools over every tools node, first occurrence of an id wins
+    tools = []
+    seen_tool_ids = set()
+    for node in spec.nodes_of_type("tools"):
+        for tool in node.data.get("tools", ()):
+            if not tool.get("enabled", False):
+                continue
+            tool_id = tool.get("id")
+            if tool_id in seen_tool_ids:
+                continue
+            seen_tool_ids.add(tool_id)
+            tools.append(tool)
+
+    rag = None
+    rag_node = spec.first_of_type("rag")
+    if rag_node:
+        rag = RAGSpec(
+            provider=rag_node.data.get("provider", DEFAULT_RAG_PROVIDER),
+            index_name=rag_node.data.get("indexName", DEFAULT_INDEX_NAME),
+            enabled=True,
+            path=rag_node.data.get("path"),
+            quantization=rag_node.data.get("quantization"),
+            retrieval=rag_node.data.get("retrieval", "vector"),
+            partition=rag_node.data.get("partition", "none"),
+            metadata_filter=rag_node.data.get("filter") or None,
+            node_id=rag_node.id,
+            data=rag_node.data,
+        )
+
+    memory = MemorySpec()
+    memory_node = spec.first_of_type("memory")
+    if memory_node:
+        mode = memory_node.data.get("mode", "buffer")
+        window_turns = memory_node.data.get("windowSize")
+        max_tokens = memory_node.data.get("maxTokens")
+        if mode == "token_budget" and not max_tokens:
+            max_tokens = DEFAULT_MEMORY_MAX_TOKENS
+        memory = MemorySpec(
+            mode=mode,
+            max_tokens=int(max_tokens) if mode == "token_budget" else None,
+            window_turns=int(window_turns) if window_turns and mode != "buffer" else None,
+            summarize=bool(memory_node.data.get("summarize", mode == "token_budget")),
+            node_id=memory_node.id,
+        )
+
+    # Tools can carry their own routing keywords next to the router node's
+    tool_keywords: Dict[str, float] = {}
+    for tool in tools:
+        tool_keywords.update(_keyword_weights(tool.get("keywords")))
+    router = RouterSpec(tool_keywords=MappingProxyType(tool_keywords))
+    router_node = spec.first_of_type("router")
+    if router_node:
+        tool_keywords.update(_keyword_weights(router_node.data.get("toolKeywords")))
+        router = RouterSpec(
+            tool_keywords=MappingProxyType(tool_keywords),
+            rag_keywords=MappingProxyType(_keyword_weights(router_node.data.get("ragKeywords"))),
+            include_defaults=bool(router_node.data.get("includeDefaults", True)),
+            threshold=float(router_node.data.get("threshold", DEFAULT_ROUTER_THRESHOLD)),
+            classifier=router_node.data.get("classifier") or None,
+            node_id=router_node.id,
+        )
+
+    return replace(spec, llm=llm, system_prompt=system_prompt, tools=tuple(tools), rag=rag, memory=memory,
+                   router=router)
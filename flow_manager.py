@@ -2,10 +2,43 @@
 """
 Flow Manager - Integrates the Flow Editor with the Slack Agent
 """
+import hashlib
 import json
 import os
+import threading
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from types import MappingProxyType
+from typing import Dict, List, Any, Optional, Tuple
+
+from flow_compiler import AgentSpec, FlowValidationError, compile_flow
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively convert parsed JSON into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    """Convert a frozen snapshot value back into plain dicts and lists"""
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable parsed view of a JSON config file at one point in time"""
+    stat_key: Optional[Tuple[int, int, int]]
+    digest: Optional[str]
+    data: Any
+
 
 class FlowManager:
     """Manages the integration between the Flow Editor and Slack Agent"""
@@ -18,18 +51,83 @@ class FlowManager:
         # Create config directory if it doesn't exist
         if not self.config_dir.exists():
             self.config_dir.mkdir(parents=True)
+        
+        # Parsed snapshots shared by all getters, keyed by file path
+        self._snapshots: Dict[Path, ConfigSnapshot] = {}
+        self._snapshot_lock = threading.Lock()
+        self._stats = {"reloads": 0, "hits": 0}
+        # (flow data, its AgentSpec or the FlowValidationError it raised)
+        self._compiled: Optional[Tuple[Any, Any]] = None
+        self._reported_invalid: Any = None
     
-    def load_flow(self) -> Dict[str, Any]:
-        """Load the flow configuration"""
-        if not self.flow_path.exists():
-            return {"nodes": [], "edges": []}
+    def _get_snapshot(self, path: Path, default: Dict[str, Any]) -> ConfigSnapshot:
+        """Return the parsed snapshot for a config file, re-parsing only if it changed
         
+        A stat() call is the fast path. If mtime/size/inode changed, the file
+        is read and hashed; the JSON is only re-parsed when the content hash
+        differs from the cached snapshot (e.g. an editor touched the file).
+        """
         try:
-            with open(self.flow_path, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading flow: {e}")
-            return {"nodes": [], "edges": []}
+            st = os.stat(path)
+            stat_key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            stat_key = None
+        
+        snapshot = self._snapshots.get(path)
+        if snapshot is not None and snapshot.stat_key == stat_key:
+            self._stats["hits"] += 1
+            return snapshot
+        
+        with self._snapshot_lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is not None and snapshot.stat_key == stat_key:
+                self._stats["hits"] += 1
+                return snapshot
+            
+            if stat_key is None:
+                new_snapshot = ConfigSnapshot(None, None, _freeze(default))
+            else:
+                try:
+                    with open(path, 'rb') as f:
+                        raw = f.read()
+                except OSError as e:
+                    print(f"Error loading {path.name}: {e}")
+                    raw = None
+                
+                digest = hashlib.sha256(raw).hexdigest() if raw is not None else None
+                if snapshot is not None and digest is not None and snapshot.digest == digest:
+                    # Content unchanged, only the metadata moved
+                    new_snapshot = ConfigSnapshot(stat_key, digest, snapshot.data)
+                    self._snapshots[path] = new_snapshot
+                    self._stats["hits"] += 1
+                    return new_snapshot
+                
+                try:
+                    data = json.loads(raw) if raw is not None else default
+                except Exception as e:
+                    print(f"Error loading {path.name}: {e}")
+                    data = default
+                new_snapshot = ConfigSnapshot(stat_key, digest, _freeze(data))
+            
+            self._snapshots[path] = new_snapshot
+            self._stats["reloads"] += 1
+            return new_snapshot
+    
+    def _flow(self) -> Any:
+        """Read-only flow data from the current snapshot"""
+        return self._get_snapshot(self.flow_path, {"nodes": [], "edges": []}).data
+    
+    def _settings(self) -> Any:
+        """Read-only settings data from the current snapshot"""
+        return self._get_snapshot(self.settings_path, {}).data
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Return how many times config files were re-parsed vs served from cache"""
+        return dict(self._stats)
+    
+    def load_flow(self) -> Dict[str, Any]:
+        """Load the flow configuration"""
+        return _thaw(self._flow())
     
     def save_flow(self, flow_data: Dict[str, Any]) -> bool:
         """Save the flow configuration"""
@@ -43,74 +141,74 @@ class FlowManager:
     
     def load_settings(self) -> Dict[str, Any]:
         """Load settings"""
-        if not self.settings_path.exists():
-            return {}
+        return _thaw(self._settings())
+    
+    def get_agent_spec(self) -> AgentSpec:
+        """Return the compiled AgentSpec for the current flow snapshot
         
+        The flow is compiled once per snapshot, so every getter below is a
+        field lookup instead of a scan over the nodes. The getters fall back
+        to the default agent on an invalid flow; this method is the strict one.
+        
+        Raises:
+            FlowValidationError: if the flow on disk is not a valid agent
+        """
+        snapshot = self._get_snapshot(self.flow_path, {"nodes": [], "edges": []})
+        compiled = self._compiled
+        if compiled is None or compiled[0] is not snapshot.data:
+            try:
+                compiled = (snapshot.data, compile_flow(snapshot.data))
+            except FlowValidationError as e:
+                compiled = (snapshot.data, e)
+            self._compiled = compiled
+        
+        if isinstance(compiled[1], FlowValidationError):
+            raise compiled[1]
+        return compiled[1]
+    
+    def _spec_or_default(self) -> AgentSpec:
+        """The compiled spec, or the default agent if the flow is invalid"""
         try:
-            with open(self.settings_path, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading settings: {e}")
-            return {}
+            return self.get_agent_spec()
+        except FlowValidationError as e:
+            data = self._compiled[0] if self._compiled is not None else None
+            if data is not self._reported_invalid:
+                self._reported_invalid = data
+                print(f"Flow is invalid, using the default agent: {e}")
+            return AgentSpec()
     
     def get_llm_config(self) -> Dict[str, Any]:
         """Extract LLM configuration from the flow"""
-        flow_data = self.load_flow()
-        llm_config = {
-            "provider": "openai",
-            "model": "gpt-4"
+        llm = self._spec_or_default().llm
+        return {
+            "provider": llm.provider,
+            "model": llm.model
         }
-        
-        for node in flow_data.get("nodes", []):
-            if node.get("type") == "llm":
-                llm_config["provider"] = node.get("data", {}).get("provider", "openai")
-                llm_config["model"] = node.get("data", {}).get("model", "gpt-4")
-                break
-        
-        return llm_config
     
     def get_system_prompt(self) -> str:
         """Extract system prompt from the flow"""
-        flow_data = self.load_flow()
-        default_prompt = "You are a helpful assistant for Slack."
-        
-        for node in flow_data.get("nodes", []):
-            if node.get("type") == "systemPrompt":
-                return node.get("data", {}).get("prompt", default_prompt)
-        
-        return default_prompt
+        return self._spec_or_default().system_prompt
     
     def get_tools_config(self) -> List[Dict[str, Any]]:
         """Extract tools configuration from the flow"""
-        flow_data = self.load_flow()
-        tools = []
-        
-        for node in flow_data.get("nodes", []):
-            if node.get("type") == "tools":
-                node_tools = node.get("data", {}).get("tools", [])
-                # Only include enabled tools
-                tools = [tool for tool in node_tools if tool.get("enabled", False)]
-                break
-        
-        return tools
+        # Only enabled tools are compiled into the spec
+        return [_thaw(tool) for tool in self._spec_or_default().tools]
     
     def get_rag_config(self) -> Optional[Dict[str, Any]]:
         """Extract RAG configuration from the flow"""
-        flow_data = self.load_flow()
+        rag = self._spec_or_default().rag
+        if rag is None:
+            return None
         
-        for node in flow_data.get("nodes", []):
-            if node.get("type") == "rag":
-                return {
-                    "provider": node.get("data", {}).get("provider", "pinecone"),
-                    "indexName": node.get("data", {}).get("indexName", "slack-knowledge"),
-                    "enabled": True
-                }
-        
-        return None
+        return {
+            "provider": rag.provider,
+            "indexName": rag.index_name,
+            "enabled": rag.enabled
+        }
     
     def get_pinecone_settings(self) -> Dict[str, Any]:
         """Get Pinecone settings from the settings file"""
-        settings = self.load_settings()
+        settings = self._settings()
         
         if not settings or "pineconeSettings" not in settings:
             return {
@@ -119,7 +217,7 @@ class FlowManager:
                 "indexName": os.environ.get("PINECONE_INDEX", "slack-knowledge")
             }
         
-        pinecone_settings = settings.get("pineconeSettings", {})
+        pinecone_settings = _thaw(settings.get("pineconeSettings", {}))
         
         # Use environment variables as fallback
         if not pinecone_settings.get("apiKey"):
@@ -135,12 +233,11 @@ class FlowManager:
     
     def is_rag_enabled(self) -> bool:
         """Check if RAG is enabled in the flow"""
-        rag_config = self.get_rag_config()
-        return rag_config is not None and rag_config.get("enabled", False)
+        return self._spec_or_default().rag_enabled
     
     def get_active_llm_api_key(self) -> Optional[str]:
         """Get the active LLM API key based on the flow configuration"""
-        settings = self.load_settings()
+        settings = self._settings()
         llm_config = self.get_llm_config()
         
         if not settings or "apiKeys" not in settings:
@@ -166,3 +263,4 @@ if __name__ == "__main__":
     print("RAG Config:", flow_manager.get_rag_config())
     print("Pinecone Settings:", flow_manager.get_pinecone_settings())
     print("RAG Enabled:", flow_manager.is_rag_enabled())
+    print("Cache Stats:", flow_manager.get_cache_stats())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+History Store - Durable chat history for conversations, SQLite by default
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+logger = logging.getLogger("history_store")
+
+_ROLE_TO_MESSAGE = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (conversation_key, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation_key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    summarized_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class StoredConversation:
+    """What a backend returns for one conversation_key"""
+    summary: str = ""
+    summarized_count: int = 0
+    message_count: int = 0
+    # (seq, message) pairs for messages after the summary, oldest first
+    messages: List[Tuple[int, BaseMessage]] = field(default_factory=list)
+
+
+class ChatHistoryBackend(ABC):
+    """Interface for durable per-conversation history"""
+
+    @abstractmethod
+    def load(self, conversation_key: str, limit: int) -> Optional[StoredConversation]:
+        ...
+
+    @abstractmethod
+    def append(self, conversation_key: str, messages: List[Tuple[int, BaseMessage]]):
+        ...
+
+    @abstractmethod
+    def save_summary(self, conversation_key: str, summary: str, summarized_count: int):
+        ...
+
+    @abstractmethod
+    def delete(self, conversation_key: str):
+        ...
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until queued writes are on disk"""
+
+    def close(self):
+        """Flush and release resources"""
+
+
+class SQLiteHistoryBackend(ChatHistoryBackend):
+    """SQLite history with write-behind batching
+
+    Writes are queued and committed by a background thread in batches, so the
+    response path never waits on disk. Reads use their own connection and
+    first flush any writes still queued for the same conversation.
+    """
+
+    def __init__(self, path: Path, batch_size: int = 200, flush_interval: float = 0.5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._pending: Dict[str, int] = {}
+        self._pending_lock = threading.Lock()
+        self.stats = {"batches": 0, "writes": 0, "loads": 0}
+
+        self._read_conn = self._connect()
+        self._read_conn.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+
+        self._writer = threading.Thread(target=self._run_writer, name="history-writer", daemon=True)
+        self._writer.start()
+        # Don't lose the last batch on a normal shutdown
+        atexit.register(self.flush, 2.0)
+
+    @classmethod
+    def from_env(cls) -> Optional["SQLiteHistoryBackend"]:
+        """Create the backend from CONVERSATION_HISTORY_BACKEND / CONVERSATION_HISTORY_PATH"""
+        backend = os.environ.get("CONVERSATION_HISTORY_BACKEND", "sqlite").lower()
+        if backend in ("", "none", "memory"):
+            return None
+        if backend != "sqlite":
+            logger.error(f"Unknown history backend '{backend}', history will not be persisted")
+            return None
+        path = os.environ.get("CONVERSATION_HISTORY_PATH") or Path(__file__).parent / "conversations.db"
+        try:
+            return cls(Path(path))
+        except Exception as e:
+            logger.error(f"Error opening conversation history at {path}: {e}")
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _enqueue(self, conversation_key: str, op: tuple):
+        with self._pending_lock:
+            self._pending[conversation_key] = self._pending.get(conversation_key, 0) + 1
+        self._queue.put((conversation_key,) + op)
+
+    def append(self, conversation_key: str, messages: List[Tuple[int, BaseMessage]]):
+        now = time.time()
+        rows = [(conversation_key, seq, message.type, str(message.content), now) for seq, message in messages]
+        self._enqueue(conversation_key, ("append", rows))
+
+    def save_summary(self, conversation_key: str, summary: str, summarized_count: int):
+        self._enqueue(conversation_key, ("summary", summary, summarized_count))
+
+    def delete(self, conversation_key: str):
+        self._enqueue(conversation_key, ("delete",))
+
+    def load(self, conversation_key: str, limit: int) -> Optional[StoredConversation]:
+        with self._pending_lock:
+            dirty = self._pending.get(conversation_key, 0) > 0
+        if dirty:
+            self.flush()
+
+        with self._read_lock:
+            summary_row = self._read_conn.execute(
+                "SELECT summary, summarized_count FROM summaries WHERE conversation_key = ?",
+                (conversation_key,)
+            ).fetchone()
+            summary, summarized_count = summary_row if summary_row else ("", 0)
+            rows = self._read_conn.execute(
+                "SELECT seq, role, content FROM messages WHERE conversation_key = ? AND seq >= ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation_key, summarized_count, limit)
+            ).fetchall()
+            max_seq = self._read_conn.execute(
+                "SELECT MAX(seq) FROM messages WHERE conversation_key = ?", (conversation_key,)
+            ).fetchone()[0]
+        self.stats["loads"] += 1
+
+        if not summary_row and max_seq is None:
+            return None
+
+        messages = [
+            (seq, _ROLE_TO_MESSAGE.get(role, HumanMessage)(content=content))
+            for seq, role, content in reversed(rows)
+        ]
+        message_count = max(summarized_count, (max_seq + 1) if max_seq is not None else 0)
+        return StoredConversation(summary, summarized_count, message_count, messages)
+
+    def flush(self, timeout: Optional[float] = None):
+        done = threading.Event()
+        self._queue.put((None, "flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self._queue.put((None, "stop", None))
+        self._writer.join(timeout=5)
+        with self._read_lock:
+            self._read_conn.close()
+
+    def _run_writer(self):
+        conn = self._connect()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather more ops until the batch is full, time is up, or someone waits on a flush
+            while len(batch) < self.batch_size and batch[-1][1] not in ("flush", "stop"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                with conn:
+                    for op in batch:
+                        self._apply(conn, op)
+                self.stats["batches"] += 1
+            except Exception as e:
+                logger.error(f"Error writing conversation history: {e}")
+
+            for op in batch:
+                key, kind = op[0], op[1]
+                if kind == "flush":
+                    op[2].set()
+                elif kind == "stop":
+                    running = False
+                elif key is not None:
+                    with self._pending_lock:
+                        self._pending[key] -= 1
+                        if not self._pending[key]:
+                            del self._pending[key]
+        conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, op: tuple):
+        key, kind = op[0], op[1]
+        if kind == "append":
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (conversation_key, seq, role, content, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                op[2]
+            )
+            self.stats["writes"] += len(op[2])
+        elif kind == "summary":
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_key, summary, summarized_count, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, op[2], op[3], time.time())
+            )
+            # Summarized messages are no longer needed to rebuild the conversation
+            conn.execute("DELETE FROM messages WHERE conversation_key = ? AND seq < ?", (key, op[3]))
+            self.stats["writes"] += 1
+        elif kind == "delete":
+            conn.execute("DELETE FROM messages WHERE conversation_key = ?", (key,))
+            conn.execute("DELETE FROM summaries WHERE conversation_key = ?", (key,))
+            self.stats["writes"] += 1
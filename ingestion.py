@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Ingestion - Streams files into the knowledge base: parse, chunk, embed and upsert in batches
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from pinecone_manager import PineconeManager
+
+logger = logging.getLogger("ingestion")
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 150
+DEFAULT_EMBED_BATCH_SIZE = 500
+DEFAULT_UPSERT_BATCH_SIZE = 200
+DEFAULT_CONCURRENCY = 4
+# Seconds between checkpoint writes while a run is going
+CHECKPOINT_INTERVAL = 2.0
+
+TEXT_EXTENSIONS = {".txt", ".md", ".markdown", ".rst", ".csv", ".json", ".html", ".htm", ".xml", ".yaml", ".yml"}
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS | {".pdf", ".docx"}
+
+
+@functools.lru_cache(maxsize=8)
+def _splitter(chunk_size: int, chunk_overlap: int):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def chunk_text(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks, breaking at paragraphs, then lines, then words"""
+    return [chunk for chunk in _splitter(chunk_size, chunk_overlap).split_text(text) if chunk.strip()]
+
+
+def read_text(path: Path) -> str:
+    """Extract the text of a file; PDF and DOCX need pypdf and python-docx"""
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ValueError("Reading PDF files requires pypdf. Install with: pip install pypdf")
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(str(path)).pages)
+    if suffix == ".docx":
+        try:
+            import docx
+        except ImportError:
+            raise ValueError("Reading DOCX files requires python-docx. Install with: pip install python-docx")
+        return "\n\n".join(paragraph.text for paragraph in docx.Document(str(path)).paragraphs)
+    return path.read_text(encoding="utf-8", errors="replace")
+
+
+def parse_file(path: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """Read and chunk one file; runs in a worker process"""
+    return chunk_text(read_text(Path(path)), chunk_size, chunk_overlap)
+
+
+def iter_files(paths: Iterable[str], extensions: Iterable[str] = SUPPORTED_EXTENSIONS) -> Iterator[Path]:
+    """Files named directly, plus supported files found under directories, lazily and in a stable order"""
+    extensions = {extension.lower() for extension in extensions}
+    for path in map(Path, paths):
+        if path.is_dir():
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                for name in sorted(files):
+                    file = Path(root) / name
+                    if file.suffix.lower() in extensions:
+                        yield file
+        elif path.is_file():
+            yield path
+        else:
+            logger.warning(f"Skipping {path}: not a file or directory")
+
+
+def chunk_id(file: Path, index: int) -> str:
+    """Stable vector ID, so re-ingesting a file overwrites its chunks instead of duplicating them"""
+    return f"{hashlib.sha1(str(file.resolve()).encode('utf-8')).hexdigest()[:16]}-{index}"
+
+
+class IngestCheckpoint:
+    """Files already ingested, with the size and mtime they had, kept in a JSON file
+
+    A file is skipped on the next run if it hasn't changed since. Progress
+    is written at most every CHECKPOINT_INTERVAL seconds and on close, via
+    a temporary file so an interrupted run never leaves it corrupt.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        if self.path is not None and self.path.exists():
+            try:
+                self._files = json.loads(self.path.read_text()).get("files", {})
+            except Exception as e:
+                logger.error(f"Error reading checkpoint {self.path}, starting over: {e}")
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def _signature(file: Path) -> Dict[str, int]:
+        stat = file.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def chunk_count(self, file: Path) -> int:
+        """Chunks stored for the file by the last run that ingested it, whether or not it changed since"""
+        return self._files.get(str(file.resolve()), {}).get("chunks", 0)
+
+    def is_done(self, file: Path) -> bool:
+        entry = self._files.get(str(file.resolve()))
+        return entry is not None and {k: entry.get(k) for k in ("size", "mtime_ns")} == self._signature(file)
+
+    def mark_done(self, file: Path, chunks: int):
+        self._files[str(file.resolve())] = {**self._signature(file), "chunks": chunks}
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        self._saved_at = time.monotonic()
+        if self.path is None or not self._dirty:
+            return
+        temp = self.path.with_name(self.path.name + ".tmp")
+        temp.write_text(json.dumps({"files": self._files}))
+        os.replace(temp, self.path)
+        self._dirty = False
+
+
+@dataclass
+class IngestStats:
+    files: int = 0
+    skipped: int = 0
+    failed: int = 0
+    chunks: int = 0
+    vectors: int = 0
+    embed_seconds: float = 0.0
+    upsert_seconds: float = 0.0
+    elapsed: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.vectors / self.elapsed if self.elapsed else 0.0
+
+
+# (file, chunk index, text)
+_Chunk = Tuple[Path, int, str]
+
+
+class IngestionPipeline:
+    """Loads files into a PineconeManager's index as overlapping chunks
+
+    Files are discovered and parsed lazily: a process pool reads and chunks
+    a bounded number of files ahead. Chunks are grouped into batches that
+    are embedded in one request each (through the manager's embedding
+    cache, so unchanged chunks are never re-embedded) and upserted
+    upsert_batch_size vectors per call, with at most `concurrency` batches
+    in flight. A file is checkpointed once all of its chunks are stored.
+    Everything goes into one namespace of the index, "" for the default.
+    Chunk ids are stable per file, so a changed file overwrites its chunks;
+    if it now has fewer, the extra ones recorded in the checkpoint are
+    deleted once the new ones are stored.
+    """
+
+    def __init__(self, pinecone_manager: "PineconeManager", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 chunk_overlap: int = DEFAULT_CHUNK_OVERLAP, embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+                 upsert_batch_size: int = DEFAULT_UPSERT_BATCH_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+                 workers: Optional[int] = None, checkpoint: Optional[IngestCheckpoint] = None,
+                 metadata: Optional[Dict[str, Any]] = None, namespace: str = ""):
+        self.pinecone_manager = pinecone_manager
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.concurrency = max(1, concurrency)
+        # 0 parses in this process, which is simpler to debug and fine for small runs
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.checkpoint = checkpoint if checkpoint is not None else IngestCheckpoint()
+        self.metadata = metadata or {}
+        self.namespace = namespace
+
+    def run(self, paths: Iterable[str]) -> IngestStats:
+        stats = IngestStats()
+        started = time.monotonic()
+        # Chunks of each file still waiting to be stored, and files with a failed batch
+        remaining: Dict[Path, int] = {}
+        chunk_counts: Dict[Path, int] = {}
+        failed: Set[Path] = set()
+        in_flight: Set[Future] = set()
+        batch: List[_Chunk] = []
+
+        def collect(done):
+            for future in done:
+                in_flight.discard(future)
+                chunks, error, embed_seconds, upsert_seconds = future.result()
+                stats.embed_seconds += embed_seconds
+                stats.upsert_seconds += upsert_seconds
+                files = {file for file, _, _ in chunks}
+                if error is not None:
+                    stats.errors.append(error)
+                    failed.update(files)
+                else:
+                    stats.vectors += len(chunks)
+                for file, _, _ in chunks:
+                    remaining[file] -= 1
+                    if not remaining[file]:
+                        self._finish(file, chunk_counts.pop(file), failed, stats)
+                        del remaining[file]
+
+        def submit():
+            nonlocal batch
+            while len(in_flight) >= self.concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(io_pool.submit(self._store, batch))
+            batch = []
+
+        files = self._pending_files(paths, stats)
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="ingest") as io_pool:
+            for file, chunks, error in self._parse(files):
+                if error is not None:
+                    logger.error(f"Error reading {file}: {error}")
+                    stats.errors.append(f"{file}: {error}")
+                    stats.failed += 1
+                    continue
+                stats.chunks += len(chunks)
+                if not chunks:
+                    self._finish(file, 0, failed, stats)
+                    continue
+                remaining[file] = chunk_counts[file] = len(chunks)
+                for index, text in enumerate(chunks):
+                    batch.append((file, index, text))
+                    if len(batch) >= self.embed_batch_size:
+                        submit()
+            if batch:
+                submit()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        self.checkpoint.save()
+        stats.elapsed = time.monotonic() - started
+        return stats
+
+    def _pending_files(self, paths: Iterable[str], stats: IngestStats) -> Iterator[Path]:
+        # Never ingest the checkpoint itself, e.g. when uploading the current directory
+        own_files = set()
+        if self.checkpoint.path is not None:
+            path = self.checkpoint.path.resolve()
+            own_files = {path, path.with_name(path.name + ".tmp")}
+        for file in iter_files(paths):
+            if file.resolve() in own_files:
+                continue
+            if self.checkpoint.is_done(file):
+                stats.skipped += 1
+            else:
+                yield file
+
+    def _parse(self, files: Iterator[Path]) -> Iterator[Tuple[Path, List[str], Optional[str]]]:
+        """(file, chunks, error) in file order, parsing a bounded number of files ahead"""
+        if self.workers <= 0:
+            for file in files:
+                try:
+                    yield file, parse_file(str(file), self.chunk_size, self.chunk_overlap), None
+                except Exception as e:
+                    yield file, [], str(e)
+            return
+
+        # Workers start on the first submit, before any upload thread exists, so
+        # forking them is safe and they inherit the parser imports
+        with ProcessPoolExecutor(self.workers) as parse_pool:
+            ahead: "deque[Tuple[Path, Future]]" = deque()
+            for file in files:
+                ahead.append((file, parse_pool.submit(parse_file, str(file), self.chunk_size, self.chunk_overlap)))
+                if len(ahead) >= self.workers * 2:
+                    yield self._parsed(*ahead.popleft())
+            while ahead:
+                yield self._parsed(*ahead.popleft())
+
+    @staticmethod
+    def _parsed(file: Path, future: Future) -> Tuple[Path, List[str], Optional[str]]:
+        try:
+            return file, future.result(), None
+        except Exception as e:
+            return file, [], str(e)
+
+    def _store(self, chunks: List[_Chunk]) -> Tuple[List[_Chunk], Optional[str], float, float]:
+        """Embed and upsert one batch; errors are returned so the main thread can account for them"""
+        embed_started = time.monotonic()
+        embed_seconds = upsert_seconds = 0.0
+        try:
+            vectors = self.pinecone_manager.embeddings.embed_documents([text for _, _, text in chunks])
+            embed_seconds = time.monotonic() - embed_started
+            records = [
+                {
+                    "id": chunk_id(file, index),
+                    "values": vector,
+                    "metadata": {**self.metadata, "source": str(file), "chunk": index, "text": text},
+                }
+                for (file, index, text), vector in zip(chunks, vectors)
+            ]
+            upsert_started = time.monotonic()
+            self.pinecone_manager.upsert_vectors(records, batch_size=self.upsert_batch_size, namespace=self.namespace)
+            upsert_seconds = time.monotonic() - upsert_started
+            return chunks, None, embed_seconds, upsert_seconds
+        except Exception as e:
+            logger.error(f"Error storing a batch of {len(chunks)} chunks: {e}")
+            return chunks, str(e), embed_seconds, upsert_seconds
+
+    def _finish(self, file: Path, chunks: int, failed: Set[Path], stats: IngestStats):
+        if file in failed:
+            stats.failed += 1
+            return
+        stale = [chunk_id(file, index) for index in range(chunks, self.checkpoint.chunk_count(file))]
+        if stale:
+            try:
+                self.pinecone_manager.delete_vectors(stale, batch_size=self.upsert_batch_size, namespace=self.namespace)
+            except Exception as e:
+                # Left unchecked so the next run tries again
+                logger.error(f"Error deleting {len(stale)} old chunks of {file}: {e}")
+                stats.errors.append(f"{file}: {e}")
+                stats.failed += 1
+                return
+            logger.info(f"Deleted {len(stale)} old chunks of {file}")
+        stats.files += 1
+        self.checkpoint.mark_done(file, chunks)
+        logger.info(f"Ingested {file} ({chunks} chunks)")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Intent Router - Decides per message whether to involve tools and the knowledge base
+"""
+import json
+import logging
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional, Set, Tuple
+
+from flow_compiler import RouterSpec
+
+logger = logging.getLogger("intent_router")
+
+ROUTES = ("tools", "rag")
+
+# Built-in keywords and how strongly each one alone suggests the route
+DEFAULT_TOOL_KEYWORDS = {
+    "weather": 1.0, "temperature": 1.0, "forecast": 1.0,
+    "wikipedia": 1.0, "search": 0.8, "look up": 0.6,
+    "current time": 1.0, "what time": 1.0, "time": 0.6, "date": 0.6, "today": 0.4, "tomorrow": 0.5,
+    "schedule": 1.0, "meeting": 1.0, "calendar": 1.0, "reschedule": 1.0,
+}
+DEFAULT_RAG_KEYWORDS = {
+    # Explicit requests for stored knowledge
+    "knowledge base": 1.0, "knowledge": 0.8, "document": 0.8, "documentation": 0.9, "docs": 0.8,
+    "what do you know about": 1.0, "according to": 0.7, "retrieve": 0.7, "lookup": 0.6, "look up": 0.6,
+    # Question patterns, only decisive together with something else
+    "tell me about": 0.6, "do you know": 0.5, "can you tell me": 0.4, "explain": 0.5, "describe": 0.5,
+    "how does": 0.5, "why does": 0.4, "what is": 0.4, "who is": 0.4, "when is": 0.3, "where is": 0.3,
+    # Domain terms
+    "framework": 0.4, "library": 0.4, "technology": 0.3, "platform": 0.3, "methodology": 0.4,
+    "company": 0.4, "organization": 0.4, "policy": 0.6, "process": 0.3, "history": 0.3,
+}
+# A message that opens with a question word is a weak RAG hint on its own
+QUESTION_PREFIX_WEIGHT = 0.2
+_QUESTION_PREFIX = re.compile(r"^\s*(?:what|who|when|where|why|how)\b", re.IGNORECASE)
+
+# Keyword scores this close to the threshold are handed to the classifier
+DEFAULT_AMBIGUITY = 0.2
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """A regex alternation of the keywords, factored into a prefix trie
+
+    Python's regex engine tries alternatives one by one, so sharing
+    prefixes ("what is", "what time", ...) keeps a failed match to a
+    single character comparison per branch instead of one per keyword.
+    """
+    trie: Dict[str, dict] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        optional = "" in node
+        branches = []
+        for char in sorted(c for c in node if c):
+            atom = r"\s+" if char == " " else re.escape(char)
+            branches.append(atom + build(node[char]))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if optional:
+            body = body + "?" if len(branches) == 1 and len(branches[0]) == 1 else f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    """Where one message should go, with per-route scores in [0, 1]
+
+    confidence is how far the least certain route is from a coin flip:
+    the score of a route that was taken, or one minus the score of a
+    route that was not.
+    """
+    use_tools: bool
+    use_rag: bool
+    scores: Mapping[str, float]
+    confidence: float
+    source: str = "keywords"
+    matches: Tuple[str, ...] = ()
+
+
+class KeywordMatcher:
+    """Finds the keywords of several weighted groups in a single regex pass
+
+    All keywords are compiled into one trie-shaped alternation matched on
+    word boundaries (with an optional plural "s"), so the cost per message
+    is one scan no matter how many keywords are configured.
+    """
+
+    def __init__(self, groups: Mapping[str, Mapping[str, float]]):
+        # keyword -> {group: weight}
+        self._weights: Dict[str, Dict[str, float]] = {}
+        for group, keywords in groups.items():
+            for keyword, weight in keywords.items():
+                keyword = _normalize(keyword)
+                if keyword:
+                    self._weights.setdefault(keyword, {})[group] = min(max(float(weight), 0.0), 1.0)
+        self.groups = tuple(groups)
+
+        self._pattern = None
+        if self._weights:
+            self._pattern = re.compile(rf"\b(?:{_trie_pattern(self._weights)})s?\b", re.IGNORECASE)
+
+    def match(self, text: str) -> Dict[str, Dict[str, float]]:
+        """Matched keywords per group, with their weights"""
+        found: Dict[str, Dict[str, float]] = {group: {} for group in self.groups}
+        if self._pattern is None:
+            return found
+        for matched in self._pattern.findall(text):
+            keyword = matched.lower()
+            weights = self._weights.get(keyword)
+            if weights is None:
+                # Matched with the optional plural suffix, or across extra whitespace
+                keyword = _normalize(keyword)
+                if keyword not in self._weights:
+                    keyword = keyword[:-1]
+                weights = self._weights.get(keyword, {})
+            for group, weight in weights.items():
+                found[group][keyword] = weight
+        return found
+
+
+def _combine(weights: Iterable[float]) -> float:
+    """Noisy-OR: independent hints add up without ever exceeding 1"""
+    miss = 1.0
+    for weight in weights:
+        miss *= 1.0 - weight
+    return 1.0 - miss
+
+
+class IntentClassifier(ABC):
+    """Interface for a local model that scores how likely a message needs each route"""
+
+    @abstractmethod
+    def predict(self, text: str) -> Dict[str, float]:
+        ...
+
+
+class NaiveBayesIntentClassifier(IntentClassifier):
+    """One multinomial naive Bayes model per route, trained on labelled messages
+
+    Small enough to train at startup from a few hundred examples and runs
+    in microseconds, so it can settle borderline keyword scores without a
+    network call.
+    """
+
+    def __init__(self, examples: Iterable[Tuple[str, Set[str]]], routes: Tuple[str, ...] = ROUTES):
+        self.routes = routes
+        # route -> label (True/False) -> token counts
+        self._counts = {route: {True: {}, False: {}} for route in routes}
+        self._totals = {route: {True: 0, False: 0} for route in routes}
+        self._docs = {route: {True: 0, False: 0} for route in routes}
+        vocabulary = set()
+
+        for text, labels in examples:
+            tokens = _TOKEN.findall(text.lower())
+            vocabulary.update(tokens)
+            for route in routes:
+                label = route in labels
+                counts = self._counts[route][label]
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                self._totals[route][label] += len(tokens)
+                self._docs[route][label] += 1
+        self._vocabulary_size = len(vocabulary) or 1
+
+    @classmethod
+    def from_jsonl(cls, path: Path) -> "NaiveBayesIntentClassifier":
+        """Train from a JSON-lines file of {"text": ..., "routes": ["tools", "rag"]}"""
+        examples = []
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    examples.append((example["text"], set(example.get("routes", ()))))
+        logger.info(f"Trained intent classifier on {len(examples)} examples from {path}")
+        return cls(examples)
+
+    def predict(self, text: str) -> Dict[str, float]:
+        tokens = _TOKEN.findall(text.lower())
+        probabilities = {}
+        for route in self.routes:
+            docs = self._docs[route]
+            log_odds = math.log((docs[True] + 1) / (docs[False] + 1))
+            for token in tokens:
+                log_odds += math.log(
+                    (self._counts[route][True].get(token, 0) + 1) / (self._totals[route][True] + self._vocabulary_size)
+                ) - math.log(
+                    (self._counts[route][False].get(token, 0) + 1) / (self._totals[route][False] + self._vocabulary_size)
+                )
+            probabilities[route] = 1.0 / (1.0 + math.exp(-max(min(log_odds, 50.0), -50.0)))
+        return probabilities
+
+
+class CachedClassifier(IntentClassifier):
+    """LRU cache in front of a classifier, keyed by the normalized message"""
+
+    def __init__(self, classifier: IntentClassifier, max_entries: int = 4096):
+        self.classifier = classifier
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def predict(self, text: str) -> Dict[str, float]:
+        key = _normalize(text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+            self.stats["misses"] += 1
+
+        result = self.classifier.predict(text)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+
+class IntentRouter:
+    """Scores a message for each route with precompiled keywords, falling back to a classifier
+
+    Keyword hints are combined per route; a route is taken when its score
+    reaches the threshold. When a classifier is configured, routes whose
+    keyword score lands within `ambiguity` of the threshold are rescored by
+    it instead.
+    """
+
+    def __init__(self, spec: Optional[RouterSpec] = None, classifier: Optional[IntentClassifier] = None,
+                 ambiguity: float = DEFAULT_AMBIGUITY):
+        spec = spec or RouterSpec()
+        tool_keywords = dict(DEFAULT_TOOL_KEYWORDS) if spec.include_defaults else {}
+        tool_keywords.update(spec.tool_keywords)
+        rag_keywords = dict(DEFAULT_RAG_KEYWORDS) if spec.include_defaults else {}
+        rag_keywords.update(spec.rag_keywords)
+
+        self.threshold = spec.threshold
+        self.ambiguity = ambiguity
+        self._matcher = KeywordMatcher({"tools": tool_keywords, "rag": rag_keywords})
+        if classifier is not None and not isinstance(classifier, CachedClassifier):
+            classifier = CachedClassifier(classifier)
+        self.classifier = classifier
+        self.stats = {"routed": 0, "tools": 0, "rag": 0, "classified": 0}
+
+    @classmethod
+    def from_spec(cls, spec: RouterSpec, base_dir: Optional[Path] = None) -> "IntentRouter":
+        """Build a router for the flow, training its classifier if one is configured"""
+        classifier = None
+        if spec.classifier:
+            path = Path(spec.classifier)
+            if not path.is_absolute() and base_dir is not None:
+                path = base_dir / path
+            try:
+                classifier = NaiveBayesIntentClassifier.from_jsonl(path)
+            except Exception as e:
+                logger.error(f"Error loading intent classifier examples from {path}: {e}")
+        return cls(spec, classifier)
+
+    def route(self, text: str, rag_available: bool = True) -> RouteDecision:
+        """Decide the routes for one message"""
+        found = self._matcher.match(text)
+        scores = {route: _combine(found[route].values()) for route in ROUTES}
+        if _QUESTION_PREFIX.match(text):
+            scores["rag"] = _combine((scores["rag"], QUESTION_PREFIX_WEIGHT))
+        active = ROUTES if rag_available else ("tools",)
+        if not rag_available:
+            scores["rag"] = 0.0
+
+        source = "keywords"
+        if self.classifier is not None:
+            ambiguous = [route for route in active if abs(scores[route] - self.threshold) < self.ambiguity]
+            if ambiguous:
+                predicted = self.classifier.predict(text)
+                for route in ambiguous:
+                    scores[route] = predicted.get(route, scores[route])
+                source = "classifier"
+                self.stats["classified"] += 1
+
+        use_tools = scores["tools"] >= self.threshold
+        use_rag = rag_available and scores["rag"] >= self.threshold
+        confidence = min(
+            scores[route] if taken else 1.0 - scores[route]
+            for route, taken in (("tools", use_tools), ("rag", use_rag))
+            if route in active
+        )
+
+        self.stats["routed"] += 1
+        self.stats["tools"] += use_tools
+        self.stats["rag"] += use_rag
+        matches = tuple(sorted({keyword for route in ROUTES for keyword in found[route]}))
+        return RouteDecision(use_tools, use_rag, scores, confidence, source, matches)
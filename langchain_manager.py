@@ -1,39 +1,235 @@
 from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationChain, LLMChain
-from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder, HumanMessagePromptTemplate
-from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
-from langchain.agents import AgentExecutor, AgentType, create_tool_calling_agent
-from langchain.agents.format_scratchpad import format_to_openai_function_messages
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.messages import SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_tools import get_tools
+import asyncio
 import os
+import sys
 import logging
-from flow_manager import FlowManager
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from flow_compiler import COMPONENTS, AgentSpec, FlowValidationError, LLMCacheSpec
+from context_assembly import ContextAssembler
+from conversation_locks import AsyncConversationLocks, ConversationLocks
+from conversation_memory import BackgroundSummarizer, ConversationMemory, TokenCounter
+from conversation_store import ConversationStore, LRUConversationStore
+from flow_manager import FlowManager, _thaw
+from history_store import ChatHistoryBackend, SQLiteHistoryBackend
+from intent_router import IntentRouter, RouteDecision
+from llm_cache import TieredLLMCache, default_cache_path
+from llm_pool import LLMPool
+from model_cascade import ModelCascade
 from pinecone_manager import PineconeManager
+from rate_limiter import (DEFAULT_COMPLETION_TOKENS, PRIORITY_MENTION, RateGovernor, RateLimitedChatModel,
+                          ServiceBusyError, request_priority)
+from retrieval_service import RetrievalService, request_scope
+from semantic_cache import SemanticResponseCache, context_hash
+from tool_callbacks import ToolResultCollector
+
+@dataclass(frozen=True)
+class AgentRuntime:
+    """Everything built from one version of the flow, swapped in as a unit"""
+    spec: AgentSpec
+    llm: Any
+    prompt: PromptTemplate
+    tools: List[Any]
+    pinecone_manager: Optional[PineconeManager]
+    retrieval: Optional[RetrievalService]
+    router: IntentRouter
+    cascade: Optional[ModelCascade]
+    generation: int
+    fingerprints: Mapping[str, str]
+    versions: Mapping[str, int]
+    
+    def component_versions(self, components: Tuple[str, ...]) -> Tuple[int, ...]:
+        """Versions of the given components in this runtime"""
+        return tuple(self.versions[c] for c in components)
+
+# Flow components each kind of shared chain is built from
+CONVERSATION_DEPENDENCIES = ("llm", "systemPrompt")
+AGENT_DEPENDENCIES = ("llm", "systemPrompt", "tools", "rag")
+
+class _SharedChain:
+    """A chain shared by all conversations and the component versions it was built from"""
+    __slots__ = ("chain", "generation", "versions")
+    
+    def __init__(self, chain, generation, versions):
+        self.chain = chain
+        self.generation = generation
+        self.versions = versions
+    
+    def is_stale(self, runtime: AgentRuntime, dependencies: Tuple[str, ...]) -> bool:
+        """True if a newer runtime changed any component this chain depends on"""
+        return (self.generation < runtime.generation
+                and self.versions != runtime.component_versions(dependencies))
+
+AGENT_FALLBACK_RESPONSE = "I processed your request but couldn't generate a proper response. Please try again."
+
+# Print chain/agent traces to stdout; off by default, tool results come from callbacks
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE", "").lower() in ("1", "true", "yes")
+
+# Most recent messages read back when a conversation is reloaded from the history backend
+HISTORY_LOAD_LIMIT = 200
+
+# Rough fixed cost of a memory object, on top of its message history
+_BASE_ENTRY_BYTES = 1024
+
+def _estimate_entry_size(memory: ConversationMemory) -> int:
+    """Approximate memory held by a conversation, dominated by its message history"""
+    messages = memory.messages
+    return (_BASE_ENTRY_BYTES + sys.getsizeof(memory.summary)
+            + sum(sys.getsizeof(message.content) + 256 for message in messages))
 
 class LangChainManager:
     """Manages LangChain components and conversation contexts"""
     
-    def __init__(self):
-        # Initialize Flow Manager
+    def __init__(self, conversation_store: Optional[ConversationStore] = None,
+                 history_backend: Optional[ChatHistoryBackend] = None,
+                 response_cache: Optional[SemanticResponseCache] = None,
+                 rate_governor: Optional[RateGovernor] = None,
+                 context_assembler: Optional[ContextAssembler] = None):
+        # Initialize Flow Manager and compile the flow into an agent spec
         self.flow_manager = FlowManager()
         
-        # Initialize Pinecone Manager if RAG is enabled
-        self.pinecone_manager = None
-        if self.flow_manager.is_rag_enabled():
-            self.pinecone_manager = PineconeManager()
+        # Exact-match LLM caches by configuration, kept across reloads of the llm node
+        self._llm_caches: Dict[LLMCacheSpec, TieredLLMCache] = {}
+        
+        # Per-provider request/token budgets (<PROVIDER>_RPM / <PROVIDER>_TPM), shared
+        # by every model of that provider and kept across reloads
+        self.rate_governor = rate_governor or RateGovernor.from_env()
         
-        # Get LLM configuration from Flow Manager
-        llm_config = self.flow_manager.get_llm_config()
+        # Token counting and the summarizer are shared by every conversation's memory
+        self._token_counter = TokenCounter()
+        self._summarizer = BackgroundSummarizer(lambda: self._runtime.llm)
+        
+        # Knowledge base results are deduplicated and fitted to RAG_CONTEXT_MAX_TOKENS
+        # before they go into a direct RAG prompt
+        self.context_assembler = context_assembler or ContextAssembler.from_env(self._token_counter)
+        
+        # Everything derived from the flow lives in one runtime object that
+        # reload_configuration() replaces with a single assignment
+        try:
+            spec = self.flow_manager.get_agent_spec()
+        except FlowValidationError as e:
+            # Start with the default agent; a reload picks up the flow once it is fixed
+            logging.error(f"Invalid flow, starting with the default agent: {e}")
+            spec = AgentSpec()
+        self._runtime = self._build_runtime(spec)
+        self._reload_lock = threading.Lock()
+        
+        # The conversation chain and agent executor are stateless, so one of each
+        # is shared by every conversation and rebuilt only when the flow changes
+        self._shared_chains: Dict[str, _SharedChain] = {}
+        self._shared_lock = threading.Lock()
+        
+        # Store only the chat history per user/channel, bounded by
+        # CONVERSATION_MAX_ENTRIES / CONVERSATION_TTL_SECONDS / CONVERSATION_MAX_MEMORY_MB
+        self.user_conversations = conversation_store or LRUConversationStore.from_env(size_of=_estimate_entry_size)
+        
+        # Turns of one conversation run one at a time in arrival order, so they
+        # never interleave their memory reads and writes; different
+        # conversations still run fully in parallel
+        self._conversation_locks = ConversationLocks()
+        self._async_conversation_locks = AsyncConversationLocks()
+        
+        # Durable history (SQLite by default) so conversations survive restarts and
+        # evicted conversations are lazily reloaded on their next message
+        self.history_backend = history_backend or SQLiteHistoryBackend.from_env()
+        
+        # Optional cache of knowledge base answers for repeated questions (SEMANTIC_CACHE=1)
+        self.response_cache = response_cache or SemanticResponseCache.from_env()
+    
+    @property
+    def spec(self) -> AgentSpec:
+        return self._runtime.spec
+    
+    @property
+    def llm(self):
+        return self._runtime.llm
+    
+    @property
+    def prompt(self) -> PromptTemplate:
+        return self._runtime.prompt
+    
+    @property
+    def tools(self):
+        return self._runtime.tools
+    
+    @property
+    def pinecone_manager(self) -> Optional[PineconeManager]:
+        return self._runtime.pinecone_manager
+    
+    def _build_runtime(self, spec: AgentSpec, previous: Optional[AgentRuntime] = None) -> AgentRuntime:
+        """
+        Build the LLM, prompt, retriever and tools for a spec without touching live state
+        
+        When a previous runtime is given, only components whose fingerprint
+        changed are rebuilt; everything else is carried over as-is.
+        """
+        fingerprints = spec.component_fingerprints()
+        
+        if previous is None:
+            changed = set(COMPONENTS)
+            versions = {component: 1 for component in COMPONENTS}
+            generation = 1
+        else:
+            changed = {c for c in COMPONENTS if fingerprints[c] != previous.fingerprints[c]}
+            versions = {c: previous.versions[c] + (c in changed) for c in COMPONENTS}
+            generation = previous.generation + 1
+            logging.info(f"Flow components changed: {sorted(changed) or 'none'}")
+        
+        # Initialize Pinecone Manager if RAG is enabled
+        if "rag" in changed:
+            pinecone_manager = self._create_knowledge_base(spec.rag) if spec.rag_enabled else None
+            # Direct RAG answers and the knowledge_base_search tool share one lookup path
+            retrieval = RetrievalService(
+                pinecone_manager, partition=spec.rag.partition, metadata_filter=spec.rag.metadata_filter
+            ) if pinecone_manager is not None else None
+        else:
+            pinecone_manager, retrieval = previous.pinecone_manager, previous.retrieval
         
         # Initialize the language model based on flow configuration
-        self._initialize_llm(llm_config)
+        if "llm" in changed:
+            llm = self._create_llm(spec.llm)
+            cascade = self._create_cascade(spec.llm)
+        else:
+            llm, cascade = previous.llm, previous.cascade
+        
+        # Create the conversation template using system prompt from the spec
+        if "systemPrompt" in changed:
+            prompt = self._create_prompt(spec.system_prompt)
+        else:
+            prompt = previous.prompt
+        
+        # Initialize tools based on flow configuration; the RAG tool wraps the retriever
+        if changed & {"tools", "rag"}:
+            tools = self._get_configured_tools(spec, retrieval)
+        else:
+            tools = previous.tools
+        
+        # Precompile the routing keywords (and train the classifier) once per flow version
+        if "router" in changed:
+            router = IntentRouter.from_spec(spec.router, self.flow_manager.config_dir)
+        else:
+            router = previous.router
         
-        # Create the conversation template using system prompt from Flow Manager
-        system_prompt = self.flow_manager.get_system_prompt()
-        self.template = f"""
+        return AgentRuntime(spec, llm, prompt, tools, pinecone_manager, retrieval, router, cascade,
+                            generation, fingerprints, versions)
+    
+    def _create_knowledge_base(self, rag_spec) -> PineconeManager:
+        """The vector index selected by the rag node's provider"""
+        if rag_spec.provider == "local":
+            return PineconeManager(provider="local", index_name=rag_spec.index_name, local_path=rag_spec.path,
+                                   quantization=rag_spec.quantization, retrieval=rag_spec.retrieval)
+        return PineconeManager(retrieval=rag_spec.retrieval)
+    
+    def _create_prompt(self, system_prompt):
+        """Create the conversation prompt template for a system prompt"""
+        template = f"""
         {system_prompt}
         
         Current conversation:
@@ -42,64 +238,119 @@ class LangChainManager:
         AI Assistant:
         """
         
-        self.prompt = PromptTemplate(
+        return PromptTemplate(
             input_variables=["history", "input"],
-            template=self.template
+            template=template
         )
-        
-        # Initialize tools based on flow configuration
-        self.tools = self._get_configured_tools()
-        
-        # Store conversation contexts for different users/channels
-        self.user_conversations = {}
-        self.user_agents = {}
     
-    def _initialize_llm(self, llm_config):
-        """Initialize the LLM based on the flow configuration"""
-        provider = llm_config.get("provider", "openai").lower()
-        model = llm_config.get("model", "gpt-4")
+    def _create_llm(self, llm_spec):
+        """Create the LLM based on the flow configuration"""
+        # Identical calls (same model, temperature and messages) are answered from
+        # the cache when the llm node enables it; None leaves caching off
+        cache = self._get_llm_cache(llm_spec.cache)
+        llm = self._create_chat_model(llm_spec.provider, llm_spec.model, cache)
+        
+        if not llm_spec.fallbacks:
+            return llm
+        
+        # Pool the primary model with its fallbacks; each call goes to the fastest
+        # healthy one and fails over (or is hedged) to the others
+        backends = [llm] + [self._create_chat_model(p, m, cache) for p, m in llm_spec.fallbacks]
+        names = [f"{p}:{m}" for p, m in ((llm_spec.provider, llm_spec.model),) + llm_spec.fallbacks]
+        logging.info(f"Pooling LLM backends {names} (hedging {'on' if llm_spec.hedge else 'off'})")
+        return LLMPool(backends=backends, names=names, hedge=llm_spec.hedge)
+    
+    def _create_cascade(self, llm_spec) -> Optional[ModelCascade]:
+        """The small model that answers conversation turns first, if the llm node sets one"""
+        cascade = llm_spec.cascade
+        if cascade is None:
+            return None
+        small_llm = self._create_chat_model(cascade.provider, cascade.model, self._get_llm_cache(llm_spec.cache))
+        logging.info(f"Cascading conversation turns through {cascade.provider}:{cascade.model}")
+        return ModelCascade(small_llm, cascade.min_confidence, name=f"{cascade.provider}:{cascade.model}")
+    
+    def _create_chat_model(self, provider, model, cache=None):
+        """Create one provider's chat model, behind its rate limiter if it has a budget"""
+        limiter = self.rate_governor.limiter(provider)
+        if limiter is None:
+            return self._create_provider_model(provider, model, cache)
+        # The cache goes on the outer model so hits are answered before the limiter is asked
+        llm = self._create_provider_model(provider, model)
+        return RateLimitedChatModel(
+            inner=llm,
+            limiter=limiter,
+            token_counter=self._token_counter,
+            completion_tokens=getattr(llm, "max_tokens", None) or DEFAULT_COMPLETION_TOKENS,
+            cache=cache
+        )
+    
+    def _create_provider_model(self, provider, model, cache=None):
+        provider = provider.lower()
         
         if provider == "openai":
-            self.llm = ChatOpenAI(
+            return ChatOpenAI(
                 temperature=0.7,
                 model_name=model,
+                # Report token usage on streams too, so the rate limiter can settle them
+                stream_usage=True,
+                cache=cache,
             )
         elif provider == "groq":
             from langchain_groq import ChatGroq
-            self.llm = ChatGroq(
+            return ChatGroq(
                 temperature=0.7,
                 model_name=model,
-                api_key=os.environ.get("GROQ_API_KEY")
+                api_key=os.environ.get("GROQ_API_KEY"),
+                cache=cache,
             )
         elif provider == "hyperbolic":
             from langchain_community.chat_models import ChatHyperbolic
-            self.llm = ChatHyperbolic(
+            return ChatHyperbolic(
                 temperature=0.7,
                 model_name=model,
-                api_key=os.environ.get("HYPERBOLIC_API_KEY")
+                api_key=os.environ.get("HYPERBOLIC_API_KEY"),
+                cache=cache,
             )
         else:
             # Default to OpenAI if provider not recognized
-            self.llm = ChatOpenAI(
+            return ChatOpenAI(
                 temperature=0.7,
                 model_name="gpt-4",
+                stream_usage=True,
+                cache=cache,
+            )
+    
+    def _get_llm_cache(self, cache_spec: LLMCacheSpec) -> Optional[TieredLLMCache]:
+        """The shared exact-match cache for a cache configuration, or None if disabled"""
+        if not cache_spec.enabled:
+            return None
+        cache = self._llm_caches.get(cache_spec)
+        if cache is None:
+            cache = TieredLLMCache(
+                max_entries=cache_spec.max_entries,
+                path=default_cache_path() if cache_spec.persist else None,
+                ttl_seconds=cache_spec.ttl_seconds,
             )
+            self._llm_caches[cache_spec] = cache
+        return cache
     
-    def _get_configured_tools(self):
+    def _get_configured_tools(self, spec, retrieval):
         """Get tools based on flow configuration"""
         all_tools = get_tools()
-        configured_tools = self.flow_manager.get_tools_config()
+        # Plain dicts, so the log below reads like the flow file
+        configured_tools = [_thaw(tool) for tool in spec.tools]
         
         # Debug logging
         logging.info(f"Available tools: {[tool.name for tool in all_tools]}")
         logging.info(f"Configured tools: {configured_tools}")
         
         # If RAG is enabled, add the RAG tool
-        if self.flow_manager.is_rag_enabled() and self.pinecone_manager and self.pinecone_manager.is_initialized():
+        if spec.rag_enabled and retrieval and retrieval.is_initialized():
             from langchain.tools.retriever import create_retriever_tool
             
-            # Create a retriever from Pinecone
-            retriever = self.pinecone_manager.create_langchain_retriever()
+            # The tool searches through the same service as direct RAG answers, so a
+            # search the direct path already made in this request isn't repeated
+            retriever = retrieval.as_retriever()
             
             if retriever:
                 # Create a retriever tool with a more descriptive name and instructions
@@ -146,275 +397,614 @@ class LangChainManager:
         logging.info(f"Final filtered tools: {[tool.name for tool in filtered_tools]}")
         return filtered_tools
     
-    def get_conversation(self, conversation_key):
-        """Get or create a conversation chain for a specific user/channel"""
-        if conversation_key not in self.user_conversations:
-            self.user_conversations[conversation_key] = ConversationChain(
-                llm=self.llm,
-                prompt=self.prompt,
-                memory=ConversationBufferMemory(return_messages=True),
-                verbose=True
-            )
+    def get_memory(self, conversation_key, runtime=None):
+        """
+        Get or create the chat history for a specific user/channel
         
-        return self.user_conversations[conversation_key]
+        Callers hold the conversation's lock, which makes the check-then-create
+        atomic without holding the store lock while the history loads.
+        """
+        runtime = runtime or self._runtime
+        memory_spec = runtime.spec.memory
+        memory = self.user_conversations.get(conversation_key)
+        
+        if memory is None:
+            memory = ConversationMemory(memory_spec, self._token_counter, self._summarizer,
+                                        self.history_backend, conversation_key)
+            if self.history_backend is not None:
+                stored = self.history_backend.load(conversation_key, limit=HISTORY_LOAD_LIMIT)
+                if stored is not None:
+                    memory.restore(stored)
+            self.user_conversations.put(conversation_key, memory)
+        elif memory.spec != memory_spec:
+            # The memory node changed in a reload; apply it on next use
+            memory.configure(memory_spec)
+        
+        return memory
     
-    def get_agent(self, conversation_key):
-        """Get or create an agent for a specific user/channel"""
-        if conversation_key not in self.user_agents:
-            try:
-                # Create a memory for the agent
-                memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-                
-                # Get the system prompt
-                system_prompt = self.flow_manager.get_system_prompt()
-                
-                # Create a prompt for the agent with system message
-                prompt = ChatPromptTemplate.from_messages([
-                    SystemMessage(content=system_prompt),
-                    MessagesPlaceholder(variable_name="chat_history"),
-                    HumanMessagePromptTemplate.from_template("{input}"),
-                    MessagesPlaceholder(variable_name="agent_scratchpad")
-                ])
-                
-                # Create the agent using the newer tool_calling_agent approach
-                from langchain.agents import create_tool_calling_agent
-                
-                # Create the agent
-                agent = create_tool_calling_agent(
-                    llm=self.llm,
-                    tools=self.tools,
-                    prompt=prompt
-                )
-                
-                # Create the agent executor
-                self.user_agents[conversation_key] = AgentExecutor.from_agent_and_tools(
-                    agent=agent,
-                    tools=self.tools,
-                    memory=memory,
-                    verbose=True,
-                    handle_parsing_errors=True,
-                    max_iterations=3
-                )
-                
-                logging.info(f"Successfully created agent for {conversation_key} with {len(self.tools)} tools")
-            except Exception as e:
-                logging.error(f"Error creating agent: {e}")
-                # Fall back to a simple conversation chain if agent creation fails
-                return self.get_conversation(conversation_key)
+    def get_conversation(self, runtime=None):
+        """Get the shared conversation chain for the current configuration"""
+        return self._get_shared_chain("conversation", CONVERSATION_DEPENDENCIES,
+                                      self._create_conversation_chain, runtime)
+    
+    def get_agent(self, runtime=None):
+        """Get the shared agent executor, or None if it could not be created"""
+        try:
+            return self._get_shared_chain("agent", AGENT_DEPENDENCIES, self._create_agent_executor, runtime)
+        except Exception as e:
+            logging.error(f"Error creating agent: {e}")
+            return None
+    
+    def _get_shared_chain(self, name, dependencies, factory, runtime=None):
+        """Return a shared chain, rebuilding it lazily if a component it depends on changed"""
+        runtime = runtime or self._runtime
+        shared = self._shared_chains.get(name)
+        
+        if shared is None or shared.is_stale(runtime, dependencies):
+            with self._shared_lock:
+                shared = self._shared_chains.get(name)
+                if shared is None or shared.is_stale(runtime, dependencies):
+                    shared = _SharedChain(factory(runtime), runtime.generation,
+                                          runtime.component_versions(dependencies))
+                    self._shared_chains[name] = shared
+        
+        return shared.chain
+    
+    def _create_conversation_chain(self, runtime):
+        """Build the prompt -> LLM chain used for plain conversation"""
+        return runtime.prompt | runtime.llm | StrOutputParser()
+    
+    def _create_agent_executor(self, runtime):
+        """Build the tool-calling agent executor; chat history is passed in per call"""
+        # Get the system prompt
+        system_prompt = runtime.spec.system_prompt
+        
+        # Create a prompt for the agent with system message
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=system_prompt),
+            MessagesPlaceholder(variable_name="chat_history"),
+            HumanMessagePromptTemplate.from_template("{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad")
+        ])
+        
+        # Create the agent using the newer tool_calling_agent approach
+        agent = create_tool_calling_agent(
+            llm=runtime.llm,
+            tools=runtime.tools,
+            prompt=prompt
+        )
+        
+        # Create the agent executor without memory so it can be shared
+        executor = AgentExecutor.from_agent_and_tools(
+            agent=agent,
+            tools=runtime.tools,
+            verbose=AGENT_VERBOSE,
+            handle_parsing_errors=True,
+            max_iterations=3
+        )
+        
+        logging.info(f"Successfully created shared agent with {len(runtime.tools)} tools")
+        return executor
+    
+    def _run_conversation(self, conversation_key, text, runtime):
+        """Answer with the shared conversation chain and this conversation's history"""
+        memory = self.get_memory(conversation_key, runtime)
+        inputs = {"history": memory.load_buffer(), "input": text}
+        
+        # In cascade mode the small model answers first; None means escalate
+        response = runtime.cascade.answer(runtime.prompt.format(**inputs), text) if runtime.cascade else None
+        if response is None:
+            started = time.monotonic()
+            response = self.get_conversation(runtime).invoke(inputs)
+            if runtime.cascade is not None:
+                runtime.cascade.record_large(time.monotonic() - started)
+        
+        memory.save_context({"input": text}, {"output": response})
+        return response
+    
+    def _run_agent(self, agent, conversation_key, text, runtime):
+        """Run the shared agent with this conversation's history and record the turn"""
+        memory = self.get_memory(conversation_key, runtime)
+        
+        # Collect tool results through callbacks scoped to this request
+        collector = ToolResultCollector(runtime.tools)
         
-        return self.user_agents[conversation_key]
+        # Run the shared agent with this conversation's history
+        agent_result = agent.invoke(
+            {"input": text, "chat_history": memory.load_messages()},
+            config={"callbacks": [collector]}
+        )
+        self._record_agent_turn(runtime)
+        
+        response = self._agent_response(agent_result, collector)
+        if response is None:
+            # If still no response, return a fallback message
+            return AGENT_FALLBACK_RESPONSE
+        
+        memory.save_context({"input": text}, {"output": response})
+        return response
+    
+    async def _arun_agent(self, agent, conversation_key, text, runtime):
+        """Async version of _run_agent"""
+        # Loading a conversation may hit the history database
+        memory = await asyncio.to_thread(self.get_memory, conversation_key, runtime)
+        collector = ToolResultCollector(runtime.tools)
+        
+        agent_result = await agent.ainvoke(
+            {"input": text, "chat_history": memory.load_messages()},
+            config={"callbacks": [collector]}
+        )
+        self._record_agent_turn(runtime)
+        
+        response = self._agent_response(agent_result, collector)
+        if response is None:
+            return AGENT_FALLBACK_RESPONSE
+        
+        memory.save_context({"input": text}, {"output": response})
+        return response
+    
+    def _record_agent_turn(self, runtime):
+        """Count a turn the agent answered as escalated past the cascade's small model
+        
+        Only recorded once the agent has run, so a turn that falls back to the
+        conversation is counted there instead, and only once.
+        """
+        if runtime.cascade is not None:
+            runtime.cascade.record_tool_turn()
+    
+    def _retrieve(self, text, runtime):
+        """
+        Query the knowledge base for a direct RAG answer
+        
+        Returns (results, cached answer or None, cache key). With the semantic
+        cache on, the question is embedded once and the vector is used both for
+        the Pinecone query and the cache lookup.
+        """
+        retrieval = runtime.retrieval
+        # Identifier lookups are answered by keyword search, which needs no embedding
+        if self.response_cache is None or retrieval.answers_lexically(text):
+            return retrieval.query(text), None, None
+        
+        embedding = retrieval.embed(text)
+        results = retrieval.query(text)
+        return self._check_response_cache(embedding, results, runtime)
+    
+    async def _aretrieve(self, text, runtime):
+        """Async version of _retrieve"""
+        retrieval = runtime.retrieval
+        if self.response_cache is None or retrieval.answers_lexically(text):
+            return await retrieval.aquery(text), None, None
+        
+        embedding = await retrieval.aembed(text)
+        results = await retrieval.aquery(text)
+        return self._check_response_cache(embedding, results, runtime)
+    
+    def _check_response_cache(self, embedding, results, runtime):
+        if not results:
+            return results, None, None
+        # Answers are only reused for the same model over the same retrieved context
+        cache_key = (embedding, context_hash(results), runtime.fingerprints["llm"])
+        return results, self.response_cache.lookup(*cache_key), cache_key
+    
+    def _remember_answer(self, text, cache_key, answer):
+        """Store a generated RAG answer in the semantic cache"""
+        if cache_key is not None:
+            embedding, context, scope = cache_key
+            self.response_cache.store(text, embedding, context, answer, scope)
+    
+    def _build_rag_prompt(self, text, results):
+        """Build the direct-answer prompt from knowledge base results"""
+        # Drop near-duplicate chunks and keep the rest within the context budget
+        results = self.context_assembler.assemble(text, results).results
+        
+        # Format the context from the knowledge base
+        context = "\n\n".join([
+            f"Source: {result.get('metadata', {}).get('source', 'Unknown')}\n{result.get('text', '')}" 
+            for result in results
+        ])
+        
+        # Create a prompt with the context
+        return f"""
+        You are a helpful assistant for Slack. 
+        
+        Use the following information to answer the user's question:
+        {context}
+        
+        User question: {text}
+        
+        If the information provided doesn't fully answer the user's question, acknowledge that and provide what you can based on the given information.
+        """
     
-    def generate_response(self, conversation_key, text):
-        """Generate a response using the appropriate conversation chain"""
-        # Check if the query might need tools
-        use_tools = self._might_need_tools(text)
+    def _agent_response(self, agent_result, collector):
+        """Pick the answer for an agent run, or None if it produced nothing usable"""
+        # A return_direct tool's output (e.g. a scheduled meeting) is the answer as-is
+        direct = collector.direct_result()
+        response = direct.output if direct else agent_result.get("output")
         
-        # Check if the query might need RAG
-        use_rag = self._might_need_rag(text)
+        if not response and collector.results:
+            response = collector.results[-1].output
+        
+        return response or None
+    
+    def generate_response(self, conversation_key, text, priority=PRIORITY_MENTION, context=None):
+        """
+        Generate a response using the appropriate conversation chain
+        
+        LLM calls wait for their provider's budget at the given priority and
+        raise ServiceBusyError when they can't be admitted. The message is
+        embedded and looked up in the knowledge base at most once, whether the
+        direct RAG answer or the agent's knowledge_base_search tool asks, in the
+        partition of the SlackContext given as context.
+        """
+        with self._conversation_locks.hold(conversation_key), request_priority(priority), request_scope(context):
+            try:
+                return self._generate_response(conversation_key, text)
+            finally:
+                # The turn grew this conversation's memory; let the store re-check its budget
+                self.user_conversations.touch(conversation_key)
+    
+    def _generate_response(self, conversation_key, text):
+        # Pin the runtime so a concurrent reload can't change it mid-request
+        runtime = self._runtime
+        pinecone_manager = runtime.pinecone_manager
+        
+        # Decide in one precompiled pass whether tools and/or the knowledge base are needed
+        route = self._route(text, runtime)
+        use_tools, use_rag = route.use_tools, route.use_rag
         
         logging.info(f"Using {'RAG' if use_rag else 'standard conversation'} for query: '{text}'")
         
         # If RAG is needed and available, use it directly
-        if use_rag and self.pinecone_manager and self.pinecone_manager.is_initialized():
+        if use_rag and pinecone_manager and pinecone_manager.is_initialized():
             try:
                 # Query the knowledge base
-                results = self.pinecone_manager.query(text, top_k=3)
+                results, cached, cache_key = self._retrieve(text, runtime)
+                if cached is not None:
+                    return cached
                 
                 if results and len(results) > 0:
-                    # Format the context from the knowledge base
-                    context = "\n\n".join([
-                        f"Source: {result.get('metadata', {}).get('source', 'Unknown')}\n{result.get('text', '')}" 
-                        for result in results
-                    ])
-                    
-                    # Create a prompt with the context
-                    rag_prompt = f"""
-                    You are a helpful assistant for Slack. 
-                    
-                    Use the following information to answer the user's question:
-                    {context}
-                    
-                    User question: {text}
-                    
-                    If the information provided doesn't fully answer the user's question, acknowledge that and provide what you can based on the given information.
-                    """
-                    
                     # Get a direct response from the LLM with the context
-                    response = self.llm.invoke(rag_prompt)
+                    response = runtime.llm.invoke(self._build_rag_prompt(text, results))
+                    self._remember_answer(text, cache_key, response.content)
                     return response.content
+            except ServiceBusyError:
+                # Out of provider budget; falling back would only queue again
+                raise
             except Exception as e:
                 logging.error(f"Error using RAG: {e}")
                 # Fall back to standard conversation if RAG fails
         
         # Try to use the agent if tools or RAG are needed
         try:
-            if use_tools or use_rag:
-                agent = self.get_agent(conversation_key)
-                
-                # Capture stdout to get the full tool output
-                import io
-                import sys
-                from contextlib import redirect_stdout
-                
-                # Use a StringIO object to capture stdout
-                f = io.StringIO()
-                with redirect_stdout(f):
-                    # Run the agent
-                    agent_result = agent.invoke({"input": text})
-                
-                # Get the captured output
-                output = f.getvalue()
-                
-                # Check if we have a direct tool output in the stdout
-                import re
-                tool_output_match = re.search(r'✅ Meeting scheduled successfully!(.*?)> Finished chain', output, re.DOTALL)
-                
-                if tool_output_match:
-                    # Extract the tool output
-                    tool_output = tool_output_match.group(1).strip()
-                    return f"✅ Meeting scheduled successfully!{tool_output}"
-                
-                # If no direct tool output found, use the agent's response
-                response = agent_result.get("response")
-                
-                # If response is None, try to extract it from the output
-                if response is None:
-                    # Try to extract any meaningful output
-                    clean_output = re.sub(r'> (Entering|Finished) new AgentExecutor chain\.\.\.', '', output)
-                    clean_output = re.sub(r'Invoking: .*?with.*?\n', '', clean_output)
-                    clean_output = clean_output.strip()
-                    
-                    if clean_output:
-                        return clean_output
-                    
-                    # If still no response, return a fallback message
-                    return "I processed your request but couldn't generate a proper response. Please try again."
-                
-                return response
+            agent = self.get_agent(runtime) if use_tools or use_rag else None
+            
+            if agent is not None:
+                return self._run_agent(agent, conversation_key, text, runtime)
             else:
                 # Use standard conversation for simple queries
-                conversation = self.get_conversation(conversation_key)
-                return conversation.invoke({"input": text}).get("response")
+                return self._run_conversation(conversation_key, text, runtime)
+        except ServiceBusyError:
+            raise
         except Exception as e:
             logging.error(f"Agent execution failed: {e}")
             # Fall back to standard conversation if agent fails
-            conversation = self.get_conversation(conversation_key)
-            return conversation.invoke({"input": text}).get("response")
-    
-    def _might_need_tools(self, text):
-        """Check if a query might benefit from using tools"""
-        # Simple heuristic to check if the query might need tools
-        tool_keywords = [
-            "weather", "temperature", "forecast",
-            "wikipedia", "information", "search",
-            "time", "date", "current time", "schedule", "meeting"
-        ]
-        
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in tool_keywords)
-    
-    def _might_need_rag(self, text):
-        """Check if a query might benefit from using RAG"""
-        # Only consider RAG if it's enabled and initialized
-        if not self.flow_manager.is_rag_enabled() or not self.pinecone_manager or not self.pinecone_manager.is_initialized():
-            return False
-        
-        # More comprehensive heuristic to check if the query might need RAG
-        rag_keywords = [
-            # General knowledge retrieval keywords
-            "knowledge", "document", "information", "data",
-            "find", "search", "lookup", "retrieve", "get",
-            
-            # Question patterns
-            "what do you know about", "tell me about", "do you know", 
-            "can you tell me", "what is", "who is", "when is", "where is",
-            "how does", "why does", "explain", "describe",
-            
-            # Domain-specific keywords
-            "framework", "library", "tool", "technology", "platform",
-            "language", "concept", "theory", "approach", "methodology",
-            "company", "organization", "person", "event", "history"
-        ]
+            return self._run_conversation(conversation_key, text, runtime)
+    
+    async def agenerate_response(self, conversation_key, text, priority=PRIORITY_MENTION, context=None):
+        """Async version of generate_response for the AsyncApp pipeline"""
+        async with self._async_conversation_locks.hold(conversation_key):
+            with request_priority(priority), request_scope(context):
+                try:
+                    return await self._agenerate_response(conversation_key, text)
+                finally:
+                    self.user_conversations.touch(conversation_key)
+    
+    async def _agenerate_response(self, conversation_key, text):
+        # Pin the runtime so a concurrent reload can't change it mid-request
+        runtime = self._runtime
+        pinecone_manager = runtime.pinecone_manager
         
-        text_lower = text.lower()
+        route = self._route(text, runtime)
+        use_tools, use_rag = route.use_tools, route.use_rag
         
-        # Check for exact keyword matches
-        if any(keyword in text_lower for keyword in rag_keywords):
-            return True
-            
-        # Check for question-like patterns that might benefit from RAG
-        if text_lower.startswith(("what", "who", "when", "where", "why", "how")):
-            return True
+        logging.info(f"Using {'RAG' if use_rag else 'standard conversation'} for query: '{text}'")
+        
+        # If RAG is needed and available, use it directly
+        if use_rag and pinecone_manager and pinecone_manager.is_initialized():
+            try:
+                results, cached, cache_key = await self._aretrieve(text, runtime)
+                if cached is not None:
+                    return cached
+                
+                if results:
+                    response = await runtime.llm.ainvoke(self._build_rag_prompt(text, results))
+                    self._remember_answer(text, cache_key, response.content)
+                    return response.content
+            except ServiceBusyError:
+                raise
+            except Exception as e:
+                logging.error(f"Error using RAG: {e}")
+                # Fall back to standard conversation if RAG fails
+        
+        try:
+            agent = self.get_agent(runtime) if use_tools or use_rag else None
             
-        # If the query is longer than 5 words, it's likely a complex question that might benefit from RAG
-        if len(text_lower.split()) > 5:
-            return True
+            if agent is not None:
+                return await self._arun_agent(agent, conversation_key, text, runtime)
+            else:
+                return await self._arun_conversation(conversation_key, text, runtime)
+        except ServiceBusyError:
+            raise
+        except Exception as e:
+            logging.error(f"Agent execution failed: {e}")
+            return await self._arun_conversation(conversation_key, text, runtime)
+    
+    async def _arun_conversation(self, conversation_key, text, runtime):
+        """Async version of _run_conversation"""
+        memory = await asyncio.to_thread(self.get_memory, conversation_key, runtime)
+        inputs = {"history": memory.load_buffer(), "input": text}
+        
+        response = await runtime.cascade.aanswer(runtime.prompt.format(**inputs), text) if runtime.cascade else None
+        if response is None:
+            started = time.monotonic()
+            response = await self.get_conversation(runtime).ainvoke(inputs)
+            if runtime.cascade is not None:
+                runtime.cascade.record_large(time.monotonic() - started)
+        
+        memory.save_context({"input": text}, {"output": response})
+        return response
+    
+    def stream_response(self, conversation_key, text, priority=PRIORITY_MENTION, context=None):
+        """
+        Generate a response incrementally
+        
+        Yields the full response text so far each time it grows; the last value
+        yielded is the final answer. Plain conversation and direct RAG answers
+        stream token by token; agent runs yield once they finish. The
+        conversation stays locked until the generator is exhausted or closed.
+        """
+        with self._conversation_locks.hold(conversation_key), request_priority(priority), request_scope(context):
+            try:
+                yield from self._stream_response(conversation_key, text)
+            finally:
+                self.user_conversations.touch(conversation_key)
+    
+    def _stream_response(self, conversation_key, text):
+        runtime = self._runtime
+        pinecone_manager = runtime.pinecone_manager
+        route = self._route(text, runtime)
+        use_tools, use_rag = route.use_tools, route.use_rag
         
-        return False
+        if use_rag and pinecone_manager and pinecone_manager.is_initialized():
+            try:
+                results, cached, cache_key = self._retrieve(text, runtime)
+                if cached is not None:
+                    yield cached
+                    return
+                if results:
+                    response = ""
+                    for chunk in runtime.llm.stream(self._build_rag_prompt(text, results)):
+                        response += chunk.content
+                        yield response
+                    self._remember_answer(text, cache_key, response)
+                    return
+            except ServiceBusyError:
+                raise
+            except Exception as e:
+                logging.error(f"Error using RAG: {e}")
+        
+        agent = self.get_agent(runtime) if use_tools or use_rag else None
+        if agent is not None:
+            try:
+                # Tool calls have to finish before there is anything to show
+                yield self._run_agent(agent, conversation_key, text, runtime)
+                return
+            except ServiceBusyError:
+                raise
+            except Exception as e:
+                logging.error(f"Agent execution failed: {e}")
+        
+        memory = self.get_memory(conversation_key, runtime)
+        inputs = {"history": memory.load_buffer(), "input": text}
+        
+        # The small model's answer is only known to be good once it's complete
+        response = runtime.cascade.answer(runtime.prompt.format(**inputs), text) if runtime.cascade else None
+        if response is not None:
+            yield response
+        else:
+            started = time.monotonic()
+            response = ""
+            for chunk in self.get_conversation(runtime).stream(inputs):
+                response += chunk
+                yield response
+            if runtime.cascade is not None:
+                runtime.cascade.record_large(time.monotonic() - started)
+        memory.save_context({"input": text}, {"output": response})
+    
+    async def astream_response(self, conversation_key, text, priority=PRIORITY_MENTION, context=None):
+        """Async version of stream_response; agent runs stream their final answer via astream_events"""
+        async with self._async_conversation_locks.hold(conversation_key):
+            with request_priority(priority), request_scope(context):
+                try:
+                    async for response in self._astream_response(conversation_key, text):
+                        yield response
+                finally:
+                    self.user_conversations.touch(conversation_key)
+    
+    async def _astream_response(self, conversation_key, text):
+        runtime = self._runtime
+        pinecone_manager = runtime.pinecone_manager
+        route = self._route(text, runtime)
+        use_tools, use_rag = route.use_tools, route.use_rag
+        
+        if use_rag and pinecone_manager and pinecone_manager.is_initialized():
+            try:
+                results, cached, cache_key = await self._aretrieve(text, runtime)
+                if cached is not None:
+                    yield cached
+                    return
+                if results:
+                    response = ""
+                    async for chunk in runtime.llm.astream(self._build_rag_prompt(text, results)):
+                        response += chunk.content
+                        yield response
+                    self._remember_answer(text, cache_key, response)
+                    return
+            except ServiceBusyError:
+                raise
+            except Exception as e:
+                logging.error(f"Error using RAG: {e}")
+        
+        agent = self.get_agent(runtime) if use_tools or use_rag else None
+        memory = await asyncio.to_thread(self.get_memory, conversation_key, runtime)
+        
+        if agent is not None:
+            try:
+                collector = ToolResultCollector(runtime.tools)
+                streamed = ""
+                agent_result = {}
+                async for event in agent.astream_events(
+                    {"input": text, "chat_history": memory.load_messages()},
+                    config={"callbacks": [collector]},
+                    version="v2"
+                ):
+                    kind = event["event"]
+                    if kind == "on_chat_model_stream":
+                        # Tool-call chunks carry no content, only answer tokens are shown
+                        content = event["data"]["chunk"].content
+                        if isinstance(content, str) and content:
+                            streamed += content
+                            yield streamed
+                    elif kind == "on_chain_end" and not event.get("parent_ids"):
+                        # The root run's end event carries the executor's output
+                        agent_result = event["data"].get("output") or {}
+                
+                self._record_agent_turn(runtime)
+                response = self._agent_response(agent_result, collector) or streamed or AGENT_FALLBACK_RESPONSE
+                if response != streamed:
+                    # e.g. a return_direct tool answered instead of the model
+                    yield response
+                if response != AGENT_FALLBACK_RESPONSE:
+                    memory.save_context({"input": text}, {"output": response})
+                return
+            except ServiceBusyError:
+                raise
+            except Exception as e:
+                logging.error(f"Agent execution failed: {e}")
+        
+        inputs = {"history": memory.load_buffer(), "input": text}
+        response = await runtime.cascade.aanswer(runtime.prompt.format(**inputs), text) if runtime.cascade else None
+        if response is not None:
+            yield response
+        else:
+            started = time.monotonic()
+            response = ""
+            async for chunk in self.get_conversation(runtime).astream(inputs):
+                response += chunk
+                yield response
+            if runtime.cascade is not None:
+                runtime.cascade.record_large(time.monotonic() - started)
+        memory.save_context({"input": text}, {"output": response})
+    
+    def _route(self, text, runtime=None) -> RouteDecision:
+        """Decide whether a query should use tools and/or RAG"""
+        runtime = runtime or self._runtime
+        pinecone_manager = runtime.pinecone_manager
+        
+        # Only consider RAG if it's enabled and initialized
+        rag_available = (runtime.spec.rag_enabled and pinecone_manager is not None
+                         and pinecone_manager.is_initialized())
+        
+        route = runtime.router.route(text, rag_available=rag_available)
+        logging.debug(f"Route for query: tools={route.use_tools} rag={route.use_rag} "
+                      f"confidence={route.confidence:.2f} via {route.source} {list(route.matches)}")
+        return route
     
-    def upload_to_knowledge_base(self, document, metadata=None):
-        """Upload a document to the knowledge base"""
-        if not self.pinecone_manager or not self.pinecone_manager.is_initialized():
+    def upload_to_knowledge_base(self, document, metadata=None, namespace=""):
+        """Upload a document to the knowledge base, into a partition's namespace if given"""
+        pinecone_manager = self.pinecone_manager
+        if not pinecone_manager or not pinecone_manager.is_initialized():
             return False, "Pinecone is not initialized. Check your API key and environment settings."
         
-        success = self.pinecone_manager.upload_document(document, metadata)
+        success = pinecone_manager.upload_document(document, metadata, namespace)
         
         if success:
+            # Cached answers may no longer reflect what the knowledge base says
+            if self.response_cache is not None:
+                self.response_cache.invalidate()
             return True, "Document uploaded successfully to the knowledge base."
         else:
             return False, "Failed to upload document to the knowledge base."
     
     def reset_conversation(self, conversation_key):
         """Reset the conversation history for a specific user/channel"""
-        if conversation_key in self.user_conversations:
-            self.user_conversations[conversation_key] = ConversationChain(
-                llm=self.llm,
-                prompt=self.prompt,
-                memory=ConversationBufferMemory(return_messages=True),
-                verbose=True
-            )
-            
-            # Also reset the agent if it exists
-            if conversation_key in self.user_agents:
-                # Remove the agent so it will be recreated on next use
-                del self.user_agents[conversation_key]
-                
+        # Wait for an in-flight turn, then drop the history so a fresh one is created on next use
+        with self._conversation_locks.hold(conversation_key):
+            return self._reset_conversation(conversation_key)
+    
+    async def areset_conversation(self, conversation_key):
+        """Async version of reset_conversation, ordered with the AsyncApp pipeline's turns"""
+        async with self._async_conversation_locks.hold(conversation_key):
+            return await asyncio.to_thread(self._reset_conversation, conversation_key)
+    
+    def _reset_conversation(self, conversation_key):
+        memory = self.user_conversations.pop(conversation_key)
+        if memory is not None:
+            memory.clear()
+        elif self.history_backend is not None:
+            # Evicted from memory but still on disk
+            self.history_backend.delete(conversation_key)
             return True
-        return False
+        return memory is not None
+    
+    def get_conversation_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Size, hit, queue and latency metrics for conversations, the router, caches, rate limits and retrieval"""
+        return {
+            "conversations": self.user_conversations.metrics(),
+            "conversation_locks": {
+                "threads": self._conversation_locks.metrics(),
+                "async": self._async_conversation_locks.metrics()
+            },
+            "router": dict(self._runtime.router.stats),
+            "semantic_cache": self.response_cache.metrics() if self.response_cache is not None else {},
+            "llm_cache": self._llm_cache_metrics(),
+            "llm_pool": self._runtime.llm.metrics() if isinstance(self._runtime.llm, LLMPool) else {},
+            "cascade": self._runtime.cascade.metrics() if self._runtime.cascade is not None else {},
+            "rate_limits": self.rate_governor.metrics(),
+            "embeddings": self.pinecone_manager.embeddings.metrics() if self.pinecone_manager is not None else {},
+            "retrieval": self._runtime.retrieval.metrics() if self._runtime.retrieval is not None else {},
+            "rag_context": self.context_assembler.metrics(),
+            "summarizer": dict(self._summarizer.stats),
+            "history": dict(self.history_backend.stats) if self.history_backend is not None else {}
+        }
+    
+    def _llm_cache_metrics(self) -> Dict[str, Any]:
+        cache = self._llm_caches.get(self.spec.llm.cache)
+        return cache.metrics() if cache is not None else {}
     
     def reload_configuration(self):
-        """Reload configuration from Flow Manager"""
-        # Get updated LLM configuration
-        llm_config = self.flow_manager.get_llm_config()
-        self._initialize_llm(llm_config)
-        
-        # Update system prompt
-        system_prompt = self.flow_manager.get_system_prompt()
-        self.template = f"""
-        {system_prompt}
+        """Reload configuration from Flow Manager
         
-        Current conversation:
-        {{history}}
-        Human: {{input}}
-        AI Assistant:
+        Only the flow components (llm, systemPrompt, tools, rag, memory, router) that changed
+        are rebuilt, off to the side, and swapped in with a single assignment so
+        in-flight requests finish on the runtime they started with. Conversation
+        memory is kept; the shared conversation chain and agent are rebuilt on
+        their next use only if a component they depend on changed.
         """
+        with self._reload_lock:
+            try:
+                spec = self.flow_manager.get_agent_spec()
+            except FlowValidationError as e:
+                logging.error(f"Keeping current configuration: {e}")
+                return False
+            
+            if spec.component_fingerprints() == self._runtime.fingerprints:
+                # e.g. only node positions moved in the editor
+                logging.info("Flow saved without changes to the agent, nothing to reload")
+                return True
+            
+            runtime = self._build_runtime(spec, self._runtime)
+            self._runtime = runtime
         
-        self.prompt = PromptTemplate(
-            input_variables=["history", "input"],
-            template=self.template
-        )
-        
-        # Reinitialize Pinecone Manager if RAG is enabled
-        if self.flow_manager.is_rag_enabled():
-            self.pinecone_manager = PineconeManager()
-        else:
-            self.pinecone_manager = None
-        
-        # Update tools
-        self.tools = self._get_configured_tools()
-        
-        # Reset all conversations and agents to use new configuration
-        for key in list(self.user_conversations.keys()):
-            self.reset_conversation(key)
-        
+        logging.info(f"Reloaded agent configuration (generation {runtime.generation})")
         return True
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Lexical Index - A BM25 inverted index over knowledge base chunks, for exact identifiers that embeddings miss
+"""
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from metadata_filter import filter_to_sql
+
+logger = logging.getLogger("lexical_index")
+
+# Standard BM25 parameters: term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant; larger values flatten the difference between ranks
+RRF_K = 60
+# Queries of at most this many words, all identifiers, are answered lexically
+MAX_LEXICAL_QUERY_WORDS = 4
+
+# Words joined by - _ . / : # stay one token (INC-4821, ERR_CONN_RESET, v2.3.1) and also count as their parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:#][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[-_./:#]")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i if in is it of on or our so that the their them "
+    "there these this to was we were what when where which who why will with you your".split()
+)
+
+# Like the vector index, an id is unique within its namespace
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    namespace TEXT NOT NULL DEFAULT '',
+    id TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    terms TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (namespace, id)
+)
+"""
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text, without stopwords; compound identifiers also yield their parts"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if TOKEN_SEPARATORS.search(token):
+            terms.extend(part for part in TOKEN_SEPARATORS.split(token) if part not in STOPWORDS)
+    return terms
+
+
+def _is_identifier(word: str) -> bool:
+    """Ticket numbers, error codes, versions and CamelCase names, rather than plain words"""
+    return (any(char.isdigit() for char in word) or bool(TOKEN_SEPARATORS.search(word.strip("-_./:#")))
+            or any(char.isupper() for char in word[1:]))
+
+
+def is_lexical_query(text: str) -> bool:
+    """Whether a query is only exact identifiers (or a quoted phrase), which BM25 answers without an embedding"""
+    text = text.strip().rstrip("?!.")
+    if len(text) > 2 and text[0] == text[-1] and text[0] in "\"'`":
+        return bool(tokenize(text))
+    words = text.split()
+    return 0 < len(words) <= MAX_LEXICAL_QUERY_WORDS and all(_is_identifier(word) for word in words)
+
+
+def identifier_terms(text: str) -> Set[str]:
+    """The identifiers a query mentions, as index terms"""
+    identifiers = set()
+    for word in text.split():
+        terms = tokenize(word) if _is_identifier(word) else []
+        if terms:
+            # The first term is the whole compound, e.g. inc-4821 rather than inc and 4821
+            identifiers.add(terms[0])
+    return identifiers
+
+
+def default_lexical_path(index_name: str) -> Path:
+    """Lexical index file for a Pinecone index, under LEXICAL_INDEX_DIR (default lexical_index/ next to app.py)"""
+    base = os.environ.get("LEXICAL_INDEX_DIR") or Path(__file__).parent / "lexical_index"
+    return Path(base) / f"{index_name}.db"
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Dict[str, Any]]], top_k: int, k: int = RRF_K,
+                           pinned: Collection[str] = ()) -> List[Dict[str, Any]]:
+    """Merge ranked result lists by summing 1 / (k + rank) per id; the score becomes the fused score
+
+    Ids in pinned go ahead of the rest, e.g. the only chunks that contain a
+    ticket number the user typed, which a weak vector rank would otherwise
+    push out of the top k.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    results: Dict[str, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            scores[result["id"]] += 1.0 / (k + rank)
+            results.setdefault(result["id"], result)
+    top = heapq.nlargest(top_k, scores.items(), key=lambda item: (item[0] in pinned, item[1]))
+    return [{**results[doc_id], "score": score} for doc_id, score in top]
+
+
+class _Partition:
+    """Postings (term -> {id: term frequency}) and document lengths of one namespace"""
+    __slots__ = ("postings", "lengths", "total_length")
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: str, length: int, terms: Dict[str, int]):
+        for term, count in terms.items():
+            self.postings[term][doc_id] = count
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id: str, terms: Iterable[str]):
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+
+
+class LexicalIndex:
+    """BM25 search over chunk texts, updated as chunks are upserted
+
+    Postings and document lengths are kept in memory per namespace, so a
+    search only touches the postings of the query's terms in its own
+    namespace, and term statistics are those of that namespace. Each
+    chunk's text, metadata and term counts are stored in SQLite (in memory
+    when path is None); the postings are rebuilt from the term counts on
+    open, and again when another process (e.g. the upload script) has
+    written to the file. Upserting an existing id replaces it. A metadata
+    filter is evaluated in SQLite before scoring.
+    """
+
+    def __init__(self, path: Optional[Path] = None, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = Path(path) if path is not None else None
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path) if self.path is not None else ":memory:",
+                                     check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.execute(SCHEMA)
+        self._load()
+
+    def __len__(self) -> int:
+        return sum(len(partition.lengths) for partition in self._partitions.values())
+
+    def _migrate(self):
+        """Move documents indexed before namespaces into the default namespace"""
+        columns = {column[1] for column in self._conn.execute("PRAGMA table_info(documents)")}
+        if columns and "namespace" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE documents RENAME TO documents_v1")
+                self._conn.execute(SCHEMA)
+                self._conn.execute("INSERT INTO documents (namespace, id, length, terms, text, metadata) "
+                                   "SELECT '', id, length, terms, text, metadata FROM documents_v1")
+                self._conn.execute("DROP TABLE documents_v1")
+
+    def _load(self):
+        """Build the postings from the stored term counts"""
+        self._partitions: Dict[str, _Partition] = defaultdict(_Partition)
+        for namespace, doc_id, length, terms in self._conn.execute(
+            "SELECT namespace, id, length, terms FROM documents"
+        ):
+            self._partitions[namespace].add(doc_id, length, json.loads(terms))
+        self._data_version = self._current_data_version()
+
+    def _current_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _refresh(self):
+        """Reload if another connection committed since the last load"""
+        if self.path is not None and self._current_data_version() != self._data_version:
+            logger.info(f"Lexical index at {self.path} changed on disk, reloading")
+            self._load()
+
+    def _remove_postings(self, namespace: str, doc_ids: Iterable[str]):
+        partition = self._partitions.get(namespace)
+        doc_ids = [doc_id for doc_id in doc_ids if partition is not None and doc_id in partition.lengths]
+        if not doc_ids:
+            return
+        placeholders = ",".join("?" * len(doc_ids))
+        for doc_id, terms in self._conn.execute(
+            f"SELECT id, terms FROM documents WHERE namespace = ? AND id IN ({placeholders})", [namespace, *doc_ids]
+        ):
+            partition.remove(doc_id, json.loads(terms))
+
+    def upsert(self, documents: Sequence[Tuple[str, str, Dict[str, Any]]], namespace: str = "") -> int:
+        """Index (id, text, metadata) chunks in a namespace, replacing any with the same id"""
+        rows = []
+        for doc_id, text, metadata in documents:
+            terms = tokenize(text)
+            rows.append((doc_id, len(terms), Counter(terms), text, metadata))
+        with self._lock:
+            self._refresh()
+            self._remove_postings(namespace, [row[0] for row in rows])
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents (namespace, id, length, terms, text, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(namespace, doc_id, length, json.dumps(terms), text, json.dumps(metadata or {}))
+                     for doc_id, length, terms, text, metadata in rows]
+                )
+            partition = self._partitions[namespace]
+            for doc_id, length, terms, _, _ in rows:
+                partition.add(doc_id, length, terms)
+            self._data_version = self._current_data_version()
+        return len(rows)
+
+    def delete(self, doc_ids: Sequence[str], namespace: str = ""):
+        with self._lock:
+            self._refresh()
+            self._remove_postings(namespace, doc_ids)
+            with self._conn:
+                self._conn.executemany("DELETE FROM documents WHERE namespace = ? AND id = ?",
+                                       [(namespace, doc_id) for doc_id in doc_ids])
+            self._data_version = self._current_data_version()
+
+    def search(self, query: str, top_k: int = 3, namespace: str = "",
+               metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Top k chunks of a namespace by BM25, as result dicts with id, score, text and metadata
+        like PineconeManager.query; metadata_filter takes Pinecone's filter syntax"""
+        terms = set(tokenize(query))
+        with self._lock:
+            self._refresh()
+            partition = self._partitions.get(namespace)
+            count = len(partition.lengths) if partition is not None else 0
+            if not terms or not count:
+                return []
+            average_length = partition.total_length / count or 1.0
+
+            allowed = None
+            if metadata_filter:
+                clause, params = filter_to_sql(metadata_filter)
+                allowed = {doc_id for doc_id, in self._conn.execute(
+                    f"SELECT id FROM documents WHERE namespace = ? AND {clause}", [namespace, *params]
+                )}
+
+            scores: Dict[str, float] = defaultdict(float)
+            for term in terms:
+                postings = partition.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * partition.lengths[doc_id] / average_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            if not top:
+                return []
+            placeholders = ",".join("?" * len(top))
+            stored = {
+                doc_id: (text, json.loads(metadata))
+                for doc_id, text, metadata in self._conn.execute(
+                    f"SELECT id, text, metadata FROM documents WHERE namespace = ? AND id IN ({placeholders})",
+                    [namespace, *(doc_id for doc_id, _ in top)]
+                )
+            }
+        return [
+            {"id": doc_id, "score": score, "text": stored[doc_id][0], "metadata": stored[doc_id][1]}
+            for doc_id, score in top if doc_id in stored
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
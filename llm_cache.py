@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+LLM Cache - Exact-match cache for LLM calls, in memory with an optional SQLite tier
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger("llm_cache")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    generations TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def default_cache_path() -> Path:
+    """SQLite file for persisted LLM responses, from LLM_CACHE_PATH"""
+    return Path(os.environ.get("LLM_CACHE_PATH") or Path(__file__).parent / "llm_cache.db")
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """Hash of the model parameters and the full serialized message list
+
+    LangChain's llm_string already carries the model name, temperature and
+    the other invocation parameters, and the prompt is the serialized
+    messages, so equal keys mean byte-identical calls.
+    """
+    digest = hashlib.sha256()
+    digest.update(llm_string.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TieredLLMCache(BaseCache):
+    """LangChain cache with an in-memory LRU in front of an optional SQLite table
+
+    Lookups try memory first, then disk, promoting disk hits into memory.
+    Updates are written to both tiers. Pass it as the `cache` of a chat
+    model to cache that model's calls only.
+    """
+
+    def __init__(self, max_entries: int = 1000, path: Optional[Path] = None,
+                 ttl_seconds: Optional[float] = None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # key -> (generations, created_at)
+        self._memory: "OrderedDict[str, Tuple[RETURN_VAL_TYPE, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+        self.path = Path(path) if path else None
+        self._conn = None
+        if self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(SCHEMA)
+            except Exception as e:
+                logger.error(f"Error opening LLM cache at {self.path}, caching in memory only: {e}")
+                self._conn = None
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        now = self._clock()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+
+            loaded = self._load(key, now)
+            if loaded is None:
+                self.stats["misses"] += 1
+                return None
+            generations, created_at = loaded
+            self.stats["disk_hits"] += 1
+            self._remember(key, generations, created_at)
+            return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = cache_key(prompt, llm_string)
+        now = self._clock()
+        with self._lock:
+            self._remember(key, return_val, now)
+            self.stats["writes"] += 1
+            if self._conn is None:
+                return
+            try:
+                serialized = dumps(list(return_val))
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (key, generations, created_at) VALUES (?, ?, ?)",
+                        (key, serialized, now)
+                    )
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error persisting LLM cache entry: {e}")
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("DELETE FROM llm_cache")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                "size": len(self._memory),
+                "hit_rate": hits / lookups if lookups else 0.0,
+                **self.stats,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, generations: RETURN_VAL_TYPE, created_at: float):
+        self._memory[key] = (generations, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Optional[Tuple[Sequence[Any], float]]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute(
+                "SELECT generations, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1], now):
+                return None
+            return loads(row[0]), row[1]
+        except Exception as e:
+            # An entry written by an incompatible langchain version is just a miss
+            self.stats["errors"] += 1
+            logger.warning(f"Error reading LLM cache entry: {e}")
+            return None
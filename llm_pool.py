@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+LLM Pool - Routes chat calls across several providers with failover and hedging
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, Field
+
+logger = logging.getLogger("llm_pool")
+
+DEFAULT_WINDOW = 50
+# A backend is skipped while more than this share of its recent calls failed
+DEFAULT_MAX_ERROR_RATE = 0.5
+DEFAULT_MIN_SAMPLES = 5
+# ...or for a cooldown after this many failures in a row
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN_SECONDS = 30.0
+DEFAULT_HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_MIN_DELAY = 0.25
+# Hedge delay used until a backend has latency samples
+DEFAULT_HEDGE_DELAY = 2.0
+
+
+class ProviderHealth:
+    """Rolling latency and error window for one backend"""
+
+    def __init__(self, name: str, window: int = DEFAULT_WINDOW,
+                 max_error_rate: float = DEFAULT_MAX_ERROR_RATE, min_samples: int = DEFAULT_MIN_SAMPLES,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        # (latency seconds, succeeded)
+        self._samples: "deque[tuple]" = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+            if ok:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._cooldown_until = self._clock() + self.cooldown_seconds
+                logger.warning(f"LLM backend {self.name} failed {self._consecutive_failures} times in a row, "
+                               f"cooling down for {self.cooldown_seconds}s")
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def latency(self, quantile: float = 0.5) -> Optional[float]:
+        """Latency quantile of recent successful calls, None before the first one"""
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(int(quantile * len(latencies)), len(latencies) - 1)]
+
+    def healthy(self) -> bool:
+        if self._clock() < self._cooldown_until:
+            return False
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return True
+        return self.error_rate() <= self.max_error_rate
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy(),
+            "calls": len(self._samples),
+            "error_rate": self.error_rate(),
+            "p50": self.latency(0.5),
+            "p95": self.latency(0.95),
+        }
+
+
+class LLMPool(BaseChatModel):
+    """Chat model that sends each call to the fastest healthy of several backends
+
+    Backends are ranked by median latency over a rolling window; ones with
+    no samples yet are tried first so every backend gets measured, and
+    unhealthy ones (high error rate, or cooling down after repeated
+    failures) are only used as a last resort. A failed call fails over to
+    the next backend.
+
+    With hedging on, if the chosen backend hasn't answered after its own
+    p95 latency, the same request is also sent to the runner-up and the
+    first answer wins. Async losers are cancelled; a sync loser can't be
+    interrupted, so its thread finishes in the background and its result
+    is discarded.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: List[Any]
+    names: List[str]
+    health: List[ProviderHealth] = Field(default_factory=list)
+    hedge: bool = False
+    hedge_quantile: float = DEFAULT_HEDGE_QUANTILE
+    hedge_min_delay: float = DEFAULT_HEDGE_MIN_DELAY
+    stats: Dict[str, int] = Field(default_factory=lambda: {
+        "calls": 0, "failovers": 0, "hedged": 0, "hedge_wins": 0, "failures": 0
+    })
+    executor: Optional[ThreadPoolExecutor] = None
+
+    def model_post_init(self, __context: Any):
+        if not self.health:
+            self.health = [ProviderHealth(name) for name in self.names]
+        if self.executor is None and self.hedge:
+            self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm_pool"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "LLMPool":
+        """Bind tools on every backend; the bound pool shares health windows and stats"""
+        return self.model_copy(update={"backends": [backend.bind_tools(tools, **kwargs) for backend in self.backends]})
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "backends": {name: health.snapshot() for name, health in zip(self.names, self.health)},
+        }
+
+    def ranked(self) -> List[int]:
+        """Backend indexes in the order they should be tried"""
+        def key(i):
+            health = self.health[i]
+            latency = health.latency()
+            return (not health.healthy(), latency if latency is not None else 0.0, i)
+        return sorted(range(len(self.backends)), key=key)
+
+    def _hedge_delay(self, i: int) -> float:
+        latency = self.health[i].latency(self.hedge_quantile)
+        return max(self.hedge_min_delay, latency if latency is not None else DEFAULT_HEDGE_DELAY)
+
+    def _record(self, i: int, started: float, ok: bool):
+        self.health[i].record(time.monotonic() - started, ok)
+        if not ok:
+            self.stats["failures"] += 1
+
+    def _call(self, i: int, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> BaseMessage:
+        started = time.monotonic()
+        try:
+            message = self.backends[i].invoke(messages, stop=stop, **kwargs)
+        except Exception:
+            self._record(i, started, False)
+            raise
+        self._record(i, started, True)
+        return message
+
+    async def _acall(self, i: int, messages: List[BaseMessage], stop: Optional[List[str]],
+                     kwargs: Dict[str, Any]) -> BaseMessage:
+        started = time.monotonic()
+        try:
+            message = await self.backends[i].ainvoke(messages, stop=stop, **kwargs)
+        except asyncio.CancelledError:
+            # Lost a hedge race; not the backend's fault
+            raise
+        except Exception:
+            self._record(i, started, False)
+            raise
+        self._record(i, started, True)
+        return message
+
+    def _result(self, message: BaseMessage) -> ChatResult:
+        if not isinstance(message, AIMessage):
+            message = AIMessage(content=getattr(message, "content", str(message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self.stats["calls"] += 1
+        order = self.ranked()
+        if self.hedge and len(order) > 1:
+            return self._result(self._hedged(order, messages, stop, kwargs))
+
+        error = None
+        for attempt, i in enumerate(order):
+            if attempt:
+                self.stats["failovers"] += 1
+            try:
+                return self._result(self._call(i, messages, stop, kwargs))
+            except Exception as e:
+                logger.warning(f"LLM backend {self.names[i]} failed: {e}")
+                error = e
+        raise error
+
+    def _hedged(self, order: List[int], messages: List[BaseMessage], stop: Optional[List[str]],
+                kwargs: Dict[str, Any]) -> BaseMessage:
+        remaining = list(order)
+        running = {}
+        hedged = False
+        error = None
+
+        def launch():
+            i = remaining.pop(0)
+            # Copy the context so the call keeps the caller's request priority
+            running[self.executor.submit(contextvars.copy_context().run, self._call, i, messages, stop, kwargs)] = i
+
+        launch()
+        delay = self._hedge_delay(order[0])
+        while running:
+            done, _ = wait(running, timeout=None if hedged or not remaining else delay,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # The first backend is slower than usual: race a duplicate against it
+                hedged = True
+                self.stats["hedged"] += 1
+                launch()
+                continue
+            for future in done:
+                i = running.pop(future)
+                if future.exception() is None:
+                    for loser in running:
+                        loser.cancel()
+                    if i != order[0]:
+                        self.stats["hedge_wins" if hedged else "failovers"] += 1
+                    return future.result()
+                logger.warning(f"LLM backend {self.names[i]} failed: {future.exception()}")
+                error = future.exception()
+            if not running and remaining:
+                launch()
+        raise error
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self.stats["calls"] += 1
+        order = self.ranked()
+        remaining = list(order)
+        running = {}
+        can_hedge = self.hedge and len(order) > 1
+        hedged = False
+        error = None
+
+        def launch():
+            i = remaining.pop(0)
+            running[asyncio.ensure_future(self._acall(i, messages, stop, kwargs))] = i
+
+        launch()
+        delay = self._hedge_delay(order[0])
+        try:
+            while running:
+                timeout = delay if can_hedge and not hedged and remaining else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self.stats["hedged"] += 1
+                    launch()
+                    continue
+                for task in done:
+                    i = running.pop(task)
+                    if task.exception() is None:
+                        if i != order[0]:
+                            self.stats["hedge_wins" if hedged else "failovers"] += 1
+                        return self._result(task.result())
+                    logger.warning(f"LLM backend {self.names[i]} failed: {task.exception()}")
+                    error = task.exception()
+                if not running and remaining:
+                    launch()
+            raise error
+        finally:
+            for loser in running:
+                loser.cancel()
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        # Streams aren't hedged; fail over only until the first chunk went out
+        self.stats["calls"] += 1
+        error = None
+        for attempt, i in enumerate(self.ranked()):
+            if attempt:
+                self.stats["failovers"] += 1
+            started = time.monotonic()
+            streamed = False
+            try:
+                for chunk in self.backends[i].stream(messages, stop=stop, **kwargs):
+                    streamed = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._record(i, started, False)
+                if streamed:
+                    raise
+                logger.warning(f"LLM backend {self.names[i]} failed: {e}")
+                error = e
+                continue
+            self._record(i, started, True)
+            return
+        raise error
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self.stats["calls"] += 1
+        error = None
+        for attempt, i in enumerate(self.ranked()):
+            if attempt:
+                self.stats["failovers"] += 1
+            started = time.monotonic()
+            streamed = False
+            try:
+                async for chunk in self.backends[i].astream(messages, stop=stop, **kwargs):
+                    streamed = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._record(i, started, False)
+                if streamed:
+                    raise
+                logger.warning(f"LLM backend {self.names[i]} failed: {e}")
+                error = e
+                continue
+            self._record(i, started, True)
+            return
+        raise error
+
+
+# Example usage with local fake providers
+if __name__ == "__main__":
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    class SlowFake(FakeListChatModel):
+        """Fake provider with a fixed delay and optional failures"""
+        delay: float = 0.0
+        fail: bool = False
+
+        def _generate(self, *args, **kwargs):
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("provider unavailable")
+            return super()._generate(*args, **kwargs)
+
+    logging.basicConfig(level=logging.INFO)
+    pool = LLMPool(
+        backends=[
+            SlowFake(responses=["from slow"], delay=0.3),
+            SlowFake(responses=["from fast"], delay=0.05),
+            SlowFake(responses=["from broken"], fail=True),
+        ],
+        names=["slow", "fast", "broken"],
+        hedge=True,
+        hedge_min_delay=0.1,
+    )
+    for _ in range(10):
+        print(pool.invoke("hello").content)
+    print(pool.metrics())
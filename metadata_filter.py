@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Metadata Filter - Translates Pinecone-style metadata filters into SQLite conditions for the local indexes
+"""
+from typing import Any, List, Mapping, Tuple
+
+COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _field(key: str) -> str:
+    """JSON path of a top-level metadata key, quoted so keys with dots or spaces work"""
+    return '$."' + key + '"'
+
+
+def filter_to_sql(metadata_filter: Mapping[str, Any], column: str = "metadata") -> Tuple[str, List[Any]]:
+    """
+    A WHERE condition and its parameters for a filter over a JSON metadata column
+
+    Supports the Pinecone operators on scalar fields: $eq, $ne, $gt, $gte,
+    $lt, $lte, $in, $nin, plus $and / $or; {"key": value} means $eq. Keys
+    at the same level must all match.
+
+    Raises:
+        ValueError: for an unknown operator or a malformed condition
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+    for key, condition in metadata_filter.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, (list, tuple)) or not condition:
+                raise ValueError(f"{key} needs a non-empty list of filters")
+            parts = [filter_to_sql(part, column) for part in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(clause for clause, _ in parts) + ")")
+            params.extend(param for _, part_params in parts for param in part_params)
+            continue
+        if key.startswith("$"):
+            raise ValueError(f"Unknown filter operator '{key}'")
+
+        field = f"json_extract({column}, ?)"
+        if not isinstance(condition, Mapping):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in COMPARISONS:
+                clauses.append(f"{field} {COMPARISONS[operator]} ?")
+                params.extend([_field(key), value])
+            elif operator in ("$in", "$nin"):
+                if not isinstance(value, (list, tuple)) or not value:
+                    raise ValueError(f"{operator} on '{key}' needs a non-empty list")
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({','.join('?' * len(value))})")
+                params.extend([_field(key), *value])
+            else:
+                raise ValueError(f"Unknown filter operator '{operator}' on '{key}'")
+
+    return ("(" + " AND ".join(clauses) + ")" if clauses else "1"), params
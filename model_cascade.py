@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Model Cascade - Lets a small, fast model answer first and escalates when it is unsure
+"""
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("model_cascade")
+
+DEFAULT_MIN_CONFIDENCE = 0.6
+# Assumed when the small model doesn't rate itself
+DEFAULT_CONFIDENCE = 0.7
+
+CONFIDENCE_INSTRUCTION = """
+
+After your reply, add one last line rating how confident you are that the reply is correct and complete, \
+written exactly as [confidence: N] with N from 0 to 10."""
+
+_CONFIDENCE_TAG = re.compile(r"\s*\[\s*confidence\s*:\s*(\d+(?:\.\d+)?)\s*(?:/\s*10\s*)?\]\s*$", re.IGNORECASE)
+_UNCERTAIN = re.compile(
+    r"\b(?:i'?m not (?:sure|certain)|i don'?t know|i do not know|i'?m unable to|i am unable to"
+    r"|i can(?:'?t|not) (?:help|answer|access|browse|check)|as an ai|i don'?t have (?:access|information)"
+    r"|no (?:access|information) (?:to|about))\b",
+    re.IGNORECASE
+)
+
+
+def assess(answer: str, question: str) -> Tuple[str, float]:
+    """Strip the self-rating from an answer and combine it with heuristics into a confidence in [0, 1]"""
+    match = _CONFIDENCE_TAG.search(answer)
+    if match:
+        answer = answer[:match.start()].rstrip()
+        confidence = min(float(match.group(1)) / 10.0, 1.0)
+    else:
+        confidence = DEFAULT_CONFIDENCE
+
+    # Models overrate themselves; explicit hedging or a non-answer overrides the rating
+    if not answer.strip():
+        return answer, 0.0
+    if _UNCERTAIN.search(answer):
+        confidence = min(confidence, 0.3)
+    if len(question.split()) > 25 and len(answer.split()) < 5:
+        confidence = min(confidence, 0.4)
+    return answer, confidence
+
+
+class ModelCascade:
+    """Answers conversation turns with a small model unless its confidence is too low
+
+    Turns routed to tools never reach the small model; they are counted as
+    escalations so the escalation rate covers all traffic. Latency saved is
+    estimated from the mean latency of large-model turns, minus the time
+    spent on small-model attempts that were escalated anyway.
+    """
+
+    def __init__(self, small_llm: Any, min_confidence: float = DEFAULT_MIN_CONFIDENCE, name: str = "small"):
+        self.small_llm = small_llm
+        self.min_confidence = min_confidence
+        self.name = name
+        self._lock = threading.Lock()
+        self.stats = {
+            "turns": 0, "answered_small": 0, "escalated_confidence": 0, "escalated_tools": 0,
+            "small_errors": 0, "small_seconds": 0.0, "large_turns": 0, "large_seconds": 0.0,
+        }
+
+    def answer(self, prompt: str, question: str) -> Optional[str]:
+        """The small model's answer, or None if the turn should go to the large model"""
+        started = time.monotonic()
+        try:
+            result = self.small_llm.invoke(prompt + CONFIDENCE_INSTRUCTION)
+        except Exception as e:
+            logger.warning(f"Small model {self.name} failed, escalating: {e}")
+            self._record_small(started, None)
+            return None
+        return self._record_small(started, getattr(result, "content", str(result)), question)
+
+    async def aanswer(self, prompt: str, question: str) -> Optional[str]:
+        """Async version of answer"""
+        started = time.monotonic()
+        try:
+            result = await self.small_llm.ainvoke(prompt + CONFIDENCE_INSTRUCTION)
+        except Exception as e:
+            logger.warning(f"Small model {self.name} failed, escalating: {e}")
+            self._record_small(started, None)
+            return None
+        return self._record_small(started, getattr(result, "content", str(result)), question)
+
+    def _record_small(self, started: float, raw: Optional[str], question: str = "") -> Optional[str]:
+        elapsed = time.monotonic() - started
+        answer, confidence = assess(raw, question) if raw is not None else (None, 0.0)
+        escalate = raw is None or confidence < self.min_confidence
+        with self._lock:
+            self.stats["turns"] += 1
+            self.stats["small_seconds"] += elapsed
+            if raw is None:
+                self.stats["small_errors"] += 1
+            elif escalate:
+                self.stats["escalated_confidence"] += 1
+            else:
+                self.stats["answered_small"] += 1
+        if raw is not None:
+            logger.debug(f"Small model confidence {confidence:.2f} ({'escalating' if escalate else 'answering'})")
+        return None if escalate else answer
+
+    def record_tool_turn(self):
+        """A turn that needs tools and goes straight to the large model"""
+        with self._lock:
+            self.stats["turns"] += 1
+            self.stats["escalated_tools"] += 1
+
+    def record_large(self, seconds: float):
+        """Time taken by the large model on an escalated conversation turn"""
+        with self._lock:
+            self.stats["large_turns"] += 1
+            self.stats["large_seconds"] += seconds
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        turns = stats["turns"]
+        escalated = turns - stats["answered_small"]
+        mean_large = stats["large_seconds"] / stats["large_turns"] if stats["large_turns"] else None
+        saved = None
+        if mean_large is not None:
+            saved = stats["answered_small"] * mean_large - stats["small_seconds"]
+        return {
+            **stats,
+            "escalation_rate": escalated / turns if turns else 0.0,
+            "mean_large_seconds": mean_large,
+            "latency_saved_seconds": saved,
+        }
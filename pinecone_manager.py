@@ -2,11 +2,23 @@
 """
 Pinecone Manager - Handles integration with Pinecone for RAG
 """
+import asyncio
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding_service import EmbeddingService, get_embedding_service
+from ingestion import DEFAULT_UPSERT_BATCH_SIZE, chunk_text
+from lexical_index import (LexicalIndex, default_lexical_path, identifier_terms, is_lexical_query,
+                           reciprocal_rank_fusion, tokenize)
 
 # Configure logging
 logging.basicConfig(
@@ -22,20 +34,92 @@ logger = logging.getLogger("pinecone_manager")
 # Load environment variables
 load_dotenv()
 
+RETRIEVAL_MODES = ("vector", "hybrid")
+# Each search contributes this many candidates to the fusion, however few results are asked for
+HYBRID_CANDIDATES = 20
+RETRIEVAL_STAGES = ("embed", "vector", "lexical", "fusion", "total")
+
+class KnowledgeBaseRetriever(BaseRetriever):
+    """LangChain retriever over the query/aquery of a PineconeManager or RetrievalService"""
+    
+    knowledge_base: Any
+    top_k: int = 3
+    
+    def _to_documents(self, results: List[Dict[str, Any]]) -> List[Document]:
+        return [
+            Document(page_content=result["text"], metadata={**result["metadata"], "id": result["id"],
+                                                            "score": result["score"]})
+            for result in results
+        ]
+    
+    def _get_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        return self._to_documents(self.knowledge_base.query(query, top_k=self.top_k))
+    
+    async def _aget_relevant_documents(self, query: str, *, run_manager: Any = None) -> List[Document]:
+        return self._to_documents(await self.knowledge_base.aquery(query, top_k=self.top_k))
+
 class PineconeManager:
-    """Manages Pinecone integration for RAG"""
+    """Manages the vector index for RAG: Pinecone, or a local index on disk"""
     
-    def __init__(self):
-        """Initialize the Pinecone manager"""
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None, provider: str = "pinecone",
+                 index_name: Optional[str] = None, local_path: Optional[str] = None,
+                 quantization: Optional[str] = None, retrieval: str = "vector"):
+        """
+        Initialize the Pinecone manager
+        
+        Args:
+            embedding_service: Embeddings to use instead of the shared service
+            provider: "pinecone", or "local" for a memory-mapped index that needs no network
+            index_name: Index to use (default: PINECONE_INDEX or slack-knowledge)
+            local_path: Directory of the local index (default: under LOCAL_VECTOR_INDEX_DIR)
+            quantization: Storage of a new local index, "float32" (default) or "int8"
+            retrieval: "vector", or "hybrid" to fuse embedding search with BM25 keyword search
+        """
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval}', expected one of {RETRIEVAL_MODES}")
+        self.provider = provider.lower()
+        self.retrieval = retrieval
         self.api_key = os.environ.get("PINECONE_API_KEY")
         self.environment = os.environ.get("PINECONE_ENVIRONMENT")
-        self.index_name = os.environ.get("PINECONE_INDEX", "slack-knowledge")
+        self.index_name = index_name or os.environ.get("PINECONE_INDEX", "slack-knowledge")
         self.pinecone_client = None
         self.index = None
+        self._async_index = None
+        # One embeddings client and cache for the whole process, so a reload
+        # that rebuilds this manager keeps its connections and cached vectors
+        self.embeddings = embedding_service or get_embedding_service()
+        # The keyword index next to the vector index, opened on first use
+        self._lexical: Optional[LexicalIndex] = None
+        self._open_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._metrics_lock = threading.Lock()
+        self._latencies = {stage: deque(maxlen=200) for stage in RETRIEVAL_STAGES}
+        self.stats = {"vector": 0, "hybrid": 0, "lexical": 0, "vector_failed": 0}
         
+        if self.provider == "local":
+            self._initialize_local(local_path, quantization)
         # Initialize Pinecone if credentials are available
-        if self.api_key and self.environment:
+        elif self.api_key and self.environment:
             self._initialize_pinecone()
+        
+        if self.retrieval == "hybrid" and self.is_initialized():
+            # Load the postings now rather than during the first question
+            self.lexical
+    
+    @property
+    def lexical(self) -> Optional[LexicalIndex]:
+        """The BM25 index of the uploaded chunks, or None if it can't be opened"""
+        if self._lexical is None:
+            with self._open_lock:
+                if self._lexical is None:
+                    path = (self.index.path / "lexical.db" if self.provider == "local"
+                            else default_lexical_path(self.index_name))
+                    try:
+                        self._lexical = LexicalIndex(path)
+                        logger.info(f"Using lexical index at {path} ({len(self._lexical)} chunks)")
+                    except Exception as e:
+                        logger.error(f"Error opening lexical index: {e}")
+        return self._lexical
     
     def _initialize_pinecone(self):
         """Initialize the Pinecone client and index"""
@@ -55,7 +139,7 @@ class PineconeManager:
                     name=self.index_name,
                     dimension=1536,  # OpenAI embeddings dimension
                     metric="cosine",
-                    spec=ServerlessSpec(cloud="aws", region=self.environment)
+                    spec=ServerlessSpec(cloud=os.environ.get("PINECONE_CLOUD", "aws"), region=self.environment)
                 )
             
             # Connect to the index
@@ -67,17 +151,35 @@ class PineconeManager:
         except Exception as e:
             logger.error(f"Error initializing Pinecone: {e}")
     
+    def _initialize_local(self, local_path: Optional[str], quantization: Optional[str]):
+        """Open (or create) the local index"""
+        try:
+            from vector_store import LocalVectorIndex, default_index_dir
+            
+            path = Path(local_path) if local_path else default_index_dir(self.index_name)
+            self.index = LocalVectorIndex(path, quantization)
+            logger.info(f"Using local vector index at {path} ({len(self.index)} vectors)")
+            
+        except ImportError:
+            logger.error("numpy not installed. Install with: pip install numpy")
+        except Exception as e:
+            logger.error(f"Error opening local vector index: {e}")
+    
     def is_initialized(self) -> bool:
         """Check if Pinecone is properly initialized"""
         return self.index is not None
     
-    def upload_document(self, document: str, metadata: Dict[str, Any] = None) -> bool:
+    def upload_document(self, document: str, metadata: Dict[str, Any] = None, namespace: str = "") -> bool:
         """
         Upload a document to Pinecone
         
+        The document is split into overlapping chunks, embedded in one request
+        and stored as one vector per chunk, so long documents stay retrievable.
+        
         Args:
             document: The text content to embed and store
             metadata: Additional metadata to store with the vector
+            namespace: Knowledge base partition to store it in, "" for the default
             
         Returns:
             bool: True if successful, False otherwise
@@ -87,13 +189,13 @@ class PineconeManager:
             return False
         
         try:
-            # Get OpenAI embeddings
-            from langchain_openai import OpenAIEmbeddings
-            
-            embeddings = OpenAIEmbeddings()
-            doc_embedding = embeddings.embed_query(document)
+            chunks = chunk_text(document)
+            if not chunks:
+                logger.error("Document is empty. Nothing to upload.")
+                return False
+            vectors = self.embeddings.embed_documents(chunks)
             
-            # Create a unique ID for the document
+            # Create a unique ID for the document; chunks are <doc_id>-<n>
             import uuid
             doc_id = str(uuid.uuid4())
             
@@ -101,34 +203,106 @@ class PineconeManager:
             if metadata is None:
                 metadata = {}
             
-            metadata["text"] = document[:1000]  # Store first 1000 chars of text in metadata
+            self.upsert_vectors([
+                {
+                    "id": f"{doc_id}-{i}",
+                    "values": vector,
+                    "metadata": {**metadata, "doc_id": doc_id, "chunk": i, "text": chunk}
+                }
+                for i, (chunk, vector) in enumerate(zip(chunks, vectors))
+            ], namespace=namespace)
             
-            # Upsert to Pinecone using new API
-            self.index.upsert(
-                vectors=[
-                    {
-                        "id": doc_id,
-                        "values": doc_embedding,
-                        "metadata": metadata
-                    }
-                ]
-            )
-            
-            logger.info(f"Successfully uploaded document with ID: {doc_id}")
+            logger.info(f"Successfully uploaded document with ID: {doc_id} ({len(chunks)} chunks)")
             return True
             
         except Exception as e:
             logger.error(f"Error uploading document to Pinecone: {e}")
             return False
     
-    def query(self, query_text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    def upsert_vectors(self, vectors: List[Dict[str, Any]], batch_size: int = DEFAULT_UPSERT_BATCH_SIZE,
+                       namespace: str = "") -> int:
+        """
+        Upsert vectors in batches of batch_size per request
+        
+        Args:
+            vectors: Dicts with id, values and metadata
+            batch_size: Vectors per upsert call
+            namespace: Knowledge base partition to write to, "" for the default
+            
+        The chunk texts are also added to the lexical index, whatever the
+        retrieval mode, so switching a flow to hybrid needs no re-upload.
+        
+        Returns:
+            int: Number of vectors upserted
+        """
+        for start in range(0, len(vectors), batch_size):
+            batch = vectors[start:start + batch_size]
+            self.index.upsert(vectors=batch, **self._scope(namespace))
+            self._index_lexically(batch, namespace)
+        return len(vectors)
+    
+    def delete_vectors(self, ids: List[str], batch_size: int = DEFAULT_UPSERT_BATCH_SIZE, namespace: str = ""):
+        """Delete chunks by id from the vector index and the lexical index"""
+        for start in range(0, len(ids), batch_size):
+            self.index.delete(ids=ids[start:start + batch_size], **self._scope(namespace))
+        lexical = self.lexical
+        if lexical is not None:
+            lexical.delete(ids, namespace=namespace)
+    
+    def _index_lexically(self, vectors: List[Dict[str, Any]], namespace: str = ""):
+        lexical = self.lexical
+        if lexical is None:
+            return
+        try:
+            lexical.upsert([
+                (vector["id"], vector["metadata"]["text"],
+                 {k: v for k, v in vector["metadata"].items() if k != "text"})
+                for vector in vectors if (vector.get("metadata") or {}).get("text")
+            ], namespace=namespace)
+        except Exception as e:
+            # The vectors are stored; keyword search just won't find these chunks
+            logger.error(f"Error updating lexical index: {e}")
+    
+    @staticmethod
+    def _scope(namespace: str = "", metadata_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Index call kwargs for a partition; empty for the default namespace and no filter"""
+        scope = {}
+        if namespace:
+            scope["namespace"] = namespace
+        if metadata_filter:
+            scope["filter"] = metadata_filter
+        return scope
+    
+    def embed_query(self, query_text: str) -> List[float]:
+        """Embed a query the same way query() does, so callers can reuse the vector"""
+        return self.embeddings.embed_query(query_text)
+    
+    async def aembed_query(self, query_text: str) -> List[float]:
+        """Async version of embed_query"""
+        return await self.embeddings.aembed_query(query_text)
+    
+    def answers_lexically(self, query_text: str) -> bool:
+        """Whether query() will try keyword search alone, without embedding the query"""
+        return self.retrieval == "hybrid" and is_lexical_query(query_text)
+    
+    def query(self, query_text: str, top_k: int = 3, query_embedding: Optional[List[float]] = None,
+              namespace: str = "", metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         Query Pinecone for similar documents
         
+        In hybrid mode the vector search runs in a worker thread while BM25
+        searches in this one, and the two rankings are fused with reciprocal
+        rank fusion. A query made only of identifiers (ticket numbers, error
+        codes) is answered by BM25 alone when it finds anything, without an
+        embedding call.
+        
         Args:
             query_text: The query text
             top_k: Number of results to return
-            
+            query_embedding: The query's embedding, if the caller already has it
+            namespace: Knowledge base partition to search, "" for the default
+            metadata_filter: Pinecone filter applied by the index before ranking
+        
         Returns:
             List of results with text and metadata
         """
@@ -136,40 +310,225 @@ class PineconeManager:
             logger.error("Pinecone not initialized. Cannot query.")
             return []
         
+        scope = self._scope(namespace, metadata_filter)
+        timings = {}
+        started = time.perf_counter()
+        try:
+            if self.retrieval == "hybrid" and self.lexical is not None:
+                results, mode = self._hybrid_search(query_text, top_k, query_embedding, scope, timings)
+            else:
+                results, mode = self._search_vectors(query_text, top_k, query_embedding, scope, timings), "vector"
+            
+        except Exception as e:
+            logger.error(f"Error querying Pinecone: {e}")
+            return []
+        
+        timings["total"] = time.perf_counter() - started
+        self._record(mode, timings)
+        return results
+    
+    async def aquery(self, query_text: str, top_k: int = 3, query_embedding: Optional[List[float]] = None,
+                     namespace: str = "", metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Async version of query
+        
+        The embedding call uses the async OpenAI client and the index query uses
+        Pinecone's asyncio client when available, otherwise a worker thread.
+        The local index is queried directly. In hybrid mode BM25 runs in a
+        worker thread while the vector search awaits the network.
+        """
+        if not self.is_initialized():
+            logger.error("Pinecone not initialized. Cannot query.")
+            return []
+        
+        scope = self._scope(namespace, metadata_filter)
+        timings = {}
+        started = time.perf_counter()
         try:
-            # Get OpenAI embeddings
-            from langchain_openai import OpenAIEmbeddings
-            
-            embeddings = OpenAIEmbeddings()
-            query_embedding = embeddings.embed_query(query_text)
-            
-            # Query Pinecone using new API
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
-            
-            # Format results
-            formatted_results = []
-            for match in results["matches"]:
-                formatted_results.append({
-                    "id": match["id"],
-                    "score": match["score"],
-                    "text": match["metadata"].get("text", ""),
-                    "metadata": {k: v for k, v in match["metadata"].items() if k != "text"}
-                })
-            
-            return formatted_results
+            if self.retrieval == "hybrid" and self.lexical is not None:
+                results, mode = await self._ahybrid_search(query_text, top_k, query_embedding, scope, timings)
+            else:
+                results, mode = await self._asearch_vectors(
+                    query_text, top_k, query_embedding, scope, timings
+                ), "vector"
             
         except Exception as e:
             logger.error(f"Error querying Pinecone: {e}")
             return []
+        
+        timings["total"] = time.perf_counter() - started
+        self._record(mode, timings)
+        return results
+    
+    def _hybrid_search(self, query_text, top_k, query_embedding, scope, timings):
+        """Fused vector and BM25 results, and which path produced them"""
+        if query_embedding is None and is_lexical_query(query_text):
+            results = self._search_lexical(query_text, top_k, scope, timings)
+            if results:
+                return results, "lexical"
+            # Nothing contains the identifiers; fall back to meaning
+            return self._search_vectors(query_text, top_k, None, scope, timings), "vector"
+        
+        candidates = max(top_k, HYBRID_CANDIDATES)
+        future = self._get_executor().submit(
+            self._search_vectors, query_text, candidates, query_embedding, scope, timings
+        )
+        lexical = self._search_lexical(query_text, candidates, scope, timings)
+        try:
+            vector = future.result()
+        except Exception as e:
+            vector = self._vector_failed(e)
+        return self._fuse(query_text, vector, lexical, top_k, timings), "hybrid"
+    
+    async def _ahybrid_search(self, query_text, top_k, query_embedding, scope, timings):
+        """Async version of _hybrid_search"""
+        if query_embedding is None and is_lexical_query(query_text):
+            results = self._search_lexical(query_text, top_k, scope, timings)
+            if results:
+                return results, "lexical"
+            return await self._asearch_vectors(query_text, top_k, None, scope, timings), "vector"
+        
+        candidates = max(top_k, HYBRID_CANDIDATES)
+        vector, lexical = await asyncio.gather(
+            self._asearch_vectors(query_text, candidates, query_embedding, scope, timings),
+            asyncio.to_thread(self._search_lexical, query_text, candidates, scope, timings),
+            return_exceptions=True
+        )
+        if isinstance(lexical, BaseException):
+            raise lexical
+        if isinstance(vector, BaseException):
+            vector = self._vector_failed(vector)
+        return self._fuse(query_text, vector, lexical, top_k, timings), "hybrid"
+    
+    def _vector_failed(self, error: BaseException) -> List[Dict[str, Any]]:
+        """Keep answering from keywords when the embedding or index call fails"""
+        logger.warning(f"Vector search failed, using keyword results only: {error}")
+        with self._metrics_lock:
+            self.stats["vector_failed"] += 1
+        return []
+    
+    def _search_vectors(self, query_text, top_k, query_embedding, scope, timings) -> List[Dict[str, Any]]:
+        if query_embedding is None:
+            started = time.perf_counter()
+            query_embedding = self.embed_query(query_text)
+            timings["embed"] = time.perf_counter() - started
+        
+        # Query Pinecone using new API
+        started = time.perf_counter()
+        results = self.index.query(
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True,
+            **scope
+        )
+        timings["vector"] = time.perf_counter() - started
+        
+        return self._format_matches(results)
+    
+    async def _asearch_vectors(self, query_text, top_k, query_embedding, scope, timings) -> List[Dict[str, Any]]:
+        if query_embedding is None:
+            started = time.perf_counter()
+            query_embedding = await self.aembed_query(query_text)
+            timings["embed"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        if self.provider == "local":
+            # The local index answers in-process, faster than handing off to a thread
+            results = self.index.query(vector=query_embedding, top_k=top_k, include_metadata=True, **scope)
+        else:
+            async_index = await self._get_async_index()
+            if async_index is not None:
+                results = await async_index.query(vector=query_embedding, top_k=top_k, include_metadata=True, **scope)
+            else:
+                results = await asyncio.to_thread(
+                    self.index.query, vector=query_embedding, top_k=top_k, include_metadata=True, **scope
+                )
+        timings["vector"] = time.perf_counter() - started
+        
+        return self._format_matches(results)
+    
+    def _search_lexical(self, query_text, top_k, scope, timings) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        results = self.lexical.search(query_text, top_k, scope.get("namespace", ""), scope.get("filter"))
+        timings["lexical"] = time.perf_counter() - started
+        return results
+    
+    def _fuse(self, query_text, vector, lexical, top_k, timings) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        # Chunks containing every identifier in the question are the ones asked about
+        identifiers = identifier_terms(query_text)
+        pinned = {result["id"] for result in lexical
+                  if identifiers and identifiers <= set(tokenize(result["text"]))}
+        results = reciprocal_rank_fusion([vector, lexical], top_k, pinned=pinned)
+        timings["fusion"] = time.perf_counter() - started
+        return results
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._open_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+        return self._executor
+    
+    def _record(self, mode: str, timings: Dict[str, float]):
+        with self._metrics_lock:
+            self.stats[mode] += 1
+            for stage, seconds in timings.items():
+                self._latencies[stage].append(seconds)
+        logger.debug(f"Retrieval ({mode}): "
+                     + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+    
+    def metrics(self) -> Dict[str, Any]:
+        """Queries per retrieval path, p50/p95 seconds per stage and the lexical index size"""
+        with self._metrics_lock:
+            stats = dict(self.stats)
+            latencies = {stage: sorted(samples) for stage, samples in self._latencies.items()}
+        metrics = {
+            "retrieval": self.retrieval,
+            "lexical_chunks": len(self._lexical) if self._lexical is not None else None,
+            **stats
+        }
+        for stage, samples in latencies.items():
+            metrics[f"{stage}_p50"] = samples[len(samples) // 2] if samples else None
+            metrics[f"{stage}_p95"] = samples[min(int(0.95 * len(samples)), len(samples) - 1)] if samples else None
+        return metrics
+    
+    async def _get_async_index(self):
+        """Lazily open an IndexAsyncio on the running loop, or None if the client lacks it"""
+        if self._async_index is not None:
+            return self._async_index or None
+        
+        try:
+            host = (await asyncio.to_thread(self.pinecone_client.describe_index, self.index_name)).host
+            self._async_index = self.pinecone_client.IndexAsyncio(host=host)
+        except Exception as e:
+            # Older clients have no asyncio support; remember that and use threads
+            logger.info(f"Pinecone asyncio client unavailable, querying in a thread: {e}")
+            self._async_index = False
+        
+        return self._async_index or None
+    
+    def _format_matches(self, results) -> List[Dict[str, Any]]:
+        """Turn a Pinecone query response into result dicts with text and metadata"""
+        formatted_results = []
+        for match in results["matches"]:
+            metadata = match["metadata"] or {}
+            formatted_results.append({
+                "id": match["id"],
+                "score": match["score"],
+                "text": metadata.get("text", ""),
+                "metadata": {k: v for k, v in metadata.items() if k != "text"}
+            })
+        
+        return formatted_results
     
     def create_langchain_retriever(self):
         """
         Create a LangChain retriever for the Pinecone index
         
+        The retriever goes through query(), so it searches the same way as
+        direct lookups (hybrid included) and uses the shared embeddings.
+        
         Returns:
             A LangChain retriever or None if initialization failed
         """
@@ -177,31 +536,7 @@ class PineconeManager:
             logger.error("Pinecone not initialized. Cannot create retriever.")
             return None
         
-        try:
-            from langchain_openai import OpenAIEmbeddings
-            from langchain_pinecone import PineconeVectorStore
-            
-            embeddings = OpenAIEmbeddings()
-            
-            # Create a PineconeVectorStore directly
-            vectorstore = PineconeVectorStore(
-                index_name=self.index_name,
-                embedding=embeddings,
-                text_key="text"
-            )
-            
-            # Create retriever
-            retriever = vectorstore.as_retriever()
-            
-            logger.info("Successfully created LangChain retriever")
-            return retriever
-            
-        except ImportError:
-            logger.error("langchain_pinecone not installed. Install with: pip install langchain-pinecone")
-            return None
-        except Exception as e:
-            logger.error(f"Error creating LangChain retriever: {e}")
-            return None
+        return KnowledgeBaseRetriever(knowledge_base=self)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter - Per-provider request and token budgets with a bounded priority queue
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableBinding
+from pydantic import ConfigDict
+
+logger = logging.getLogger("rate_limiter")
+
+# Lower values are admitted first
+PRIORITY_DIRECT = 0
+PRIORITY_MENTION = 1
+PRIORITY_BACKGROUND = 2
+
+DEFAULT_QUEUE_SIZE = 50
+DEFAULT_QUEUE_TIMEOUT_SECONDS = 20.0
+# Completion tokens charged up front when the model doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+# How often async waiters re-check when they aren't at the head of the queue
+ASYNC_POLL_SECONDS = 0.05
+
+_priority: ContextVar[int] = ContextVar("llm_request_priority", default=PRIORITY_BACKGROUND)
+
+
+class ServiceBusyError(Exception):
+    """Raised when a request can't be admitted: the queue is full or the wait ran out"""
+    pass
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Run LLM calls made in this block (and tasks/threads it spawns with copied context) at a priority"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class TokenBucket:
+    """Refills continuously at per_minute, holding at most a minute's worth
+
+    take() may drive the level negative, e.g. for a request larger than the
+    bucket or when usage turns out higher than estimated; later requests
+    wait until the debt is repaid.
+    """
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken (capped at capacity so huge requests still run)"""
+        self._refill()
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """Admits one provider's calls within its requests/min and tokens/min budgets
+
+    Callers wait in a priority queue (FIFO within a priority) and only the
+    head of the queue may take from the buckets, so a burst of channel
+    mentions can't starve a direct message that arrives later. When the
+    queue is full, or a caller has waited max_wait seconds, ServiceBusyError
+    is raised so the bot can say it is busy instead of timing out.
+    """
+
+    def __init__(self, name: str, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_queue: int = DEFAULT_QUEUE_SIZE,
+                 max_wait: float = DEFAULT_QUEUE_TIMEOUT_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._clock = clock
+        # Heap of (priority, sequence) tickets
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._waits: "deque[float]" = deque(maxlen=200)
+        self.stats = {"admitted": 0, "waited": 0, "rejected_full": 0, "rejected_timeout": 0, "max_depth": 0}
+
+    def acquire(self, tokens: int, priority: Optional[int] = None):
+        """Block until the call may go out"""
+        started = self._clock()
+        deadline = started + self.max_wait
+        with self._condition:
+            ticket = self._enqueue(priority)
+            while True:
+                wait = self._try_admit(ticket, tokens, started)
+                if wait == 0:
+                    return
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    self._abandon(ticket)
+                    raise ServiceBusyError(f"Timed out waiting for {self.name} rate limit")
+                self._condition.wait(remaining if wait is None else min(wait, remaining))
+
+    async def aacquire(self, tokens: int, priority: Optional[int] = None):
+        """Async version of acquire; waits without blocking the event loop"""
+        started = self._clock()
+        deadline = started + self.max_wait
+        with self._condition:
+            ticket = self._enqueue(priority)
+        admitted = False
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_admit(ticket, tokens, started)
+                    if wait == 0:
+                        admitted = True
+                        return
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise ServiceBusyError(f"Timed out waiting for {self.name} rate limit")
+                await asyncio.sleep(min(ASYNC_POLL_SECONDS if wait is None else wait, remaining))
+        finally:
+            if not admitted:
+                with self._condition:
+                    self._abandon(ticket)
+
+    def settle(self, estimated: int, actual: int):
+        """Correct the token bucket once a call's real usage is known"""
+        if self.tokens is None or actual == estimated:
+            return
+        with self._condition:
+            if actual < estimated:
+                self.tokens.refund(estimated - actual)
+                self._condition.notify_all()
+            else:
+                self.tokens.take(actual - estimated)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._condition:
+            waits = sorted(self._waits)
+            return {
+                **self.stats,
+                "queue_depth": len(self._queue),
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[min(int(0.95 * len(waits)), len(waits) - 1)] if waits else 0.0,
+                "requests_available": self.requests.level if self.requests else None,
+                "tokens_available": self.tokens.level if self.tokens else None,
+            }
+
+    def _enqueue(self, priority: Optional[int]) -> tuple:
+        if len(self._queue) >= self.max_queue:
+            self.stats["rejected_full"] += 1
+            raise ServiceBusyError(f"{self.name} request queue is full ({self.max_queue} waiting)")
+        ticket = (current_priority() if priority is None else priority, next(self._sequence))
+        heapq.heappush(self._queue, ticket)
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._queue))
+        return ticket
+
+    def _try_admit(self, ticket: tuple, tokens: int, started: float) -> Optional[float]:
+        """0 once admitted, otherwise seconds until the buckets refill (None if not at the head)"""
+        if self._queue[0] != ticket:
+            return None
+        wait = max(self.requests.wait_time(1) if self.requests else 0.0,
+                   self.tokens.wait_time(tokens) if self.tokens else 0.0)
+        if wait > 0:
+            return wait
+
+        heapq.heappop(self._queue)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        waited = self._clock() - started
+        self._waits.append(waited)
+        self.stats["admitted"] += 1
+        if waited > 0.001:
+            self.stats["waited"] += 1
+        # The next ticket is now at the head
+        self._condition.notify_all()
+        return 0
+
+    def _abandon(self, ticket: tuple):
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self.stats["rejected_timeout"] += 1
+            self._condition.notify_all()
+
+
+class RateGovernor:
+    """One limiter per provider, with budgets from <PROVIDER>_RPM and <PROVIDER>_TPM"""
+
+    def __init__(self, max_queue: int = DEFAULT_QUEUE_SIZE, max_wait: float = DEFAULT_QUEUE_TIMEOUT_SECONDS):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._limiters: Dict[str, Optional[ProviderLimiter]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateGovernor":
+        """Queue bounds from LLM_QUEUE_SIZE and LLM_QUEUE_TIMEOUT_SECONDS"""
+        return cls(
+            max_queue=int(os.environ.get("LLM_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+            max_wait=float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", DEFAULT_QUEUE_TIMEOUT_SECONDS)),
+        )
+
+    def limiter(self, provider: str) -> Optional[ProviderLimiter]:
+        """The provider's shared limiter, or None if it has no budget configured"""
+        provider = provider.lower()
+        with self._lock:
+            if provider not in self._limiters:
+                rpm = os.environ.get(f"{provider.upper()}_RPM")
+                tpm = os.environ.get(f"{provider.upper()}_TPM")
+                limiter = None
+                if rpm or tpm:
+                    limiter = ProviderLimiter(provider, float(rpm) if rpm else None, float(tpm) if tpm else None,
+                                              self.max_queue, self.max_wait)
+                    logger.info(f"Rate limiting {provider} to {rpm or 'unlimited'} requests/min, "
+                                f"{tpm or 'unlimited'} tokens/min")
+                self._limiters[provider] = limiter
+            return self._limiters[provider]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {name: limiter.metrics() for name, limiter in limiters.items() if limiter is not None}
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model that waits for its provider's limiter before every call
+
+    Each call is charged its prompt tokens plus the expected completion up
+    front; when the provider reports usage the difference is settled. Give
+    the LLM cache to this model rather than the inner one: BaseChatModel
+    looks it up before _generate, so cache hits never wait for or spend
+    the provider's budget. Entries are keyed like the inner model's would
+    be, including any bound tools.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: Any
+    limiter: Any
+    token_counter: Any
+    completion_tokens: int = DEFAULT_COMPLETION_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "rate_limited"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "RateLimitedChatModel":
+        """Bind tools on the wrapped model; the bound copy shares the limiter"""
+        return self.model_copy(update={"inner": self.inner.bind_tools(tools, **kwargs)})
+
+    def _get_llm_string(self, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        model, bound = self.inner, {}
+        if isinstance(model, RunnableBinding):
+            model, bound = model.bound, dict(model.kwargs)
+        return model._get_llm_string(stop=stop, **{**bound, **kwargs})
+
+    def _estimate(self, messages: List[BaseMessage]) -> int:
+        return sum(self.token_counter.count_message(message) for message in messages) + self.completion_tokens
+
+    def _settle(self, estimated: int, message: BaseMessage):
+        usage = getattr(message, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            self.limiter.settle(estimated, usage["total_tokens"])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        estimated = self._estimate(messages)
+        self.limiter.acquire(estimated)
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        self._settle(estimated, message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        estimated = self._estimate(messages)
+        await self.limiter.aacquire(estimated)
+        message = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+        self._settle(estimated, message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        estimated = self._estimate(messages)
+        self.limiter.acquire(estimated)
+        merged = None
+        try:
+            for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+                merged = chunk if merged is None else merged + chunk
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            # Usage arrives on the last chunk; merging sums it if a provider splits it up
+            if merged is not None:
+                self._settle(estimated, merged)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        estimated = self._estimate(messages)
+        await self.limiter.aacquire(estimated)
+        merged = None
+        try:
+            async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+                merged = chunk if merged is None else merged + chunk
+                yield ChatGenerationChunk(message=chunk)
+        finally:
+            if merged is not None:
+                self._settle(estimated, merged)
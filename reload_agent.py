@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Reload agent configuration when the flow is updated
+
+The running app reloads itself in-process unless it was started with FLOW_HOT_RELOAD=0.
+This script validates the saved flow and touches it so the watcher picks it up.
 """
 import os
 import sys
@@ -20,24 +23,30 @@ logging.basicConfig(
 logger = logging.getLogger("agent_reload")
 
 def reload_agent():
-    """Reload the agent configuration"""
+    """Validate the flow and notify the running agent that it changed"""
     try:
-        # Import the LangChainManager
         sys.path.append(str(Path(__file__).parent))
-        from langchain_manager import LangChainManager
-        
-        # Create a new instance of LangChainManager to reload configuration
-        manager = LangChainManager()
+        from flow_compiler import FlowValidationError
+        from flow_manager import FlowManager
         
-        # Reload the configuration
-        success = manager.reload_configuration()
+        flow_manager = FlowManager()
         
-        if success:
-            logger.info("Successfully reloaded agent configuration")
-            return True
-        else:
-            logger.error("Failed to reload agent configuration")
+        # Compile the flow so an invalid one is reported here, not in the bot
+        try:
+            spec = flow_manager.get_agent_spec()
+        except FlowValidationError as e:
+            logger.error(f"Flow is invalid, not reloading: {e}")
             return False
+        
+        # Bump the mtime so the in-process watcher reloads the agent
+        if flow_manager.flow_path.exists():
+            os.utime(flow_manager.flow_path)
+        
+        logger.info(
+            f"Flow is valid ({spec.llm.provider}/{spec.llm.model}, {len(spec.tools)} tools); "
+            f"the running app reloads it unless started with FLOW_HOT_RELOAD=0"
+        )
+        return True
             
     except Exception as e:
         logger.error(f"Error reloading agent configuration: {e}")
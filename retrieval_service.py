@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Retrieval Service - The single path to the knowledge base, with one embedding and one index query per request
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from pinecone_manager import KnowledgeBaseRetriever, PineconeManager
+
+logger = logging.getLogger("retrieval_service")
+
+DEFAULT_TOP_K = 3
+# How the knowledge base is split: one shared namespace, one per Slack workspace, or one per channel
+PARTITIONS = ("none", "workspace", "channel")
+
+
+@dataclass(frozen=True)
+class SlackContext:
+    """Where a message came from, which decides the knowledge base partition it may search"""
+    team_id: Optional[str] = None
+    channel_id: Optional[str] = None
+    user_id: Optional[str] = None
+    is_direct: bool = False
+
+
+def workspace_namespace(team_id: str) -> str:
+    return f"team-{team_id}"
+
+
+def channel_namespace(channel_id: str) -> str:
+    return f"channel-{channel_id}"
+
+
+class _RequestMemo:
+    """Embeddings and results seen while handling one user message"""
+    __slots__ = ("embeddings", "results", "context")
+
+    def __init__(self, context: Optional[SlackContext] = None):
+        self.embeddings: Dict[str, List[float]] = {}
+        # (top_k the results were fetched with, results)
+        self.results: Dict[str, Tuple[int, List[Dict[str, Any]]]] = {}
+        self.context = context
+
+
+_memo: ContextVar[Optional[_RequestMemo]] = ContextVar("retrieval_memo", default=None)
+
+
+@contextmanager
+def request_scope(context: Optional[SlackContext] = None):
+    """Memoize knowledge base lookups for the duration of the block, e.g. one user message
+
+    context is the Slack message being answered; lookups in the block search
+    its partition. Nested scopes share the outermost memo and context.
+    Outside any scope every lookup goes to the index's default namespace.
+    """
+    if _memo.get() is not None:
+        yield
+        return
+    token = _memo.set(_RequestMemo(context))
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+class RetrievalService:
+    """Knowledge base lookups shared by the direct RAG answer and the knowledge_base_search tool
+
+    Both go through query()/aquery(), so within a request_scope() a
+    question is embedded at most once and the index is queried at most once:
+    if the direct answer found nothing and the agent's tool then searches
+    for the same text, it gets the memoized (empty) results instead of
+    paying for the lookup again. Texts are compared case- and
+    whitespace-insensitively, and results fetched for a larger top_k answer
+    smaller ones.
+
+    With partition "workspace" or "channel", lookups search the namespace of
+    the scope's Slack workspace or channel (team-<id> / channel-<id>); a
+    direct message searches its workspace's namespace. metadata_filter is a
+    Pinecone filter sent with every query, in which "{team}", "{channel}"
+    and "{user}" are replaced by the scope's ids, e.g.
+    {"channel": {"$in": ["{channel}", "all"]}} to share one namespace
+    between channels.
+    """
+
+    def __init__(self, knowledge_base: PineconeManager, top_k: int = DEFAULT_TOP_K, partition: str = "none",
+                 metadata_filter: Optional[Dict[str, Any]] = None):
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown knowledge base partition '{partition}'")
+        self.knowledge_base = knowledge_base
+        self.top_k = top_k
+        self.partition = partition
+        self.metadata_filter = metadata_filter
+        self._lock = threading.Lock()
+        self.stats = {"queries": 0, "query_memo_hits": 0, "embeddings": 0, "embedding_memo_hits": 0,
+                      "unscoped_queries": 0}
+
+    def is_initialized(self) -> bool:
+        return self.knowledge_base.is_initialized()
+
+    def answers_lexically(self, text: str) -> bool:
+        return self.knowledge_base.answers_lexically(text)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def embed(self, text: str) -> List[float]:
+        """The question's embedding, computed once per request"""
+        memo = _memo.get()
+        key = _normalize(text)
+        if memo is not None and key in memo.embeddings:
+            self._count("embedding_memo_hits")
+            return memo.embeddings[key]
+        self._count("embeddings")
+        embedding = self.knowledge_base.embed_query(text)
+        if memo is not None:
+            memo.embeddings[key] = embedding
+        return embedding
+
+    async def aembed(self, text: str) -> List[float]:
+        """Async version of embed"""
+        memo = _memo.get()
+        key = _normalize(text)
+        if memo is not None and key in memo.embeddings:
+            self._count("embedding_memo_hits")
+            return memo.embeddings[key]
+        self._count("embeddings")
+        embedding = await self.knowledge_base.aembed_query(text)
+        if memo is not None:
+            memo.embeddings[key] = embedding
+        return embedding
+
+    def _scope(self, memo: Optional[_RequestMemo]) -> Dict[str, Any]:
+        """The namespace and filter for the current request"""
+        context = memo.context if memo is not None else None
+        if context is None:
+            if self.partition != "none":
+                # No message to partition by, e.g. a call outside the Slack handlers
+                self._count("unscoped_queries")
+            return {"namespace": "", "metadata_filter": self._fill(self.metadata_filter, SlackContext())}
+
+        namespace = ""
+        if self.partition == "channel" and context.channel_id and not context.is_direct:
+            namespace = channel_namespace(context.channel_id)
+        elif self.partition != "none" and context.team_id:
+            namespace = workspace_namespace(context.team_id)
+        return {"namespace": namespace, "metadata_filter": self._fill(self.metadata_filter, context)}
+
+    def _fill(self, value: Any, context: SlackContext) -> Any:
+        """A plain dict/list copy of a filter with the {team}, {channel} and {user} placeholders replaced
+
+        Filters from the flow arrive frozen (mapping proxies and tuples).
+        """
+        if isinstance(value, Mapping):
+            return {key: self._fill(item, context) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._fill(item, context) for item in value]
+        if isinstance(value, str) and "{" in value:
+            return (value.replace("{team}", context.team_id or "")
+                    .replace("{channel}", context.channel_id or "")
+                    .replace("{user}", context.user_id or ""))
+        return value
+
+    def _memoized(self, memo: Optional[_RequestMemo], key: str, top_k: int) -> Optional[List[Dict[str, Any]]]:
+        cached = memo.results.get(key) if memo is not None else None
+        if cached is not None and cached[0] >= top_k:
+            self._count("query_memo_hits")
+            return cached[1][:top_k]
+        return None
+
+    def query(self, text: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Knowledge base results for a question, reusing this request's earlier lookups"""
+        top_k = top_k or self.top_k
+        memo = _memo.get()
+        key = _normalize(text)
+        results = self._memoized(memo, key, top_k)
+        if results is not None:
+            return results
+
+        self._count("queries")
+        embedding = memo.embeddings.get(key) if memo is not None else None
+        results = self.knowledge_base.query(text, top_k=top_k, query_embedding=embedding, **self._scope(memo))
+        if memo is not None:
+            memo.results[key] = (top_k, results)
+        return results
+
+    async def aquery(self, text: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Async version of query"""
+        top_k = top_k or self.top_k
+        memo = _memo.get()
+        key = _normalize(text)
+        results = self._memoized(memo, key, top_k)
+        if results is not None:
+            return results
+
+        self._count("queries")
+        embedding = memo.embeddings.get(key) if memo is not None else None
+        results = await self.knowledge_base.aquery(
+            text, top_k=top_k, query_embedding=embedding, **self._scope(memo)
+        )
+        if memo is not None:
+            memo.results[key] = (top_k, results)
+        return results
+
+    def as_retriever(self) -> KnowledgeBaseRetriever:
+        """A LangChain retriever over query(), for the knowledge_base_search tool"""
+        return KnowledgeBaseRetriever(knowledge_base=self, top_k=self.top_k)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Lookups and memo hits, plus the knowledge base's per-stage latencies"""
+        with self._lock:
+            stats = dict(self.stats)
+        return {**stats, **self.knowledge_base.metrics()}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Semantic Cache - Reuses knowledge base answers for questions that mean the same thing
+"""
+import hashlib
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger("semantic_cache")
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL_SECONDS = 86400
+DEFAULT_MAX_ENTRIES = 1000
+
+
+def context_hash(results: Sequence[Dict[str, Any]]) -> str:
+    """Identify the retrieved context an answer was generated from"""
+    digest = hashlib.sha1()
+    for result in results:
+        digest.update(str(result.get("id", "")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(result.get("text", "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _unit(vector: Sequence[float]) -> Tuple[float, ...]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return tuple(x / norm for x in vector)
+
+
+@dataclass
+class _Entry:
+    question: str
+    embedding: Tuple[float, ...]
+    bucket: Tuple[str, str]
+    answer: str
+    created_at: float
+
+
+class SemanticResponseCache:
+    """Answers keyed by question embedding and the context they were generated from
+
+    A lookup only considers entries generated from the same retrieved
+    context (and scope, e.g. the model), and returns the answer of the most
+    similar prior question if its cosine similarity reaches the threshold.
+    Comparing against one context's entries keeps lookups cheap without a
+    vector index. Entries expire after ttl_seconds, the least recently used
+    are evicted beyond max_entries, and invalidate() drops everything when
+    the knowledge base changes.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], Set[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticResponseCache"]:
+        """Create the cache if SEMANTIC_CACHE is on, tuned by SEMANTIC_CACHE_THRESHOLD,
+        SEMANTIC_CACHE_TTL_SECONDS and SEMANTIC_CACHE_MAX_ENTRIES"""
+        if os.environ.get("SEMANTIC_CACHE", "").lower() not in ("1", "true", "yes"):
+            return None
+        ttl = os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", str(DEFAULT_TTL_SECONDS))
+        return cls(
+            threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+            ttl_seconds=float(ttl) if ttl else None,
+            max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        )
+
+    def lookup(self, embedding: Sequence[float], context: str, scope: str = "") -> Optional[str]:
+        """The cached answer for a similar question over the same context, or None"""
+        query = _unit(embedding)
+        now = self._clock()
+        with self._lock:
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._buckets.get((scope, context), ())):
+                entry = self._entries[entry_id]
+                if self._expired(entry, now):
+                    self._remove(entry_id)
+                    self.stats["expired"] += 1
+                    continue
+                score = sum(a * b for a, b in zip(query, entry.embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+        logger.debug(f"Semantic cache hit ({best_score:.3f}) for '{entry.question}'")
+        return entry.answer
+
+    def store(self, question: str, embedding: Sequence[float], context: str, answer: str, scope: str = ""):
+        """Remember an answer generated for a question over a context"""
+        if not answer:
+            return
+        bucket = (scope, context)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = _Entry(question, _unit(embedding), bucket, answer, self._clock())
+            self._buckets.setdefault(bucket, set()).add(entry_id)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self):
+        """Drop every entry, e.g. after documents were added to the knowledge base"""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.stats["invalidations"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "size": len(self._entries),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                **self.stats,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._buckets.get(entry.bucket)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._buckets[entry.bucket]
@@ -1,12 +1,19 @@
 import logging
+import re
 from slack_bolt import App
 from langchain_manager import LangChainManager
 from command_handler import CommandHandler
+from rate_limiter import PRIORITY_DIRECT, PRIORITY_MENTION, ServiceBusyError
+from retrieval_service import SlackContext
+from slack_streamer import SlackMessageStreamer, streaming_enabled
 from utils import extract_command, format_slack_message
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Sent right away when the LLM request queue is full instead of letting the user wait for a timeout
+BUSY_MESSAGE = "I'm handling a lot of requests right now. Please try again in a minute."
+
 class SlackHandler:
     """Handles Slack events and commands"""
     
@@ -14,6 +21,7 @@ class SlackHandler:
         self.app = app
         self.langchain_manager = LangChainManager()
         self.command_handler = CommandHandler()
+        self.streaming = streaming_enabled()
         self._register_commands()
         self.register_handlers()
         
@@ -43,6 +51,72 @@ class SlackHandler:
         # Log the registered handlers
         logger.info("Registered event handlers: message, app_mention")
         
+    def _run_command(self, text: str, channel_id: str, user_id: str) -> Tuple[bool, Optional[str]]:
+        """Run the message as a command if it is one; returns (was_command, response)"""
+        parsed = self._parse_command(text, channel_id, user_id)
+        if parsed is None:
+            return False, None
+        return True, self.command_handler.handle_command(*parsed)
+    
+    def _parse_command(self, text: str, channel_id: str,
+                       user_id: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """The (command, args, context) of a message, or None if it isn't a command"""
+        command, args = extract_command(text)
+        
+        if not (command and (command.startswith("!") or self.command_handler.has_command(command))):
+            return None
+        
+        # Remove the ! prefix if present
+        if command.startswith("!"):
+            command = command[1:]
+            
+        # Process the command
+        context = {
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "conversation_key": f"{channel_id}:{user_id}"
+        }
+        
+        return command, args, context
+    
+    def _strip_mention(self, text: str) -> str:
+        """Remove the <@BOT_ID> mention from an app_mention's text"""
+        # The bot ID is typically in the text as <@BOT_ID>
+        bot_id_match = re.search(r'<@([A-Z0-9]+)>', text)
+        if bot_id_match:
+            return text.replace(f"<@{bot_id_match.group(1)}>", "").strip()
+        
+        # If we can't extract the bot ID, just use the text as is
+        logger.warning("Could not extract bot ID from mention text")
+        return text
+    
+    def _slack_context(self, body: Dict[str, Any]) -> SlackContext:
+        """The workspace, channel and user of an event, which select its knowledge base partition"""
+        event = body["event"]
+        return SlackContext(
+            team_id=event.get("team") or body.get("team_id"),
+            channel_id=event.get("channel"),
+            user_id=event.get("user"),
+            is_direct=event.get("channel_type") == "im"
+        )
+    
+    def _stream_reply(self, channel_id: str, conversation_key: str, text: str, priority: int,
+                      context: Optional[SlackContext] = None):
+        """Post a placeholder and edit it as the response is generated"""
+        streamer = SlackMessageStreamer(self.app.client, channel_id)
+        streamer.start()
+        response = None
+        try:
+            for response in self.langchain_manager.stream_response(conversation_key, text, priority, context):
+                streamer.update(response)
+        except ServiceBusyError as e:
+            logger.warning(f"Too busy to answer: {e}")
+            response = BUSY_MESSAGE
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            response = "I'm having trouble processing your request. Please try again later."
+        streamer.finish(response or "I'm sorry, I couldn't generate a response. Please try again.")
+    
     def handle_message(self, body: Dict[str, Any], logger: logging.Logger):
         """Handle direct messages to the bot"""
         event = body["event"]
@@ -63,22 +137,9 @@ class SlackHandler:
         conversation_key = f"{channel_id}:{user_id}"
         
         # Check if this is a command
-        command, args = extract_command(text)
+        is_command, response = self._run_command(text, channel_id, user_id)
         
-        if command and (command.startswith("!") or self.command_handler.has_command(command)):
-            # Remove the ! prefix if present
-            if command.startswith("!"):
-                command = command[1:]
-                
-            # Process the command
-            context = {
-                "user_id": user_id,
-                "channel_id": channel_id,
-                "conversation_key": conversation_key
-            }
-            
-            response = self.command_handler.handle_command(command, args, context)
-            
+        if is_command:
             if response:
                 self.app.client.chat_postMessage(
                     channel=channel_id,
@@ -86,9 +147,15 @@ class SlackHandler:
                 )
             return
         
-        # Get the response from LangChain
+        # Get the response from LangChain, searching the knowledge base partition of this workspace/channel
+        slack_context = self._slack_context(body)
         try:
-            response = self.langchain_manager.generate_response(conversation_key, text)
+            if self.streaming:
+                self._stream_reply(channel_id, conversation_key, text, PRIORITY_DIRECT, slack_context)
+                return
+            
+            response = self.langchain_manager.generate_response(conversation_key, text, PRIORITY_DIRECT,
+                                                                slack_context)
             
             # Handle None responses
             if response is None:
@@ -102,6 +169,9 @@ class SlackHandler:
                     channel=channel_id,
                     text=response
                 )
+        except ServiceBusyError as e:
+            logger.warning(f"Too busy to answer: {e}")
+            self.app.client.chat_postMessage(channel=channel_id, text=BUSY_MESSAGE)
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             self.app.client.chat_postMessage(
@@ -118,43 +188,28 @@ class SlackHandler:
             text = event["text"]
             
             # Extract bot ID from the event
-            # The bot ID is typically in the text as <@BOT_ID>
-            import re
-            bot_id_match = re.search(r'<@([A-Z0-9]+)>', text)
-            if bot_id_match:
-                bot_id = bot_id_match.group(1)
-                text = text.replace(f"<@{bot_id}>", "").strip()
-            else:
-                # If we can't extract the bot ID, just use the text as is
-                logger.warning("Could not extract bot ID from mention text")
+            text = self._strip_mention(text)
             
             # Create a unique key for this conversation
             conversation_key = f"{channel_id}:{user_id}"
             
             # Check if this is a command
-            command, args = extract_command(text)
+            is_command, response = self._run_command(text, channel_id, user_id)
             
-            if command and (command.startswith("!") or self.command_handler.has_command(command)):
-                # Remove the ! prefix if present
-                if command.startswith("!"):
-                    command = command[1:]
-                    
-                # Process the command
-                context = {
-                    "user_id": user_id,
-                    "channel_id": channel_id,
-                    "conversation_key": conversation_key
-                }
-                
-                response = self.command_handler.handle_command(command, args, context)
-                
+            if is_command:
                 if response:
                     say(response)
                 return
             
-            # Get the response from LangChain
+            # Get the response from LangChain, searching the knowledge base partition of this workspace/channel
+            slack_context = self._slack_context(body)
             try:
-                response = self.langchain_manager.generate_response(conversation_key, text)
+                if self.streaming:
+                    self._stream_reply(channel_id, conversation_key, text, PRIORITY_MENTION, slack_context)
+                    return
+                
+                response = self.langchain_manager.generate_response(conversation_key, text, PRIORITY_MENTION,
+                                                                    slack_context)
                 
                 # Handle None responses
                 if response is None:
@@ -162,6 +217,9 @@ class SlackHandler:
                     say("I'm sorry, I couldn't generate a response. Please try again.")
                 else:
                     say(response)
+            except ServiceBusyError as e:
+                logger.warning(f"Too busy to answer: {e}")
+                say(BUSY_MESSAGE)
             except Exception as e:
                 logger.error(f"Error processing mention: {e}")
                 say("I'm having trouble processing your request. Please try again later.")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Slack Streamer - Shows a response while it is generated by editing one message
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("slack_streamer")
+
+STREAMING_PLACEHOLDER = "_Thinking..._"
+# Slack allows roughly one chat.update per second per message
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MIN_CHARS = 40
+# Once this many intervals pass without an edit, any new text is shown, however little
+STALE_EDIT_INTERVALS = 2
+# Shown after the partial text so users can tell the answer isn't finished
+TYPING_SUFFIX = " ▍"
+
+
+def streaming_enabled() -> bool:
+    """Check if progressive responses were requested with SLACK_STREAMING"""
+    return os.environ.get("SLACK_STREAMING", "").lower() in ("1", "true", "yes")
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait if the error is a Slack rate limit, else None"""
+    response = getattr(error, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", headers.get("retry-after", 1)))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class _EditPolicy:
+    """Decides when a partial response is worth an edit
+
+    An edit is sent once at least `min_interval` seconds have passed since
+    the last one and the text grew by at least `min_chars`, so a fast model
+    costs about one API call per second instead of one per token. A slow
+    model's trickle of text is shown anyway after STALE_EDIT_INTERVALS
+    intervals, so the message doesn't sit on a stale prefix.
+    """
+
+    def __init__(self, min_interval: float, min_chars: int, clock: Callable[[], float]):
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self._clock = clock
+        self.sent_text = ""
+        self._next_edit = 0.0
+        self._last_edit = 0.0
+        self.stats = {"edits": 0, "skipped": 0, "rate_limited": 0}
+
+    def due(self, text: str) -> bool:
+        now = self._clock()
+        if text == self.sent_text or now < self._next_edit:
+            self.stats["skipped"] += 1
+            return False
+        stale = now - self._last_edit >= self.min_interval * STALE_EDIT_INTERVALS
+        if len(text) - len(self.sent_text) < self.min_chars and not stale:
+            self.stats["skipped"] += 1
+            return False
+        return True
+
+    def sent(self, text: str):
+        self.sent_text = text
+        self.stats["edits"] += 1
+        self._last_edit = self._clock()
+        self._next_edit = self._last_edit + self.min_interval
+
+    def failed(self, error: Exception):
+        delay = _retry_after(error)
+        if delay is not None:
+            self.stats["rate_limited"] += 1
+            self._next_edit = self._clock() + delay
+            logger.warning(f"Slack rate limited message edits, waiting {delay}s")
+        else:
+            logger.error(f"Error updating streamed message: {error}")
+            self._next_edit = self._clock() + self.min_interval
+
+
+class SlackMessageStreamer:
+    """Posts a placeholder right away and edits it as the response grows
+
+    Usage:
+        streamer = SlackMessageStreamer(client, channel_id)
+        streamer.start()
+        for text in langchain_manager.stream_response(key, question):
+            streamer.update(text)
+        streamer.finish(text)
+    """
+
+    def __init__(self, client: Any, channel: str, thread_ts: Optional[str] = None,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, min_chars: int = DEFAULT_MIN_CHARS,
+                 placeholder: str = STREAMING_PLACEHOLDER, clock: Callable[[], float] = time.monotonic):
+        self.client = client
+        self.channel = channel
+        self.thread_ts = thread_ts
+        self.placeholder = placeholder
+        self.ts: Optional[str] = None
+        self.policy = _EditPolicy(min_interval, min_chars, clock)
+
+    def start(self):
+        """Post the placeholder message that later edits replace"""
+        kwargs = {"channel": self.channel, "text": self.placeholder}
+        if self.thread_ts:
+            kwargs["thread_ts"] = self.thread_ts
+        response = self.client.chat_postMessage(**kwargs)
+        self.ts = response["ts"]
+        self.policy.sent("")
+
+    def update(self, text: str):
+        """Show partial text if enough time and text has accumulated since the last edit"""
+        if self.ts is None or not text or not self.policy.due(text):
+            return
+        try:
+            self.client.chat_update(channel=self.channel, ts=self.ts, text=text + TYPING_SUFFIX)
+            self.policy.sent(text)
+        except Exception as e:
+            self.policy.failed(e)
+
+    def finish(self, text: str):
+        """Replace the message with the final text, waiting out a rate limit if needed"""
+        if self.ts is None:
+            self.client.chat_postMessage(channel=self.channel, text=text, thread_ts=self.thread_ts)
+            return
+        for _ in range(3):
+            try:
+                self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+                self.policy.sent(text)
+                return
+            except Exception as e:
+                delay = _retry_after(e)
+                if delay is None:
+                    raise
+                self.policy.failed(e)
+                time.sleep(delay)
+        logger.error("Could not deliver the final streamed message after retries")
+
+
+class AsyncSlackMessageStreamer(SlackMessageStreamer):
+    """SlackMessageStreamer for the AsyncApp client"""
+
+    async def start(self):
+        kwargs = {"channel": self.channel, "text": self.placeholder}
+        if self.thread_ts:
+            kwargs["thread_ts"] = self.thread_ts
+        response = await self.client.chat_postMessage(**kwargs)
+        self.ts = response["ts"]
+        self.policy.sent("")
+
+    async def update(self, text: str):
+        if self.ts is None or not text or not self.policy.due(text):
+            return
+        try:
+            await self.client.chat_update(channel=self.channel, ts=self.ts, text=text + TYPING_SUFFIX)
+            self.policy.sent(text)
+        except Exception as e:
+            self.policy.failed(e)
+
+    async def finish(self, text: str):
+        if self.ts is None:
+            await self.client.chat_postMessage(channel=self.channel, text=text, thread_ts=self.thread_ts)
+            return
+        for _ in range(3):
+            try:
+                await self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+                self.policy.sent(text)
+                return
+            except Exception as e:
+                delay = _retry_after(e)
+                if delay is None:
+                    raise
+                self.policy.failed(e)
+                await asyncio.sleep(delay)
+        logger.error("Could not deliver the final streamed message after retries")
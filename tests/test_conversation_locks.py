@@ -0,0 +1,138 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from conversation_locks import AsyncConversationLocks, ConversationLocks  # noqa: E402
+
+
+class InterruptingCondition:
+    """Wraps a key's condition so one thread is interrupted while it waits"""
+
+    def __init__(self, condition, victim):
+        self._condition = condition
+        self._victim = victim
+
+    def __enter__(self):
+        return self._condition.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._condition.__exit__(*exc_info)
+
+    def wait(self, timeout=None):
+        if threading.current_thread() is self._victim:
+            raise KeyboardInterrupt
+        return self._condition.wait(timeout)
+
+    def notify_all(self):
+        self._condition.notify_all()
+
+
+def wait_for_tickets(locks, key, count):
+    deadline = time.monotonic() + 2
+    while locks._locks[key].next_ticket < count:
+        assert time.monotonic() < deadline, "waiter never took its ticket"
+        time.sleep(0.001)
+
+
+def start_holder(locks, key):
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with locks.hold(key):
+            held.set()
+            release.wait(2)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    assert held.wait(2)
+    return thread, release
+
+
+def test_waiters_run_in_arrival_order_and_lock_is_dropped():
+    locks = ConversationLocks()
+    holder, release = start_holder(locks, "C1")
+    order = []
+
+    def request(number):
+        with locks.hold("C1"):
+            order.append(number)
+
+    waiters = []
+    for number in range(5):
+        waiter = threading.Thread(target=request, args=(number,))
+        waiter.start()
+        wait_for_tickets(locks, "C1", number + 2)
+        waiters.append(waiter)
+
+    release.set()
+    for thread in [holder, *waiters]:
+        thread.join(2)
+
+    assert order == [0, 1, 2, 3, 4]
+    assert locks.metrics() == {"active": 0, "acquired": 6, "waited": 5}
+
+
+def test_interrupted_waiter_neither_releases_early_nor_strands_later_tickets():
+    locks = ConversationLocks()
+    holder, release = start_holder(locks, "C1")
+    order = []
+
+    def request(number):
+        with locks.hold("C1"):
+            order.append(number)
+
+    first = threading.Thread(target=request, args=(1,))
+    first.start()
+    wait_for_tickets(locks, "C1", 2)
+
+    lock = locks._locks["C1"]
+    lock.condition = InterruptingCondition(lock.condition, threading.current_thread())
+    with pytest.raises(KeyboardInterrupt):
+        with locks.hold("C1"):
+            order.append("interrupted")
+
+    last = threading.Thread(target=request, args=(3,))
+    last.start()
+    wait_for_tickets(locks, "C1", 4)
+    time.sleep(0.05)
+    # The holder still has the lock, so nobody behind it may run yet
+    assert order == []
+
+    release.set()
+    for thread in (holder, first, last):
+        thread.join(2)
+
+    assert order == [1, 3]
+    assert locks.metrics()["active"] == 0
+
+
+def test_async_waiters_run_in_order_and_cancelled_waiter_is_skipped():
+    locks = AsyncConversationLocks()
+    order = []
+
+    async def request(number, release=None):
+        async with locks.hold("C1"):
+            order.append(number)
+            if release is not None:
+                await release.wait()
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(request(0, release))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(request(number)) for number in (1, 2, 3)]
+        await asyncio.sleep(0)
+        waiters[1].cancel()
+        release.set()
+        await asyncio.gather(holder, *waiters, return_exceptions=True)
+
+    asyncio.run(main())
+
+    assert order == [0, 1, 3]
+    assert locks.metrics() == {"active": 0, "acquired": 4, "waited": 3}
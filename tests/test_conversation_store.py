@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from conversation_store import ConversationStore, LRUConversationStore  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ConversationStore()
+
+
+def test_idle_entries_expire_after_ttl():
+    clock = FakeClock()
+    store = LRUConversationStore(ttl_seconds=60, clock=clock)
+    store.put("C1:U1", "first")
+    store.put("C1:U2", "second")
+
+    clock.now = 50
+    assert store.get("C1:U1") == "first"
+    clock.now = 100
+    # C1:U2 has been idle for 100s, C1:U1 only for 50s
+    assert "C1:U2" not in store
+    assert store.evict_expired() == 1
+    assert store.keys() == ["C1:U1"]
+
+    clock.now = 200
+    assert store.get("C1:U1") is None
+    assert store.metrics()["evicted_ttl"] == 2
+
+
+def test_capacity_evicts_least_recently_used():
+    store = LRUConversationStore(max_entries=2)
+    store.put("a", 1)
+    store.put("b", 2)
+    store.get("a")
+    store.put("c", 3)
+
+    assert store.keys() == ["a", "c"]
+    assert store.metrics()["evicted_capacity"] == 1
+
+
+def test_memory_budget_evicts_until_it_fits_and_tracks_growth():
+    store = LRUConversationStore(max_memory_bytes=10, size_of=len)
+    store.put("a", "xxxx")
+    store.put("b", "xxxx")
+    assert store.metrics()["memory_bytes"] == 8
+
+    store.put("c", "xxxx")
+    assert store.keys() == ["b", "c"]
+
+    # An entry that grows in place is re-measured by touch()
+    history = []
+    store.put("d", history)
+    store.pop("b")
+    history.extend(["x"] * 9)
+    store.touch("d")
+    assert store.keys() == ["d"]
+    assert store.metrics()["memory_bytes"] == 9
+    assert store.metrics()["evicted_memory"] == 2
+
+
+def test_eviction_listeners_run_with_reason_and_survive_errors():
+    clock = FakeClock()
+    evicted = []
+
+    def failing_listener(key, value, reason):
+        raise RuntimeError("persist failed")
+
+    store = LRUConversationStore(max_entries=1, ttl_seconds=10, clock=clock,
+                                 on_evict=lambda *args: evicted.append(args))
+    store.add_eviction_listener(failing_listener)
+    store.add_eviction_listener(lambda *args: evicted.append(("second", *args)))
+
+    store.put("a", 1)
+    store.put("b", 2)
+    clock.now = 20
+    store.get("b")
+
+    assert evicted == [("a", 1, "capacity"), ("second", "a", 1, "capacity"),
+                       ("b", 2, "ttl"), ("second", "b", 2, "ttl")]
+    # Removing an entry on purpose is not an eviction
+    store.put("c", 3)
+    store.pop("c")
+    assert len(evicted) == 4
@@ -0,0 +1,96 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import langchain_manager  # noqa: E402
+from flow_compiler import AgentSpec, FlowValidationError  # noqa: E402
+from flow_manager import FlowManager  # noqa: E402
+
+PROMPT_ONLY_FLOW = {
+    "nodes": [{"id": "prompt", "type": "systemPrompt", "data": {"prompt": "Be brief."}}],
+    "edges": [],
+}
+NODE_WITHOUT_ID_FLOW = {
+    "nodes": [{"type": "llm", "data": {"provider": "openai", "model": "gpt-4o"}}],
+    "edges": [],
+}
+
+
+def flow_manager_for(tmp_path, flow):
+    flow_path = tmp_path / "slack-agent-flow.json"
+    flow_path.write_text(json.dumps(flow))
+    flow_manager = FlowManager()
+    flow_manager.flow_path = flow_path
+    flow_manager.settings_path = tmp_path / "settings.json"
+    return flow_manager
+
+
+@pytest.mark.parametrize("flow", [PROMPT_ONLY_FLOW, NODE_WITHOUT_ID_FLOW])
+def test_getters_fall_back_to_defaults_on_invalid_flow(tmp_path, flow):
+    flow_manager = flow_manager_for(tmp_path, flow)
+
+    assert flow_manager.get_llm_config() == {"provider": "openai", "model": "gpt-4"}
+    assert flow_manager.get_system_prompt() == "You are a helpful assistant for Slack."
+    assert flow_manager.get_tools_config() == []
+    assert flow_manager.get_rag_config() is None
+    assert flow_manager.is_rag_enabled() is False
+
+
+@pytest.mark.parametrize("flow", [PROMPT_ONLY_FLOW, NODE_WITHOUT_ID_FLOW])
+def test_get_agent_spec_stays_strict(tmp_path, flow):
+    flow_manager = flow_manager_for(tmp_path, flow)
+
+    with pytest.raises(FlowValidationError):
+        flow_manager.get_agent_spec()
+
+
+def manager_for(tmp_path, monkeypatch, flow):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("CONVERSATION_HISTORY_BACKEND", "none")
+    flow_path = tmp_path / "slack-agent-flow.json"
+    flow_path.write_text(json.dumps(flow))
+
+    class TmpFlowManager(FlowManager):
+        def __init__(self):
+            super().__init__()
+            self.flow_path = flow_path
+            self.settings_path = tmp_path / "settings.json"
+
+    monkeypatch.setattr(langchain_manager, "FlowManager", TmpFlowManager)
+    return langchain_manager.LangChainManager()
+
+
+def test_manager_starts_with_default_agent_on_invalid_flow(tmp_path, monkeypatch):
+    manager = manager_for(tmp_path, monkeypatch, PROMPT_ONLY_FLOW)
+
+    assert manager._runtime.spec == AgentSpec()
+
+
+def test_layout_only_edit_keeps_the_runtime(tmp_path, monkeypatch):
+    flow = {"nodes": [{"id": "llm", "type": "llm", "position": {"x": 0, "y": 0}, "data": {"model": "gpt-4o"}}],
+            "edges": []}
+    manager = manager_for(tmp_path, monkeypatch, flow)
+    runtime = manager._runtime
+
+    flow["nodes"][0]["position"] = {"x": 120, "y": 40}
+    manager.flow_manager.flow_path.write_text(json.dumps(flow))
+
+    assert manager.reload_configuration() is True
+    assert manager._runtime is runtime
+
+
+def test_configured_tools_are_logged_as_plain_json(tmp_path, monkeypatch, caplog):
+    flow = {"nodes": [{"id": "llm", "type": "llm", "data": {}},
+                      {"id": "tools", "type": "tools",
+                       "data": {"tools": [{"id": "weather", "enabled": True}]}}],
+            "edges": []}
+
+    with caplog.at_level("INFO"):
+        manager_for(tmp_path, monkeypatch, flow)
+
+    assert "Configured tools: [{'id': 'weather', 'enabled': True}]" in caplog.text
+    assert "mappingproxy" not in caplog.text
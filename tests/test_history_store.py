@@ -0,0 +1,78 @@
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from history_store import ChatHistoryBackend, SQLiteHistoryBackend  # noqa: E402
+
+
+def stored_rows(path):
+    with sqlite3.connect(str(path)) as conn:
+        return conn.execute("SELECT conversation_key, seq, content FROM messages ORDER BY seq").fetchall()
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ChatHistoryBackend()
+
+
+def test_full_batch_is_written_without_waiting_for_the_interval(tmp_path):
+    path = tmp_path / "history.db"
+    backend = SQLiteHistoryBackend(path, batch_size=3, flush_interval=60)
+    try:
+        for seq in range(3):
+            backend.append("C1:U1", [(seq, HumanMessage(content=f"message {seq}"))])
+
+        deadline = time.monotonic() + 5
+        while backend.stats["batches"] < 1:
+            assert time.monotonic() < deadline, "batch was not written"
+            time.sleep(0.01)
+
+        assert backend.stats["batches"] == 1
+        assert stored_rows(path) == [("C1:U1", seq, f"message {seq}") for seq in range(3)]
+    finally:
+        backend.close()
+
+
+def test_history_survives_a_restart(tmp_path):
+    path = tmp_path / "history.db"
+    backend = SQLiteHistoryBackend(path, flush_interval=60)
+    backend.append("C1:U1", [(0, HumanMessage(content="hi")), (1, AIMessage(content="hello")),
+                             (2, HumanMessage(content="how are you?"))])
+    backend.save_summary("C1:U1", "Greetings were exchanged.", 2)
+    backend.close()
+
+    reopened = SQLiteHistoryBackend(path)
+    try:
+        conversation = reopened.load("C1:U1", limit=10)
+    finally:
+        reopened.close()
+
+    assert conversation.summary == "Greetings were exchanged."
+    assert conversation.summarized_count == 2
+    assert conversation.message_count == 3
+    assert [(seq, message.type, message.content) for seq, message in conversation.messages] == [
+        (2, "human", "how are you?")
+    ]
+
+
+def test_queued_writes_are_flushed_at_exit(tmp_path):
+    path = tmp_path / "history.db"
+    script = (
+        "import sys\n"
+        f"sys.path.insert(0, {str(ROOT)!r})\n"
+        "from langchain_core.messages import HumanMessage\n"
+        "from history_store import SQLiteHistoryBackend\n"
+        f"backend = SQLiteHistoryBackend({str(path)!r}, flush_interval=60)\n"
+        "backend.append('C1:U1', [(0, HumanMessage(content='last words'))])\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, timeout=30)
+
+    assert stored_rows(path) == [("C1:U1", 0, "last words")]
@@ -0,0 +1,192 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, List
+
+import pytest
+from langchain_core.caches import InMemoryCache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from rate_limiter import (  # noqa: E402
+    PRIORITY_BACKGROUND,
+    PRIORITY_DIRECT,
+    ProviderLimiter,
+    RateLimitedChatModel,
+    ServiceBusyError,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class UsageChatModel(BaseChatModel):
+    """Answers "ok" and reports 42 tokens, splitting the stream over three chunks"""
+
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "usage-fake"
+
+    def _generate(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None,
+                  **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        usage = {"input_tokens": 40, "output_tokens": 2, "total_tokens": 42}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok", usage_metadata=usage))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Any = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self.calls += 1
+        yield ChatGenerationChunk(message=AIMessageChunk(content="o"))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="k"))
+        usage = {"input_tokens": 40, "output_tokens": 2, "total_tokens": 42}
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.acquired = []
+        self.settled = []
+
+    def acquire(self, tokens, priority=None):
+        self.acquired.append(tokens)
+
+    async def aacquire(self, tokens, priority=None):
+        self.acquired.append(tokens)
+
+    def settle(self, estimated, actual):
+        self.settled.append((estimated, actual))
+
+
+class OneTokenPerMessage:
+    def count_message(self, message):
+        return 1
+
+
+def rate_limited(limiter, cache=None):
+    return RateLimitedChatModel(inner=UsageChatModel(), limiter=limiter, token_counter=OneTokenPerMessage(),
+                                completion_tokens=100, cache=cache)
+
+
+def wait_for_queue(limiter, depth):
+    deadline = time.monotonic() + 2
+    while limiter.metrics()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "caller never joined the queue"
+        time.sleep(0.001)
+
+
+def advance(limiter, clock, seconds):
+    with limiter._condition:
+        clock.now += seconds
+        limiter._condition.notify_all()
+
+
+def test_token_bucket_refills_at_rate_and_caps_at_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+
+    bucket.take(60)
+    assert bucket.wait_time(10) == pytest.approx(10)
+    clock.now += 4
+    assert bucket.wait_time(10) == pytest.approx(6)
+    # A request larger than the bucket waits only for a full bucket
+    assert bucket.wait_time(1000) == pytest.approx(56)
+
+    bucket.refund(500)
+    assert bucket.level == 60
+    clock.now += 600
+    assert bucket.wait_time(60) == 0.0
+
+
+def test_higher_priority_is_admitted_first():
+    clock = FakeClock()
+    limiter = ProviderLimiter("test", requests_per_minute=1, max_wait=1000, clock=clock)
+    limiter.acquire(1)
+    order = []
+
+    def call(name, priority):
+        limiter.acquire(1, priority)
+        order.append(name)
+
+    background = threading.Thread(target=call, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    wait_for_queue(limiter, 1)
+    direct = threading.Thread(target=call, args=("direct", PRIORITY_DIRECT))
+    direct.start()
+    wait_for_queue(limiter, 2)
+
+    advance(limiter, clock, 60)
+    direct.join(2)
+    assert order == ["direct"]
+
+    advance(limiter, clock, 60)
+    background.join(2)
+    assert order == ["direct", "background"]
+
+
+def test_full_queue_raises_service_busy():
+    clock = FakeClock()
+    limiter = ProviderLimiter("test", requests_per_minute=1, max_queue=1, max_wait=1000, clock=clock)
+    limiter.acquire(1)
+    waiter = threading.Thread(target=limiter.acquire, args=(1,))
+    waiter.start()
+    wait_for_queue(limiter, 1)
+
+    with pytest.raises(ServiceBusyError):
+        limiter.acquire(1)
+    assert limiter.metrics()["rejected_full"] == 1
+
+    advance(limiter, clock, 60)
+    waiter.join(2)
+    assert not waiter.is_alive()
+
+
+def test_wait_past_deadline_raises_service_busy():
+    limiter = ProviderLimiter("test", requests_per_minute=1, max_wait=0, clock=FakeClock())
+    limiter.acquire(1)
+
+    with pytest.raises(ServiceBusyError):
+        limiter.acquire(1)
+    with pytest.raises(ServiceBusyError):
+        asyncio.run(limiter.aacquire(1))
+
+    metrics = limiter.metrics()
+    assert metrics["rejected_timeout"] == 2
+    assert metrics["queue_depth"] == 0
+
+
+def test_cache_hits_skip_the_limiter():
+    limiter = RecordingLimiter()
+    model = rate_limited(limiter, cache=InMemoryCache())
+
+    assert model.invoke("hello").content == "ok"
+    assert model.invoke("hello").content == "ok"
+
+    assert model.inner.calls == 1
+    assert limiter.acquired == [101]
+    assert limiter.settled == [(101, 42)]
+
+
+def test_streams_settle_from_final_usage():
+    limiter = RecordingLimiter()
+    model = rate_limited(limiter)
+
+    assert "".join(chunk.content for chunk in model.stream("hello")) == "ok"
+
+    async def consume():
+        return "".join([chunk.content async for chunk in model.astream("hello")])
+
+    assert asyncio.run(consume()) == "ok"
+    assert limiter.settled == [(101, 42), (101, 42)]
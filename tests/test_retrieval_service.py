@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+from types import MappingProxyType
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flow_compiler import compile_flow  # noqa: E402
+from flow_manager import _freeze  # noqa: E402
+from retrieval_service import RetrievalService, SlackContext, request_scope  # noqa: E402
+
+
+class RecordingKnowledgeBase:
+    """Stands in for PineconeManager and records the scope of each query"""
+
+    def __init__(self):
+        self.calls = []
+
+    def query(self, text, top_k=3, query_embedding=None, namespace="", metadata_filter=None):
+        self.calls.append({"namespace": namespace, "metadata_filter": metadata_filter})
+        return []
+
+
+def compiled_rag_spec(data):
+    flow = _freeze({
+        "nodes": [{"id": "llm", "type": "llm", "data": {}}, {"id": "rag", "type": "rag", "data": data}],
+        "edges": [],
+    })
+    return compile_flow(flow).rag
+
+
+def test_compiled_filter_resolves_to_channel_id():
+    rag = compiled_rag_spec({"partition": "channel", "filter": {"channel": {"$in": ["{channel}", "all"]}}})
+    knowledge_base = RecordingKnowledgeBase()
+    retrieval = RetrievalService(knowledge_base, partition=rag.partition, metadata_filter=rag.metadata_filter)
+
+    with request_scope(SlackContext(team_id="T1", channel_id="C42", user_id="U7")):
+        retrieval.query("where is the runbook?")
+
+    call = knowledge_base.calls[0]
+    assert call["namespace"] == "channel-C42"
+    assert call["metadata_filter"] == {"channel": {"$in": ["C42", "all"]}}
+    # Plain JSON types, which Pinecone can serialize
+    assert type(call["metadata_filter"]) is dict
+    assert type(call["metadata_filter"]["channel"]["$in"]) is list
+
+
+def test_direct_message_searches_workspace_namespace():
+    knowledge_base = RecordingKnowledgeBase()
+    retrieval = RetrievalService(knowledge_base, partition="channel",
+                                 metadata_filter=MappingProxyType({"user": "{user}"}))
+
+    with request_scope(SlackContext(team_id="T1", channel_id="D1", user_id="U7", is_direct=True)):
+        retrieval.query("my notes")
+
+    assert knowledge_base.calls[0] == {"namespace": "team-T1", "metadata_filter": {"user": "U7"}}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tool Callbacks - Collects structured tool results for a single agent run
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger("tool_callbacks")
+
+
+@dataclass
+class ToolResult:
+    """One tool invocation observed during an agent run"""
+    name: str
+    input: str
+    output: Optional[str] = None
+    error: Optional[str] = None
+    return_direct: bool = False
+
+
+class ToolResultCollector(BaseCallbackHandler):
+    """Records every tool call of one request
+
+    Create a new collector per request and pass it in the invoke config, so
+    concurrent requests never see each other's results.
+    """
+
+    def __init__(self, tools: Iterable[Any] = ()):
+        self._return_direct = {tool.name for tool in tools if getattr(tool, "return_direct", False)}
+        self._running: Dict[UUID, ToolResult] = {}
+        self.results: List[ToolResult] = []
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._running[run_id] = ToolResult(name=name, input=input_str, return_direct=name in self._return_direct)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        result = self._running.pop(run_id, None)
+        if result is None:
+            return
+        # Newer langchain-core passes a ToolMessage rather than the raw string
+        result.output = output.content if hasattr(output, "content") else str(output)
+        self.results.append(result)
+        logger.debug(f"Tool {result.name} returned {len(result.output)} chars")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        result = self._running.pop(run_id, None)
+        if result is None:
+            return
+        result.error = str(error)
+        self.results.append(result)
+
+    def direct_result(self) -> Optional[ToolResult]:
+        """The last successful result of a return_direct tool, which is the run's answer"""
+        for result in reversed(self.results):
+            if result.return_direct and result.error is None:
+                return result
+        return None
@@ -9,6 +9,7 @@ from typing import Dict, List, Optional, Type, Any, Union, Annotated
 from uuid import uuid4
 import os
 import json
+import asyncio
 import datetime
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
@@ -72,7 +73,8 @@ class GoogleCalendarTool(GoogleCalendarToolBase):
 
     async def _arun(self, date: str, start_time: str, end_time: str, attendees: str, topic: str) -> str:
         """Async implementation of the tool."""
-        return self._run(date, start_time, end_time, attendees, topic)
+        # The Google API client is blocking, keep it off the event loop
+        return await asyncio.to_thread(self._run, date, start_time, end_time, attendees, topic)
 
 
 class CreateMeet:
@@ -147,7 +149,7 @@ class GoogleCalendarViewTool(GoogleCalendarToolBase):
     
     async def _arun(self, days: int = 7) -> str:
         """Async implementation of the tool."""
-        return self._run(days=days)
+        return await asyncio.to_thread(self._run, days=days)
 
 
 def auth_calendar():
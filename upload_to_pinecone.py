@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Upload files and directories to the Pinecone knowledge base
+
+Files are chunked, embedded in batches and upserted in batches. Progress is
+checkpointed, so an interrupted run picks up where it stopped and files that
+haven't changed since the last run are skipped.
+
+The index is the one the flow's rag node selects (Pinecone or the local
+index) unless --provider says otherwise. With a partitioned rag node, upload
+each workspace's or channel's documents with --workspace or --channel.
+
+Usage:
+    python upload_to_pinecone.py --file path/to/document.pdf
+    python upload_to_pinecone.py docs/ notes.md [--chunk-size 1000] [--workers 4]
+    python upload_to_pinecone.py docs/ --provider local --quantization int8
+    python upload_to_pinecone.py runbooks/ --channel C0123456789
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+from flow_compiler import RAG_PROVIDERS, RAG_QUANTIZATIONS, RAGSpec  # noqa: E402
+from flow_manager import FlowManager  # noqa: E402
+from ingestion import (DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY,  # noqa: E402
+                       DEFAULT_EMBED_BATCH_SIZE, DEFAULT_UPSERT_BATCH_SIZE, IngestCheckpoint, IngestionPipeline)
+from pinecone_manager import PineconeManager  # noqa: E402
+from retrieval_service import channel_namespace, workspace_namespace  # noqa: E402
+
+logger = logging.getLogger("upload_to_pinecone")
+
+
+def parse_metadata(pairs):
+    metadata = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Metadata must be key=value, got '{pair}'")
+        metadata[key] = value
+    return metadata
+
+
+def flow_rag_spec() -> RAGSpec:
+    """The rag node of the saved flow, or the defaults if it has none"""
+    try:
+        return FlowManager().get_agent_spec().rag or RAGSpec()
+    except Exception as e:
+        logger.warning(f"Could not read the flow, using the default index: {e}")
+        return RAGSpec()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload documents to the Pinecone knowledge base")
+    parser.add_argument("paths", nargs="*", help="Files or directories to upload")
+    parser.add_argument("--file", action="append", default=[], help="A file to upload (repeatable)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP,
+                        help="Characters shared by consecutive chunks")
+    parser.add_argument("--embed-batch-size", type=int, default=DEFAULT_EMBED_BATCH_SIZE,
+                        help="Chunks embedded per request")
+    parser.add_argument("--upsert-batch-size", type=int, default=DEFAULT_UPSERT_BATCH_SIZE,
+                        help="Vectors per upsert call")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Batches embedded and upserted at the same time")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes parsing files (default: CPU count, 0 parses in this process)")
+    parser.add_argument("--provider", choices=RAG_PROVIDERS, help="Index to upload to (default: the flow's)")
+    parser.add_argument("--index-name", help="Index name (default: the flow's)")
+    parser.add_argument("--index-path", help="Directory of the local index")
+    parser.add_argument("--quantization", choices=RAG_QUANTIZATIONS, help="Storage of a new local index")
+    partition = parser.add_mutually_exclusive_group()
+    partition.add_argument("--namespace", default="", help="Namespace to upload into (default: the shared one)")
+    partition.add_argument("--workspace", metavar="TEAM_ID", help="Upload into a Slack workspace's namespace")
+    partition.add_argument("--channel", metavar="CHANNEL_ID", help="Upload into a Slack channel's namespace")
+    parser.add_argument("--checkpoint", help="Progress file used to resume "
+                                             "(default: ingest_checkpoint.<provider>.<index>[.<namespace>].json)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and upload everything again")
+    parser.add_argument("--metadata", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="Metadata added to every chunk")
+    args = parser.parse_args()
+
+    paths = args.paths + args.file
+    if not paths:
+        parser.error("Give at least one file or directory")
+    metadata = parse_metadata(args.metadata)
+    if args.workspace:
+        namespace = workspace_namespace(args.workspace)
+    elif args.channel:
+        namespace = channel_namespace(args.channel)
+    else:
+        namespace = args.namespace
+
+    rag = flow_rag_spec()
+    provider = args.provider or rag.provider
+    if provider == "local":
+        pinecone_manager = PineconeManager(provider="local", index_name=args.index_name or rag.index_name,
+                                           local_path=args.index_path or rag.path,
+                                           quantization=args.quantization or rag.quantization)
+    else:
+        pinecone_manager = PineconeManager(index_name=args.index_name)
+    if not pinecone_manager.is_initialized():
+        logger.error("The vector index is not initialized. Check PINECONE_API_KEY and PINECONE_ENVIRONMENT, "
+                     "or the local index path.")
+        return 1
+
+    # One checkpoint per index and namespace, so uploading to another one doesn't skip everything
+    checkpoint_name = ".".join(filter(None, ["ingest_checkpoint", provider, pinecone_manager.index_name, namespace]))
+    checkpoint_path = Path(args.checkpoint or f"{checkpoint_name}.json")
+    if args.restart and checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+    pipeline = IngestionPipeline(
+        pinecone_manager,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+        workers=args.workers,
+        checkpoint=IngestCheckpoint(checkpoint_path),
+        metadata=metadata,
+        namespace=namespace,
+    )
+    stats = pipeline.run(paths)
+
+    target = f" into namespace {namespace}" if namespace else ""
+    logger.info(
+        f"Uploaded {stats.files} files{target} ({stats.vectors} chunks) in {stats.elapsed:.1f}s "
+        f"({stats.chunks_per_second:.1f} chunks/s); skipped {stats.skipped} unchanged, {stats.failed} failed"
+    )
+    for error in stats.errors:
+        logger.error(error)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Vector Store - A local, memory-mapped vector index with the same interface as a Pinecone index
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metadata_filter import filter_to_sql
+
+logger = logging.getLogger("vector_store")
+
+QUANTIZATIONS = ("float32", "int8")
+INITIAL_CAPACITY = 1024
+# int8 rows are widened to float32 this many at a time, so the copy stays in cache
+INT8_BLOCK_ROWS = 256
+# Rows of a namespace or filter are gathered from the matrix this many at a time
+SUBSET_BLOCK_ROWS = 1024
+
+# Like Pinecone, an id is unique within its namespace
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    namespace TEXT NOT NULL DEFAULT '',
+    id TEXT NOT NULL,
+    row INTEGER NOT NULL UNIQUE,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (namespace, id)
+)
+"""
+
+
+def default_index_dir(index_name: str) -> Path:
+    """Directory for a local index, under LOCAL_VECTOR_INDEX_DIR (default vector_index/ next to app.py)"""
+    base = os.environ.get("LOCAL_VECTOR_INDEX_DIR") or Path(__file__).parent / "vector_index"
+    return Path(base) / index_name
+
+
+class LocalVectorIndex:
+    """Exact cosine search over a memory-mapped matrix, persisted in a directory
+
+    Vectors are normalized on upsert, so a query is one matrix-vector
+    product plus an argpartition for the top k; with int8 quantization the
+    matrix takes a quarter of the space at a small cost in precision. IDs
+    and metadata live in SQLite next to the matrix, and upserting an
+    existing ID overwrites its row, like Pinecone. upsert() and query()
+    accept and return the same shapes as a Pinecone index, so
+    PineconeManager can use either.
+
+    Namespaces and metadata filters narrow the search before scoring: only
+    the rows of the namespace (tracked in memory) or those matching the
+    filter (selected in SQLite) are compared with the query. Deleted rows
+    are left in the matrix and reused by later upserts.
+    """
+
+    def __init__(self, path: Path, quantization: Optional[str] = None):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(str(self.path / "records.db"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._conn.execute(SCHEMA)
+
+        meta_path = self.path / "index.json"
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        # An existing index keeps the storage it was created with
+        if meta and quantization is not None and meta["quantization"] != quantization:
+            logger.warning(f"Index at {self.path} is {meta['quantization']}, ignoring requested {quantization}")
+        self.quantization = meta.get("quantization", quantization or "float32")
+        self.dimension: Optional[int] = meta.get("dimension")
+        self._capacity = meta.get("capacity", 0)
+
+        records = self._conn.execute("SELECT namespace, id, row FROM records").fetchall()
+        self._rows: Dict[Tuple[str, str], int] = {}
+        self._ids: List[Optional[str]] = [None] * (max((record[2] for record in records), default=-1) + 1)
+        self._namespace_rows: Dict[str, List[int]] = {}
+        for namespace, vector_id, row in sorted(records, key=lambda record: record[2]):
+            self._rows[namespace, vector_id] = row
+            self._ids[row] = vector_id
+            self._namespace_rows.setdefault(namespace, []).append(row)
+        # Rows of deleted vectors, reused before the matrix grows
+        self._free: List[int] = [row for row, vector_id in enumerate(self._ids) if vector_id is None]
+        self._namespace_arrays: Dict[str, np.ndarray] = {}
+        self._matrix = self._open_matrix() if self.dimension else None
+
+    def _migrate(self):
+        """Move records of an index created before namespaces into the default namespace"""
+        columns = {column[1] for column in self._conn.execute("PRAGMA table_info(records)")}
+        if columns and "namespace" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE records RENAME TO records_v1")
+                self._conn.execute(SCHEMA)
+                self._conn.execute("INSERT INTO records (namespace, id, row, metadata) "
+                                   "SELECT '', id, row, metadata FROM records_v1")
+                self._conn.execute("DROP TABLE records_v1")
+
+    @property
+    def _dtype(self):
+        return np.int8 if self.quantization == "int8" else np.float32
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _open_matrix(self, mode: str = "r+"):
+        return np.memmap(self.path / "vectors.bin", dtype=self._dtype, mode=mode,
+                         shape=(self._capacity, self.dimension))
+
+    def _save_meta(self):
+        meta = {"dimension": self.dimension, "quantization": self.quantization, "capacity": self._capacity}
+        temp = self.path / "index.json.tmp"
+        temp.write_text(json.dumps(meta))
+        os.replace(temp, self.path / "index.json")
+
+    def _reserve(self, rows: int):
+        """Grow the matrix file, doubling, so it holds at least rows vectors"""
+        if rows <= self._capacity:
+            return
+        capacity = max(self._capacity, INITIAL_CAPACITY)
+        while capacity < rows:
+            capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self.path / "vectors.bin", "ab") as f:
+            f.truncate(capacity * self.dimension * np.dtype(self._dtype).itemsize)
+        self._capacity = capacity
+        self._matrix = self._open_matrix()
+        self._save_meta()
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        if self.quantization == "int8":
+            return np.clip(np.rint(vectors * 127), -127, 127).astype(np.int8)
+        return vectors.astype(np.float32)
+
+    def upsert(self, vectors: Sequence[Dict[str, Any]], namespace: str = "", **kwargs) -> Dict[str, int]:
+        """Insert or overwrite {"id", "values", "metadata"} records in a namespace"""
+        if not vectors:
+            return {"upserted_count": 0}
+        values = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = values.shape[1]
+            if values.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {values.shape[1]} does not match "
+                                 f"index dimension {self.dimension}")
+
+            rows = []
+            for vector in vectors:
+                row = self._rows.get((namespace, vector["id"]))
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                        self._ids[row] = vector["id"]
+                    else:
+                        row = len(self._ids)
+                        self._ids.append(vector["id"])
+                    self._rows[namespace, vector["id"]] = row
+                    self._namespace_rows.setdefault(namespace, []).append(row)
+                    self._namespace_arrays.pop(namespace, None)
+                rows.append(row)
+            self._reserve(len(self._ids))
+            self._matrix[rows] = self._encode(values)
+            self._matrix.flush()
+
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records (namespace, id, row, metadata) VALUES (?, ?, ?, ?)",
+                    [(namespace, vector["id"], row, json.dumps(vector.get("metadata") or {}))
+                     for vector, row in zip(vectors, rows)]
+                )
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids: Sequence[str], namespace: str = "", **kwargs) -> Dict[str, Any]:
+        """Remove records of a namespace by id; unknown ids are ignored, like Pinecone"""
+        with self._lock:
+            rows = [self._rows.pop((namespace, vector_id)) for vector_id in ids if (namespace, vector_id) in self._rows]
+            if not rows:
+                return {}
+            removed = set(rows)
+            self._namespace_rows[namespace] = [row for row in self._namespace_rows[namespace] if row not in removed]
+            if not self._namespace_rows[namespace]:
+                del self._namespace_rows[namespace]
+            self._namespace_arrays.pop(namespace, None)
+            for row in rows:
+                self._ids[row] = None
+            self._free.extend(rows)
+            with self._conn:
+                self._conn.executemany("DELETE FROM records WHERE namespace = ? AND id = ?",
+                                       [(namespace, vector_id) for vector_id in ids])
+        return {}
+
+    def query(self, vector: Sequence[float], top_k: int = 3, include_metadata: bool = True,
+              namespace: str = "", filter: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        """Top k records of a namespace by cosine similarity, as {"matches": [{"id", "score", "metadata"}]}
+
+        filter takes Pinecone's metadata filter syntax (see metadata_filter).
+        """
+        with self._lock:
+            count = len(self._ids)
+            if not count or self._matrix is None:
+                return {"matches": []}
+            matrix = self._matrix[:count]
+            # A copy, so a delete or upsert after the lock is released cannot change the ids we return
+            ids = self._ids[:count]
+            rows = self._candidate_rows(namespace, filter, count)
+        if rows is not None and not len(rows):
+            return {"matches": []}
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self._scores(matrix, rows, query)
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        top_rows = top if rows is None else rows[top]
+
+        metadata = self._metadata(namespace, [ids[row] for row in top_rows]) if include_metadata else {}
+        return {"matches": [
+            {"id": ids[row], "score": float(scores[position]), "metadata": metadata.get(ids[row])}
+            for position, row in zip(top, top_rows)
+        ]}
+
+    def _candidate_rows(self, namespace: str, metadata_filter: Optional[Dict[str, Any]],
+                        count: int) -> Optional[np.ndarray]:
+        """Rows a query has to score, or None for all of them"""
+        if metadata_filter:
+            clause, params = filter_to_sql(metadata_filter)
+            selected = self._conn.execute(
+                f"SELECT row FROM records WHERE namespace = ? AND {clause} ORDER BY row", [namespace, *params]
+            )
+            return np.fromiter((row for row, in selected), dtype=np.int64)
+
+        namespace_rows = self._namespace_rows.get(namespace, ())
+        if len(namespace_rows) == count:
+            # The only namespace: scan the matrix without gathering rows
+            return None
+        if namespace not in self._namespace_arrays:
+            self._namespace_arrays[namespace] = np.asarray(namespace_rows, dtype=np.int64)
+        return self._namespace_arrays[namespace]
+
+    def _scores(self, matrix: np.ndarray, rows: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        """Dot products of the query with every row, or with the given rows"""
+        total = len(matrix) if rows is None else len(rows)
+        if rows is None and self.quantization != "int8":
+            return matrix @ query
+
+        block_rows = INT8_BLOCK_ROWS if rows is None else SUBSET_BLOCK_ROWS
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, block_rows):
+            block = matrix[start:start + block_rows] if rows is None else matrix[rows[start:start + block_rows]]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+        if self.quantization == "int8":
+            scores /= 127
+        return scores
+
+    def _metadata(self, namespace: str, ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, metadata FROM records WHERE namespace = ? AND id IN ({placeholders})", [namespace, *ids]
+            )
+            return {vector_id: json.loads(metadata) for vector_id, metadata in rows}
+
+    def describe_index_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            namespaces = {namespace: {"vector_count": len(rows)} for namespace, rows in self._namespace_rows.items()}
+        return {"dimension": self.dimension, "total_vector_count": len(self), "namespaces": namespaces,
+                "quantization": self.quantization}
+
+    def close(self):
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            self._conn.close()